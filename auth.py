@@ -1,8 +1,15 @@
 import os
 import hashlib
+import hmac
+import secrets
+import time
 import bcrypt
 from fastapi import Header, HTTPException, Depends
 
+from cache import LocalCache, UserCache
+from metrics import BCRYPT_VERIFY_DURATION
+from request_stats import phase
+from tracing import current_span, span
 from repositories import get_user_repository
 from repositories.protocols import UserEntity
 
@@ -14,6 +21,17 @@ if not _salt:
     )
 PASSWORD_SALT = _salt.encode()
 
+# Seconds a successful password check is remembered, sparing a bcrypt round
+# on every request. 0 checks every request. Kept inside the process and keyed
+# with a secret that never leaves it, so a shared cache never holds anything
+# derived from credentials.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+auth_cache = UserCache(LocalCache(), "auth", AUTH_CACHE_TTL)
+_AUTH_CACHE_KEY = secrets.token_bytes(32)
+
+# Token for the /admin endpoints, sent as x-admin-token. Unset disables them.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 
 def md5_hash(password: str) -> str:
     """Convert raw password to MD5 hash."""
@@ -23,15 +41,38 @@ def md5_hash(password: str) -> str:
 def hash_password(password_md5: str) -> str:
     """Hash an MD5 password for storage using bcrypt."""
     salted = PASSWORD_SALT + password_md5.encode()
-    # bcrypt has a max input length of 72 bytes
-    return bcrypt.hashpw(salted[:72], bcrypt.gensalt()).decode()
+    with span("bcrypt.hashpw"):
+        # bcrypt has a max input length of 72 bytes
+        return bcrypt.hashpw(salted[:72], bcrypt.gensalt()).decode()
 
 
 def verify_password(password_md5: str, password_hash: str) -> bool:
     """Verify MD5 password against stored bcrypt hash."""
     salted = PASSWORD_SALT + password_md5.encode()
-    # bcrypt has a max input length of 72 bytes
-    return bcrypt.checkpw(salted[:72], password_hash.encode())
+    start = time.perf_counter()
+    try:
+        with span("bcrypt.checkpw"):
+            # bcrypt has a max input length of 72 bytes
+            return bcrypt.checkpw(salted[:72], password_hash.encode())
+    finally:
+        BCRYPT_VERIFY_DURATION.observe(time.perf_counter() - start)
+
+
+def verify_user_password(user: UserEntity, password_md5: str) -> bool:
+    """verify_password, remembering successful checks in the auth cache."""
+    if AUTH_CACHE_TTL <= 0:
+        return verify_password(password_md5, user.password_hash)
+    # Keyed on the stored hash too, so a password change never matches an old entry
+    key = hmac.new(_AUTH_CACHE_KEY, f"{user.password_hash}:{password_md5}".encode(), hashlib.sha256).hexdigest()
+    cached = auth_cache.get(user.id, key)
+    if (trace := current_span()) is not None:
+        trace.set_attribute("auth.cached", bool(cached))
+    if cached:
+        return True
+    if not verify_password(password_md5, user.password_hash):
+        return False
+    auth_cache.set(user.id, key, True)
+    return True
 
 
 def get_current_user(
@@ -43,11 +84,21 @@ def get_current_user(
     if not x_auth_user or not x_auth_key:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    user = user_repo.get_by_username(x_auth_user)
-    if not user:
-        raise HTTPException(status_code=401, detail="Unauthorized")
+    with phase("auth"), span("get_current_user"):
+        user = user_repo.get_by_username(x_auth_user)
+        if not user:
+            raise HTTPException(status_code=401, detail="Unauthorized")
 
-    if not verify_password(x_auth_key, user.password_hash):
-        raise HTTPException(status_code=401, detail="Unauthorized")
+        if not verify_user_password(user, x_auth_key):
+            raise HTTPException(status_code=401, detail="Unauthorized")
 
     return user
+
+
+def require_admin(x_admin_token: str = Header(None)) -> None:
+    """Dependency guarding the /admin endpoints."""
+    if not ADMIN_TOKEN:
+        # Without a configured token the admin endpoints do not exist
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
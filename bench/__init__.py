@@ -0,0 +1,9 @@
+"""Performance tooling. Not imported by the server.
+
+load      - load test simulating KOReader readers against the app, in-process or over HTTP
+micro     - micro-benchmarks of repository methods and hot spots, with baseline comparison
+dataset   - synthetic datasets with Zipf-distributed library sizes, bulk-loaded into a backend
+scale     - endpoint latencies against budgets on a loaded dataset, by library size
+replay    - replay of traffic captured by the server (CAPTURE_FILE), comparing builds
+coldstart - Lambda cold starts: import time and RSS per module, init and first request
+"""
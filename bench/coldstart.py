@@ -0,0 +1,244 @@
+"""Lambda cold-start measurement: import costs, init and first request.
+
+Every measurement runs in a fresh interpreter, as a new Lambda execution
+environment would:
+
+  - each module in --modules is imported on its own, recording the import
+    time and RSS growth it costs including its dependencies;
+  - lambda_handler is imported under -X importtime, listing the modules
+    with the most import time of their own;
+  - cold starts import lambda_handler, which primes the DynamoDB connection
+    unless LAMBDA_PRIME=false, then invoke the handler twice with a Function
+    URL event. Both settings are measured, --runs times each.
+
+Peak RSS and init plus first request time are checked against memory_size
+and timeout in terraform/lambda.tf. The request goes to --path, by default
+GET /users/auth for a user that does not exist: one read of the users table
+without creating anything.
+
+    python -m bench.coldstart --dynamodb-endpoint http://localhost:8000
+    python -m bench.coldstart --backend memory --runs 5 --output coldstart.json
+
+Times are those of this machine; Lambda at 256 MB gets a fraction of a vCPU,
+so compare runs with each other rather than with Lambda's own durations.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional
+
+from bench.load import configure_backend
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = (
+    "fastapi", "pydantic", "mangum", "slowapi", "bcrypt", "boto3",
+    "schemas", "auth", "svg_card", "repositories", "repositories.dynamodb", "main", "lambda_handler",
+)
+
+# Run in the child interpreters; print one JSON document
+_RSS = """
+import os, resource, sys
+def rss_mb():
+    # Current RSS where /proc is available, as on Lambda; the peak elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+"""
+_IMPORT = _RSS + """
+import importlib, json, time
+before = rss_mb()
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(json.dumps({"import_ms": (time.perf_counter() - start) * 1000, "rss_mb": rss_mb(), "rss_delta_mb": rss_mb() - before}))
+"""
+_COLD_START = _RSS + """
+import json, time
+start = time.perf_counter()
+import lambda_handler
+imported = time.perf_counter()
+event = json.loads(sys.argv[1])
+timings = []
+for _ in range(2):
+    started = time.perf_counter()
+    response = lambda_handler.handler(event, None)
+    timings.append((time.perf_counter() - started) * 1000)
+print(json.dumps({
+    "init_ms": (imported - start) * 1000,
+    "prime_ms": lambda_handler._primed_ms,
+    "first_request_ms": timings[0],
+    "second_request_ms": timings[1],
+    "status": response["statusCode"],
+    "max_rss_mb": max_rss_mb(),
+}))
+"""
+
+
+def _child(code: str, *args: str, env: Optional[dict] = None, python_args: tuple = ()) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *python_args, "-c", code, *args],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def function_url_event(path: str, headers: Optional[dict[str, str]] = None, method: str = "GET") -> dict:
+    """A Lambda Function URL (payload format 2.0) request under the /reader prefix."""
+    raw_path = "/reader" + path
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": raw_path,
+        "rawQueryString": "",
+        "headers": {"host": "coldstart.lambda-url.localhost", "accept": "application/json", **(headers or {})},
+        "requestContext": {
+            "accountId": "anonymous",
+            "apiId": "coldstart",
+            "domainName": "coldstart.lambda-url.localhost",
+            "domainPrefix": "coldstart",
+            "http": {"method": method, "path": raw_path, "protocol": "HTTP/1.1", "sourceIp": "127.0.0.1",
+                     "userAgent": "bench.coldstart"},
+            "requestId": "coldstart",
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime()),
+            "timeEpoch": int(time.time() * 1000),
+        },
+        "isBase64Encoded": False,
+    }
+
+
+def lambda_limits(path: str = os.path.join(PROJECT_ROOT, "terraform", "lambda.tf")) -> dict:
+    """memory_size (MB) and timeout (s) of the Lambda function."""
+    with open(path, encoding="utf-8") as f:
+        config = f.read()
+    return {
+        "memory_mb": int(re.search(r"^\s*memory_size\s*=\s*(\d+)", config, re.M).group(1)),
+        "timeout_s": int(re.search(r"^\s*timeout\s*=\s*(\d+)", config, re.M).group(1)),
+    }
+
+
+def measure_imports(modules: tuple[str, ...], env: dict) -> list[dict]:
+    """Import time and RSS of each module, each in a fresh interpreter."""
+    return [{"module": module, **json.loads(_child(_IMPORT, module, env=env).stdout)} for module in modules]
+
+
+def heaviest_imports(env: dict, top: int = 15) -> list[dict]:
+    """Modules with the most import time of their own when lambda_handler is imported."""
+    output = _child("import lambda_handler", env=env, python_args=("-X", "importtime")).stderr
+    rows = []
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match:
+            rows.append({"module": match.group(4), "self_ms": int(match.group(1)) / 1000,
+                         "cumulative_ms": int(match.group(2)) / 1000})
+    return sorted(rows, key=lambda row: row["self_ms"], reverse=True)[:top]
+
+
+def measure_cold_start(env: dict, event: dict, prime: bool) -> dict:
+    env = {**env, "LAMBDA_PRIME": "true" if prime else "false"}
+    start = time.perf_counter()
+    result = json.loads(_child(_COLD_START, json.dumps(event), env=env).stdout)
+    # Includes starting the interpreter, which Lambda does before the init phase too
+    result["process_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def summarize(runs: list[dict]) -> dict:
+    """Median of each timing over the runs, and the peak RSS."""
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 1)
+        for key in ("process_ms", "init_ms", "first_request_ms", "second_request_ms")
+    }
+    primes = [run["prime_ms"] for run in runs if run["prime_ms"] is not None]
+    summary["prime_ms"] = round(statistics.median(primes), 1) if primes else None
+    summary["max_rss_mb"] = round(max(run["max_rss_mb"] for run in runs), 1)
+    summary["statuses"] = sorted({run["status"] for run in runs})
+    return summary
+
+
+def check_limits(cold_starts: dict[str, dict], limits: dict) -> list[str]:
+    problems = []
+    for mode, summary in cold_starts.items():
+        if summary["max_rss_mb"] > limits["memory_mb"]:
+            problems.append(f"{mode}: peak RSS {summary['max_rss_mb']} MB over memory_size {limits['memory_mb']} MB")
+        seconds = (summary["init_ms"] + summary["first_request_ms"]) / 1000
+        if seconds > limits["timeout_s"]:
+            problems.append(f"{mode}: init and first request took {seconds:.1f}s, over timeout {limits['timeout_s']}s")
+    return problems
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{'module':<24} {'import ms':>10} {'RSS MB':>8} {'+RSS MB':>8}"]
+    lines.extend(
+        f"{row['module']:<24} {row['import_ms']:>10.1f} {row['rss_mb']:>8.1f} {row['rss_delta_mb']:>8.1f}"
+        for row in report["imports"]
+    )
+    lines.append("")
+    lines.append(f"{'heaviest own import time':<40} {'self ms':>8} {'cum. ms':>8}")
+    lines.extend(
+        f"{row['module']:<40} {row['self_ms']:>8.1f} {row['cumulative_ms']:>8.1f}" for row in report["heaviest_imports"]
+    )
+    lines.append("")
+    limits = report["limits"]
+    lines.append(
+        f"{'cold start (median)':<20} {'process':>8} {'init':>8} {'prime':>8} {'1st req':>8} {'2nd req':>8} "
+        f"{'RSS MB':>8}   limits: {limits['memory_mb']} MB, {limits['timeout_s']} s"
+    )
+    for mode, summary in report["cold_starts"].items():
+        prime = f"{summary['prime_ms']:.1f}" if summary["prime_ms"] is not None else "-"
+        lines.append(
+            f"{mode:<20} {summary['process_ms']:>8.1f} {summary['init_ms']:>8.1f} {prime:>8} "
+            f"{summary['first_request_ms']:>8.1f} {summary['second_request_ms']:>8.1f} {summary['max_rss_mb']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("dynamodb", "memory"), default="dynamodb")
+    parser.add_argument("--dynamodb-endpoint", default="http://localhost:8000", help="DynamoDB Local endpoint")
+    parser.add_argument("--path", default="/users/auth", help="Route requested by the cold starts")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="Modules whose import cost is measured")
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts per LAMBDA_PRIME setting")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    configure_backend(args.backend, dynamodb_endpoint=args.dynamodb_endpoint)
+    env = dict(os.environ)
+    # As deployed: rate limits on
+    env.pop("RATE_LIMIT_ENABLED", None)
+    event = function_url_event(args.path, {"x-auth-user": "coldstart-nobody", "x-auth-key": "0" * 32})
+
+    report = {
+        "backend": args.backend,
+        "path": args.path,
+        "limits": lambda_limits(),
+        "imports": measure_imports(tuple(args.modules.split(",")), env),
+        "heaviest_imports": heaviest_imports(env),
+        "cold_starts": {
+            mode: summarize([measure_cold_start(env, event, prime) for _ in range(args.runs)])
+            for mode, prime in (("primed", True), ("unprimed", False))
+        },
+    }
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    problems = check_limits(report["cold_starts"], report["limits"])
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
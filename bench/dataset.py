@@ -0,0 +1,353 @@
+"""Synthetic large-library datasets, bulk-loaded straight into a backend.
+
+Library sizes follow Zipf's law over the users: the user at rank r (index
+r - 1) holds about max_books / r**zipf_s books, so user 0 has the largest
+library, a handful of users have thousands of books and the long tail has a
+few each. For every book a user has:
+
+  - one progress record under its canonical hash, last pushed by one of the
+    user's 1-4 devices at some point over the past year;
+  - with probability edition_rate, a second edition with the same filename,
+    linked to the first as auto-linking would have done, plus an entry in the
+    filename index;
+  - with probability label_rate, a label.
+
+Each user's library is derived from the seed and the user's index alone, so
+a user can be regenerated without the rest of the dataset (bench.scale uses
+this to find its users and documents), and `Library.unseen_edition` gives a
+new hash under a known filename, which auto-links when it is pushed.
+
+Loading skips the repositories: rows go to SQL through multi-row INSERTs in
+large transactions, to DynamoDB through batch writes, and to the memory
+backend as store records. Every user gets the same password (one bcrypt
+hash), `password` in the config, hashed with the server's PASSWORD_SALT.
+
+    python -m bench.dataset --database-url sqlite:///./data/scale.db --users 1000000 --max-books 20000
+    python -m bench.dataset --backend dynamodb --dynamodb-endpoint http://localhost:8000 --users 10000
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from filename_match import normalize_filename
+
+DEVICES = ("Kindle Paperwhite", "Kobo Libra", "Android Phone", "iPad")
+# Rows per INSERT batch or transaction when loading into SQL
+_SQL_BATCH = 20_000
+_YEAR = 365 * 24 * 3600
+
+
+@dataclass
+class DatasetConfig:
+    users: int = 1000
+    # Books of the largest library (user 0)
+    max_books: int = 20_000
+    zipf_s: float = 1.1
+    edition_rate: float = 0.1
+    label_rate: float = 0.05
+    seed: int = 1
+    prefix: str = "scale"
+    password: str = "scale-password"
+
+    @property
+    def password_md5(self) -> str:
+        return hashlib.md5(self.password.encode()).hexdigest()
+
+    def library_size(self, index: int) -> int:
+        return max(1, int(self.max_books / (index + 1) ** self.zipf_s))
+
+    def username(self, index: int) -> str:
+        return f"{self.prefix}-{index}"
+
+
+def _hash(*parts) -> str:
+    return hashlib.md5(":".join(map(str, parts)).encode()).hexdigest()
+
+
+@dataclass
+class Book:
+    canonical_hash: str
+    filename: str
+    progress: str
+    percentage: float
+    device: str
+    device_id: str
+    timestamp: int
+    edition_hash: Optional[str] = None
+    label: Optional[str] = None
+
+
+@dataclass
+class Library:
+    """One generated user and their books."""
+    index: int
+    username: str
+    books: list[Book] = field(default_factory=list)
+
+    def unseen_edition(self, book: int) -> str:
+        """A hash not in the dataset, for a new edition of the given book."""
+        return _hash(self.username, "book", book, "unseen")
+
+
+def generate_library(config: DatasetConfig, index: int, now: Optional[int] = None) -> Library:
+    """The library of user `index`; the same for a given config, whatever else is generated."""
+    rng = random.Random(f"{config.seed}:{index}")
+    now = now or int(time.time())
+    username = config.username(index)
+    devices = [
+        (name, _hash(username, "device", name)[:16])
+        for name in rng.sample(DEVICES, rng.randint(1, len(DEVICES)))
+    ]
+    library = Library(index, username)
+    for book in range(config.library_size(index)):
+        device, device_id = rng.choice(devices)
+        percentage = round(rng.random(), 4)
+        library.books.append(Book(
+            canonical_hash=_hash(username, "book", book),
+            filename=f"Book {book} - Author {rng.randint(1, 5000)}.epub",
+            progress=f"/body/DocFragment[{int(percentage * 40) + 1}]/body/p[{rng.randint(1, 60)}]",
+            percentage=percentage,
+            device=device,
+            device_id=device_id,
+            # Recent books are read more, so timestamps cluster near now
+            timestamp=now - min(_YEAR, int(rng.expovariate(1 / (_YEAR / 8)))),
+            edition_hash=_hash(username, "book", book, "edition") if rng.random() < config.edition_rate else None,
+            label=f"Shelf {rng.randint(1, 20)}" if rng.random() < config.label_rate else None,
+        ))
+    return library
+
+
+def generate(config: DatasetConfig) -> Iterator[Library]:
+    now = int(time.time())
+    for index in range(config.users):
+        yield generate_library(config, index, now)
+
+
+def _password_hash(config: DatasetConfig) -> str:
+    from auth import hash_password
+    return hash_password(config.password_md5)
+
+
+class SQLLoader:
+    """Multi-row INSERTs into the SQL tables, committed every _SQL_BATCH rows.
+
+    User ids are assigned by the database, so sequences (PostgreSQL) stay in
+    step with the rows and the server can register users afterwards.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def load(self, config: DatasetConfig, libraries: Iterator[Library]) -> dict[str, int]:
+        from sqlalchemy import insert, select
+        from models import User, Progress, DocumentLink, FilenameIndex, BookLabel
+
+        password_hash = _password_hash(config)
+        counts = dict.fromkeys(("users", "progress", "document_links", "filename_index", "book_labels"), 0)
+        batch: list[Library] = []
+
+        def flush():
+            if not batch:
+                return
+            with self.engine.begin() as connection:
+                connection.execute(insert(User), [
+                    {"username": library.username, "password_hash": password_hash} for library in batch
+                ])
+                counts["users"] += len(batch)
+                user_ids = dict(connection.execute(
+                    select(User.username, User.id).where(User.username.in_([library.username for library in batch]))
+                ).all())
+                rows: dict = {model: [] for model in (Progress, DocumentLink, FilenameIndex, BookLabel)}
+                for library in batch:
+                    user_id = user_ids[library.username]
+                    for book in library.books:
+                        rows[Progress].append({
+                            "user_id": user_id, "document": book.canonical_hash, "progress": book.progress,
+                            "percentage": book.percentage, "device": book.device, "device_id": book.device_id,
+                            "timestamp": book.timestamp, "filename": book.filename,
+                        })
+                        if book.edition_hash:
+                            rows[DocumentLink].append({
+                                "user_id": user_id, "document_hash": book.edition_hash,
+                                "canonical_hash": book.canonical_hash, "timestamp": book.timestamp,
+                            })
+                            rows[FilenameIndex].append({
+                                "user_id": user_id, "filename": normalize_filename(book.filename),
+                                "canonical_hash": book.canonical_hash,
+                            })
+                        if book.label:
+                            rows[BookLabel].append({
+                                "user_id": user_id, "canonical_hash": book.canonical_hash,
+                                "label": book.label, "timestamp": book.timestamp,
+                            })
+                for model, model_rows in rows.items():
+                    if model_rows:
+                        connection.execute(insert(model), model_rows)
+                        counts[model.__tablename__] += len(model_rows)
+            batch.clear()
+
+        pending_rows = 0
+        for library in libraries:
+            batch.append(library)
+            pending_rows += 1 + len(library.books)
+            if pending_rows >= _SQL_BATCH:
+                flush()
+                pending_rows = 0
+        flush()
+        return counts
+
+
+class DynamoLoader:
+    """Batch writes (25 items per request) into the DynamoDB tables."""
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    def load(self, config: DatasetConfig, libraries: Iterator[Library]) -> dict[str, int]:
+        from repositories.dynamodb import _progress_to_item
+        from repositories.protocols import ProgressEntity
+
+        def table(variable: str, default: str):
+            return self.dynamodb.Table(os.getenv(variable, default))
+
+        password_hash = _password_hash(config)
+        counts = dict.fromkeys(("users", "progress", "document_links", "filename_index", "book_labels"), 0)
+        with table("DYNAMODB_USERS_TABLE", "reader-progress-users").batch_writer() as users, \
+                table("DYNAMODB_PROGRESS_TABLE", "reader-progress-progress").batch_writer() as progress, \
+                table("DYNAMODB_DOCUMENT_LINKS_TABLE", "reader-progress-document-links").batch_writer() as links, \
+                table("DYNAMODB_FILENAME_INDEX_TABLE", "reader-progress-filename-index").batch_writer() as filenames, \
+                table("DYNAMODB_BOOK_LABELS_TABLE", "reader-progress-book-labels").batch_writer() as labels:
+            for library in libraries:
+                # The username is the user id in DynamoDB
+                user_id = library.username
+                users.put_item(Item={"username": user_id, "password_hash": password_hash})
+                counts["users"] += 1
+                for book in library.books:
+                    progress.put_item(Item=_progress_to_item(ProgressEntity(
+                        user_id=user_id, document=book.canonical_hash, progress=book.progress,
+                        percentage=book.percentage, device=book.device, device_id=book.device_id,
+                        timestamp=book.timestamp, filename=book.filename,
+                    )))
+                    counts["progress"] += 1
+                    if book.edition_hash:
+                        links.put_item(Item={
+                            "user_id": user_id, "document_hash": book.edition_hash,
+                            "canonical_hash": book.canonical_hash, "timestamp": book.timestamp,
+                        })
+                        filenames.put_item(Item={
+                            "user_id": user_id, "filename": normalize_filename(book.filename),
+                            "canonical_hash": book.canonical_hash,
+                        })
+                        counts["document_links"] += 1
+                        counts["filename_index"] += 1
+                    if book.label:
+                        labels.put_item(Item={
+                            "user_id": user_id, "canonical_hash": book.canonical_hash,
+                            "label": book.label, "timestamp": book.timestamp,
+                        })
+                        counts["book_labels"] += 1
+        return counts
+
+
+class MemoryLoader:
+    """Records written to the memory store, one journal line per user."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def load(self, config: DatasetConfig, libraries: Iterator[Library]) -> dict[str, int]:
+        password_hash = _password_hash(config)
+        counts = dict.fromkeys(("users", "progress", "document_links", "filename_index", "book_labels"), 0)
+        for library in libraries:
+            with self.store.lock:
+                user_id = str(self.store.next_user_id)
+                records = [("user", {"id": user_id, "username": library.username, "password_hash": password_hash})]
+                for book in library.books:
+                    records.append(("progress", {
+                        "user_id": user_id, "document": book.canonical_hash, "progress": book.progress,
+                        "percentage": book.percentage, "device": book.device, "device_id": book.device_id,
+                        "timestamp": book.timestamp, "filename": book.filename,
+                    }))
+                    if book.edition_hash:
+                        records.append(("link", {
+                            "user_id": user_id, "document_hash": book.edition_hash,
+                            "canonical_hash": book.canonical_hash, "timestamp": book.timestamp,
+                        }))
+                        records.append(("filename", {
+                            "user_id": user_id, "filename": normalize_filename(book.filename),
+                            "canonical_hash": book.canonical_hash,
+                        }))
+                    if book.label:
+                        records.append(("label", {
+                            "user_id": user_id, "canonical_hash": book.canonical_hash,
+                            "label": book.label, "timestamp": book.timestamp,
+                        }))
+                self.store.write(*records)
+            counts["users"] += 1
+            for op, table in (("progress", "progress"), ("link", "document_links"),
+                              ("filename", "filename_index"), ("label", "book_labels")):
+                counts[table] += sum(1 for record_op, _ in records if record_op == op)
+        return counts
+
+
+def loader_for(backend: str):
+    """Loader for the backend the app is configured with."""
+    if backend == "dynamodb":
+        from repositories.dynamodb import get_dynamodb_resource
+        return DynamoLoader(get_dynamodb_resource())
+    if backend == "memory":
+        from repositories.memory import get_memory_store
+        return MemoryLoader(get_memory_store())
+    from database import engine, init_db
+    init_db()
+    return SQLLoader(engine)
+
+
+def load(config: DatasetConfig, backend: str) -> dict[str, int]:
+    """Generate the dataset and load it into the backend; returns rows written per table."""
+    return loader_for(backend).load(config, generate(config))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from bench.load import configure_backend
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("sqlite", "postgres", "dynamodb", "memory"), default="sqlite")
+    parser.add_argument("--database-url", help="SQLAlchemy URL for sqlite/postgres (default: a fresh SQLite file)")
+    parser.add_argument("--dynamodb-endpoint", default="http://localhost:8000", help="DynamoDB Local endpoint")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--max-books", type=int, default=20_000, help="Books of the largest library")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent of library sizes")
+    parser.add_argument("--edition-rate", type=float, default=0.1, help="Share of books with a linked second edition")
+    parser.add_argument("--label-rate", type=float, default=0.05, help="Share of books with a label")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--prefix", default="scale", help="Prefix of the generated usernames")
+    args = parser.parse_args(argv)
+
+    # Bulk inserts are slow statements by design
+    os.environ.setdefault("SLOW_QUERY_MS", "-1")
+    configure_backend(args.backend, args.database_url, args.dynamodb_endpoint)
+    config = DatasetConfig(
+        users=args.users, max_books=args.max_books, zipf_s=args.zipf_s, edition_rate=args.edition_rate,
+        label_rate=args.label_rate, seed=args.seed, prefix=args.prefix,
+    )
+    started = time.perf_counter()
+    counts = load(config, os.environ["DB_BACKEND"])
+    elapsed = time.perf_counter() - started
+    rows = sum(counts.values())
+    for table, count in counts.items():
+        print(f"{table:<16} {count:>12}")
+    print(f"{rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+    if args.backend == "sqlite" and not args.database_url:
+        print(f"DATABASE_URL={os.environ['DATABASE_URL']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""Load test speaking the KOReader sync protocol.
+
+Simulates readers, each with a few devices and a shelf of books, going
+through the flows the KOReader plugin produces: register once, then reading
+sessions that authenticate, pull the progress of the book being opened and
+push progress on page turns, with the occasional link between two editions,
+book list and card fetch. Readers mostly return to their first books, like
+real libraries.
+
+Flows are drawn from a seeded random generator per simulated client, so two
+runs with the same options send the same requests. Registration (one bcrypt
+hash per user) is reported separately from the measured phase.
+
+The app runs in-process through an ASGI transport by default, on a fresh
+SQLite file, PostgreSQL (--database-url), DynamoDB Local (--dynamodb-endpoint,
+tables are created if missing) or the memory backend. With --url, a running
+server is tested over HTTP instead; it needs RATE_LIMIT_ENABLED=false.
+
+    python -m bench.load --users 200 --sessions 5
+    python -m bench.load --backend postgres --database-url postgresql://localhost/kosync
+    python -m bench.load --backend dynamodb --dynamodb-endpoint http://localhost:8000
+    python -m bench.load --url http://localhost:8080 --duration 60 --output report.json
+
+The report gives the throughput and p50/p95/p99 latency per endpoint;
+--output also writes it as JSON for comparing runs.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+import httpx
+
+BACKENDS = ("sqlite", "postgres", "dynamodb", "memory")
+
+# Page turns pushed per reading session
+PAGE_TURNS = (3, 12)
+# Chance per session of each secondary flow
+LINK_RATE = 0.1
+LIST_BOOKS_RATE = 0.2
+CARD_RATE = 0.05
+
+
+@dataclass
+class LoadConfig:
+    users: int = 100
+    devices: int = 2
+    books: int = 20
+    concurrency: int = 50
+    # Sessions per user, unless a duration in seconds is given
+    sessions: int = 5
+    duration: Optional[float] = None
+    # Seconds between page turns
+    think_time: float = 0.0
+    seed: int = 1
+    prefix: str = "bench"
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(1, math.ceil(len(sorted_values) * fraction)) - 1]
+
+
+class Recorder:
+    """Latencies and failures per endpoint."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    @staticmethod
+    def _summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+        ordered = sorted(latencies)
+        return {
+            "count": len(ordered),
+            "errors": errors,
+            "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed > 0 else 0.0,
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        }
+
+    def summary(self, elapsed: float) -> dict:
+        every = [seconds for latencies in self.latencies.values() for seconds in latencies]
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "total": self._summary(every, sum(self.errors.values()), elapsed),
+            "endpoints": {
+                endpoint: self._summary(latencies, self.errors[endpoint], elapsed)
+                for endpoint, latencies in sorted(self.latencies.items())
+            },
+        }
+
+
+async def _call(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, expected: tuple[int, ...], **kwargs):
+    """Send one request, recording it under the endpoint's route template."""
+    method, _ = endpoint.split(" ", 1)
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, **kwargs)
+    except httpx.HTTPError:
+        recorder.record(endpoint, time.perf_counter() - start, False)
+        return None
+    recorder.record(endpoint, time.perf_counter() - start, response.status_code in expected)
+    return response
+
+
+def _document_hash(*parts) -> str:
+    return hashlib.md5(":".join(map(str, parts)).encode()).hexdigest()
+
+
+@dataclass
+class Reader:
+    """One simulated user with their devices, books and reading positions."""
+    username: str
+    books: int
+    devices: list[tuple[str, str]]
+    positions: dict[int, float] = field(default_factory=dict)
+    linked: set[int] = field(default_factory=set)
+
+    @classmethod
+    def create(cls, config: LoadConfig, index: int) -> "Reader":
+        username = f"{config.prefix}-{config.seed}-{index}"
+        devices = [(f"Device {n}", _document_hash(username, "device", n)[:16]) for n in range(config.devices)]
+        return cls(username, config.books, devices)
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"x-auth-user": self.username, "x-auth-key": _document_hash(self.username, "password")}
+
+    def _book(self, rng: random.Random) -> int:
+        # Readers mostly go back to the same few books
+        return rng.choices(range(self.books), weights=[1 / (n + 1) for n in range(self.books)])[0]
+
+    async def register(self, client: httpx.AsyncClient, recorder: Recorder) -> None:
+        # 402 when the user exists from an earlier run with the same prefix and seed
+        await _call(
+            client, recorder, "POST /users/create", (201, 402),
+            url="/users/create", json={"username": self.username, "password": self.headers["x-auth-key"]},
+        )
+
+    async def session(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random, think_time: float):
+        """Open a book on one device, read a few pages, then maybe browse."""
+        device, device_id = rng.choice(self.devices)
+        headers = self.headers
+        await _call(client, recorder, "GET /users/auth", (200,), url="/users/auth", headers=headers)
+
+        book = self._book(rng)
+        document = _document_hash(self.username, "book", book)
+        await _call(
+            client, recorder, "GET /syncs/progress/{document}", (200, 404),
+            url=f"/syncs/progress/{document}", headers=headers,
+        )
+        percentage = self.positions.get(book, 0.0)
+        for _ in range(rng.randint(*PAGE_TURNS)):
+            percentage = min(1.0, percentage + rng.uniform(0.001, 0.01))
+            # 409 when the server keeps the newest or furthest progress and another device is ahead
+            await _call(
+                client, recorder, "PUT /syncs/progress", (200, 409),
+                url="/syncs/progress", headers=headers,
+                json={
+                    "document": document,
+                    "progress": f"/body/DocFragment[{int(percentage * 100) + 1}]/body/p[{rng.randint(1, 60)}]",
+                    "percentage": round(percentage, 4),
+                    "device": device,
+                    "device_id": device_id,
+                    "filename": f"Book {book}.epub",
+                },
+            )
+            if think_time:
+                await asyncio.sleep(think_time)
+        self.positions[book] = percentage
+
+        if book not in self.linked and rng.random() < LINK_RATE:
+            # Another edition of the same book, on another device
+            self.linked.add(book)
+            await _call(
+                client, recorder, "POST /documents/link", (201,),
+                url="/documents/link", headers=headers,
+                json={"hashes": [document, _document_hash(self.username, "book", book, "edition")]},
+            )
+        if rng.random() < LIST_BOOKS_RATE:
+            await _call(client, recorder, "GET /books", (200,), url="/books", headers=headers)
+        if rng.random() < CARD_RATE:
+            await _call(client, recorder, "GET /card/{username}", (200,), url=f"/card/{self.username}")
+
+
+async def run_load(client: httpx.AsyncClient, config: LoadConfig) -> dict:
+    """Register the readers, run their sessions and summarize both phases."""
+    readers = [Reader.create(config, index) for index in range(config.users)]
+    slots = asyncio.Semaphore(config.concurrency)
+
+    async def register(reader: Reader) -> None:
+        async with slots:
+            await reader.register(client, setup)
+
+    setup = Recorder()
+    started = time.perf_counter()
+    await asyncio.gather(*(register(reader) for reader in readers))
+    setup_elapsed = time.perf_counter() - started
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + config.duration if config.duration else None
+
+    async def client_loop(index: int) -> None:
+        # Each simulated client drives its own readers with its own generator
+        rng = random.Random(f"{config.seed}:{index}")
+        mine = readers[index::config.concurrency]
+        sessions = 0
+        while deadline is not None or sessions < len(mine) * config.sessions:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            await mine[sessions % len(mine)].session(client, recorder, rng, config.think_time)
+            sessions += 1
+
+    await asyncio.gather(*(client_loop(index) for index in range(min(config.concurrency, config.users))))
+    return {"setup": setup.summary(setup_elapsed), **recorder.summary(time.perf_counter() - started)}
+
+
+# Key schema and indexes of the DynamoDB tables (see terraform/dynamodb.tf)
+_DYNAMODB_TABLES = {
+    "DYNAMODB_USERS_TABLE": ("reader-progress-users", "username", None, []),
+    "DYNAMODB_PROGRESS_TABLE": ("reader-progress-progress", "user_id", "document", [
+        ("user_id-timestamp-index", "timestamp", "N", "ALL"),
+        ("user_id-modified_at-index", "modified_at", "N", "ALL"),
+    ]),
+    "DYNAMODB_DOCUMENT_LINKS_TABLE": ("reader-progress-document-links", "user_id", "document_hash", [
+        ("user_id-timestamp-index", "timestamp", "N", "ALL"),
+        ("user_id-canonical_hash-index", "canonical_hash", "S", "KEYS_ONLY"),
+    ]),
+    "DYNAMODB_BOOK_LABELS_TABLE": ("reader-progress-book-labels", "user_id", "canonical_hash", [
+        ("user_id-timestamp-index", "timestamp", "N", "ALL"),
+    ]),
+    "DYNAMODB_FILENAME_INDEX_TABLE": ("reader-progress-filename-index", "user_id", "filename", []),
+    "DYNAMODB_DELETIONS_TABLE": ("reader-progress-deletions", "user_id", "key", [
+        ("user_id-timestamp-index", "timestamp", "N", "ALL"),
+    ]),
+}
+
+
+def create_dynamodb_tables(endpoint_url: str) -> None:
+    """Create the tables the DynamoDB backend expects, unless they exist."""
+    import boto3
+
+    client = boto3.client("dynamodb", endpoint_url=endpoint_url, region_name=os.getenv("AWS_REGION", "us-east-1"))
+    existing = set(client.list_tables()["TableNames"])
+    for variable, (default, hash_key, range_key, indexes) in _DYNAMODB_TABLES.items():
+        name = os.getenv(variable, default)
+        if name in existing:
+            continue
+        attributes = {hash_key: "S"}
+        schema = [{"AttributeName": hash_key, "KeyType": "HASH"}]
+        if range_key:
+            attributes[range_key] = "S"
+            schema.append({"AttributeName": range_key, "KeyType": "RANGE"})
+        options = {}
+        for index_name, index_key, index_type, projection in indexes:
+            attributes[index_key] = index_type
+            options.setdefault("GlobalSecondaryIndexes", []).append({
+                "IndexName": index_name,
+                "KeySchema": [
+                    {"AttributeName": "user_id", "KeyType": "HASH"},
+                    {"AttributeName": index_key, "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": projection},
+            })
+        client.create_table(
+            TableName=name,
+            KeySchema=schema,
+            AttributeDefinitions=[{"AttributeName": k, "AttributeType": t} for k, t in attributes.items()],
+            BillingMode="PAY_PER_REQUEST",
+            **options,
+        )
+        client.get_waiter("table_exists").wait(TableName=name)
+
+
+def configure_backend(backend: str, database_url: Optional[str] = None, dynamodb_endpoint: Optional[str] = None) -> None:
+    """Point the app at the backend through its environment; call before importing main."""
+    if "main" in sys.modules:
+        raise RuntimeError("The backend must be configured before the app is imported")
+    os.environ.setdefault("PASSWORD_SALT", "bench-salt")
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    if backend in ("sqlite", "postgres"):
+        if backend == "postgres" and not database_url:
+            raise ValueError("The postgres backend needs a database URL")
+        os.environ["DB_BACKEND"] = "sql"
+        os.environ["DATABASE_URL"] = database_url or f"sqlite:///{tempfile.mkdtemp(prefix='kosync-bench-')}/bench.db"
+    elif backend == "dynamodb":
+        os.environ["DB_BACKEND"] = "dynamodb"
+        os.environ["DYNAMODB_ENDPOINT_URL"] = dynamodb_endpoint
+        # DynamoDB Local accepts any credentials
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+        create_dynamodb_tables(dynamodb_endpoint)
+    elif backend == "memory":
+        os.environ["DB_BACKEND"] = "memory"
+    else:
+        raise ValueError(f"Unknown backend {backend}")
+
+
+@asynccontextmanager
+async def in_process_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Client calling the app in this process, with its startup and shutdown run."""
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+@asynccontextmanager
+async def http_client(url: str, concurrency: int) -> AsyncIterator[httpx.AsyncClient]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        yield client
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_report(report: dict) -> str:
+    """The per-endpoint summary as a text table."""
+    header = f"{'endpoint':<32} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    lines = [header, "-" * len(header)]
+
+    def row(name: str, summary: dict) -> str:
+        return (
+            f"{name:<32} {summary['count']:>7} {summary['errors']:>6} {summary['throughput_rps']:>8.1f} "
+            f"{summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f} {summary['max_ms']:>8.2f}"
+        )
+
+    lines.extend(row(name, summary) for name, summary in report["endpoints"].items())
+    lines.append(row("total", report["total"]))
+    lines.append(row("setup: POST /users/create", report["setup"]["total"]))
+    return "\n".join(lines)
+
+
+async def main_async(args: argparse.Namespace) -> dict:
+    config = LoadConfig(
+        users=args.users, devices=args.devices, books=args.books, concurrency=args.concurrency,
+        sessions=args.sessions, duration=args.duration, think_time=args.think_time, seed=args.seed,
+        prefix=args.prefix,
+    )
+    if args.url:
+        client_context = http_client(args.url, config.concurrency)
+    else:
+        configure_backend(args.backend, args.database_url, args.dynamodb_endpoint)
+        client_context = in_process_client()
+    started_at = datetime.now(timezone.utc).isoformat()
+    async with client_context as client:
+        results = await run_load(client, config)
+    return {
+        "meta": {
+            "target": args.url or "in-process",
+            "backend": None if args.url else args.backend,
+            "config": asdict(config),
+            "started_at": started_at,
+            "commit": _commit(),
+            "python": platform.python_version(),
+        },
+        **results,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="Test a running server at this base URL instead of the app in-process")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite", help="In-process backend (default sqlite)")
+    parser.add_argument("--database-url", help="SQLAlchemy URL for sqlite/postgres (default: a fresh SQLite file)")
+    parser.add_argument("--dynamodb-endpoint", default="http://localhost:8000", help="DynamoDB Local endpoint")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--devices", type=int, default=2, help="Devices per user")
+    parser.add_argument("--books", type=int, default=20, help="Books per user")
+    parser.add_argument("--concurrency", type=int, default=50, help="Simulated clients sending requests at once")
+    parser.add_argument("--sessions", type=int, default=5, help="Reading sessions per user")
+    parser.add_argument("--duration", type=float, help="Run sessions for this many seconds instead")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between page turns")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--prefix", default="bench", help="Prefix of the simulated usernames")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["total"]["errors"] or report["setup"]["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""Micro-benchmarks of the repository methods and pure-Python hot spots.
+
+Each repository benchmark times one protocol method on one backend against a
+user holding a fixed number of rows, so the cost of a method can be followed
+as the data grows:
+
+    progress.upsert, progress.get_by_user_and_document
+    progress.get_all_by_user        at each --sizes row count (10, 1000, 50000)
+    document_link.get_canonical, document_link.create_link
+
+The SQL backend runs on a fresh SQLite file unless --database-url points at
+another database, through the same engine (and event hooks) as the server.
+The memory backend uses a store of its own, and the DynamoDB backend needs
+DynamoDB Local (--dynamodb-endpoint). The book aggregation of GET /books and
+the SVG card renderer are timed on in-memory data.
+
+A benchmark is run in rounds of enough calls to last --min-time seconds, and
+the median time per call over the rounds is what is compared:
+
+    python -m bench.micro run --output current.json
+    python -m bench.micro run --backend sql --backend memory --save-baseline baseline.json
+    python -m bench.micro run --baseline baseline.json --tolerance 0.25
+    python -m bench.micro compare baseline.json current.json
+
+`compare` also accepts two reports of bench.load, comparing p95 latency per
+endpoint. Either command exits with status 1 when a benchmark got slower than
+the baseline by more than the tolerance. Baselines only mean something on
+the machine that recorded them.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional
+
+BACKENDS = ("sql", "memory", "dynamodb")
+DEFAULT_SIZES = (10, 1000, 50000)
+# Card sizes: the default limit of GET /card, and a large one
+CARD_SIZES = (5, 50)
+# Rows written per upsert_many call while filling a fixture
+_FILL_BATCH = 500
+
+
+@dataclass
+class Benchmark:
+    name: str
+    call: Callable[[], object]
+
+
+def _hash(*parts) -> str:
+    return hashlib.md5(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def _progress(user_id: str, index: int, timestamp: int):
+    from repositories.protocols import ProgressEntity
+    return ProgressEntity(
+        user_id=user_id,
+        document=_hash(user_id, index),
+        progress=f"/body/DocFragment[{index % 40 + 1}]/body/p[{index % 60 + 1}]",
+        percentage=(index % 100) / 100,
+        device="Kindle",
+        device_id="kindle-001",
+        timestamp=timestamp + index,
+        filename=f"Book {index}.epub",
+    )
+
+
+def measure(call: Callable[[], object], min_time: float = 0.2, rounds: int = 5) -> dict:
+    """Seconds per call: the median, minimum and spread over `rounds` rounds."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / rounds or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / rounds / 10 else 2
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "calls_per_round": number,
+        "rounds": rounds,
+    }
+
+
+@contextmanager
+def _repositories(backend: str) -> Iterator[tuple]:
+    """User, progress and link repositories of a backend, as the factories build them."""
+    if backend == "sql":
+        from database import SessionLocal, init_db
+        from repositories.sql import SQLUserRepository, SQLProgressRepository, SQLDocumentLinkRepository
+        init_db()
+        db = SessionLocal()
+        try:
+            yield SQLUserRepository(db), SQLProgressRepository(db), SQLDocumentLinkRepository(db)
+        finally:
+            db.close()
+    elif backend == "memory":
+        from repositories.memory import (
+            MemoryStore, MemoryUserRepository, MemoryProgressRepository, MemoryDocumentLinkRepository,
+        )
+        store = MemoryStore()
+        yield MemoryUserRepository(store), MemoryProgressRepository(store), MemoryDocumentLinkRepository(store)
+    elif backend == "dynamodb":
+        from repositories.dynamodb import DynamoUserRepository, DynamoProgressRepository, DynamoDocumentLinkRepository
+        yield DynamoUserRepository(), DynamoProgressRepository(), DynamoDocumentLinkRepository()
+    else:
+        raise ValueError(f"Unknown backend {backend}")
+
+
+def _fixture_user(user_repo, progress_repo, rows: int) -> str:
+    """A new user holding `rows` progress records; returns its id."""
+    user_id = user_repo.create(f"micro-{rows}-{uuid.uuid4().hex[:12]}", "not-a-bcrypt-hash").id
+    now = int(time.time()) - rows
+    for start in range(0, rows, _FILL_BATCH):
+        progress_repo.upsert_many([_progress(user_id, i, now) for i in range(start, min(start + _FILL_BATCH, rows))])
+    return user_id
+
+
+def repository_benchmarks(backend: str, user_repo, progress_repo, link_repo, sizes: tuple[int, ...]) -> list[Benchmark]:
+    benchmarks = []
+    # Point lookups and writes run against the middle fixture
+    point_size = sorted(sizes)[len(sizes) // 2]
+    user_ids = {rows: _fixture_user(user_repo, progress_repo, rows) for rows in sizes}
+    user_id = user_ids[point_size]
+
+    versions = itertools.count(1)
+    existing = _progress(user_id, 0, int(time.time()))
+
+    def upsert():
+        # A new position each time, so the write is never skipped as unchanged
+        existing.percentage = (next(versions) % 1000) / 1000
+        progress_repo.upsert(existing)
+
+    benchmarks.append(Benchmark(f"{backend}:progress.upsert[{point_size}]", upsert))
+    benchmarks.append(Benchmark(
+        f"{backend}:progress.get_by_user_and_document[{point_size}]",
+        lambda: progress_repo.get_by_user_and_document(user_id, existing.document),
+    ))
+    for rows in sizes:
+        benchmarks.append(Benchmark(
+            f"{backend}:progress.get_all_by_user[{rows}]",
+            lambda owner=user_ids[rows]: progress_repo.get_all_by_user(owner),
+        ))
+
+    link_repo.create_link(user_id, _hash("edition", 0), existing.document)
+    benchmarks.append(Benchmark(
+        f"{backend}:document_link.get_canonical[{point_size}]",
+        lambda: link_repo.get_canonical(user_id, _hash("edition", 0)),
+    ))
+    new_links = itertools.count(1)
+    benchmarks.append(Benchmark(
+        f"{backend}:document_link.create_link[{point_size}]",
+        lambda: link_repo.create_link(user_id, _hash("edition", next(new_links)), existing.document),
+    ))
+    return benchmarks
+
+
+def python_benchmarks(sizes: tuple[int, ...]) -> list[Benchmark]:
+    from main import _summarize_books
+    from repositories.protocols import DocumentLinkEntity, BookLabelEntity
+    from schemas import BookSummary
+    from svg_card import render_progress_card
+
+    benchmarks = []
+    now = int(time.time())
+    for rows in sizes:
+        # Two devices per book, one book in ten linked, one in twenty labeled
+        progress = [_progress("1", i // 2, now + i % 2) for i in range(rows)]
+        links = [DocumentLinkEntity("1", _hash("edition", i), _hash("1", i)) for i in range(0, rows // 2, 10)]
+        labels = [BookLabelEntity("1", _hash("1", i), f"Label {i}") for i in range(0, rows // 2, 20)]
+        benchmarks.append(Benchmark(
+            f"python:list_books.aggregate[{rows}]",
+            lambda p=progress, l=links, b=labels: _summarize_books(p, l, b),
+        ))
+    for count in CARD_SIZES:
+        books = [
+            BookSummary(
+                canonical_hash=_hash("1", i), linked_hashes=[], label=f"A Long Book Title Number {i}" if i % 2 else None,
+                filename=f"Book {i}.epub", progress="/body/p[1]", percentage=i / count,
+                device="Kindle", device_id="kindle-001", timestamp=now - i,
+            )
+            for i in range(count)
+        ]
+        benchmarks.append(Benchmark(
+            f"python:render_progress_card[{count}]", lambda b=books: render_progress_card(b),
+        ))
+    return benchmarks
+
+
+def configure(database_url: Optional[str] = None, dynamodb_endpoint: Optional[str] = None) -> None:
+    """Environment for the app modules; call before they are imported."""
+    if "database" in sys.modules or "main" in sys.modules:
+        raise RuntimeError("Configure the benchmarks before the app is imported")
+    os.environ.setdefault("PASSWORD_SALT", "bench-salt")
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{tempfile.mkdtemp(prefix='kosync-micro-')}/micro.db"
+    # Keep the statement log quiet; its hooks still run as in the server
+    os.environ.setdefault("SLOW_QUERY_MS", "-1")
+    if dynamodb_endpoint:
+        from bench.load import create_dynamodb_tables
+        os.environ["DYNAMODB_ENDPOINT_URL"] = dynamodb_endpoint
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+        create_dynamodb_tables(dynamodb_endpoint)
+
+
+def run(
+    backends: tuple[str, ...] = ("sql", "memory"),
+    sizes: tuple[int, ...] = DEFAULT_SIZES,
+    python: bool = True,
+    only: Optional[str] = None,
+    min_time: float = 0.2,
+    rounds: int = 5,
+    log=print,
+) -> dict:
+    """Run the benchmarks whose name contains `only` (all by default)."""
+    results = {}
+
+    def run_all(benchmarks: list[Benchmark]) -> None:
+        for benchmark in benchmarks:
+            if only and only not in benchmark.name:
+                continue
+            results[benchmark.name] = measure(benchmark.call, min_time, rounds)
+            log(f"{benchmark.name:<56} {results[benchmark.name]['median_s'] * 1e6:>12.1f} us")
+
+    for backend in backends:
+        with _repositories(backend) as (user_repo, progress_repo, link_repo):
+            run_all(repository_benchmarks(backend, user_repo, progress_repo, link_repo, sizes))
+    if python:
+        run_all(python_benchmarks(sizes))
+    return {
+        "meta": {
+            "backends": list(backends),
+            "sizes": list(sizes),
+            "database": os.getenv("DATABASE_URL", "").split("://")[0] if "sql" in backends else None,
+            "min_time": min_time,
+            "rounds": rounds,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "benchmarks": results,
+    }
+
+
+def _comparable(report: dict) -> tuple[dict[str, float], str]:
+    """The value compared per name, and its unit, for micro or load reports."""
+    if "benchmarks" in report:
+        return {name: result["median_s"] * 1e6 for name, result in report["benchmarks"].items()}, "us"
+    return {name: summary["p95_ms"] for name, summary in report["endpoints"].items()}, "ms p95"
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.25) -> list[dict]:
+    """One row per benchmark; status is regression, improvement, ok, new or missing."""
+    before, unit = _comparable(baseline)
+    after, _ = _comparable(current)
+    rows = []
+    for name in sorted(before.keys() | after.keys()):
+        old, new = before.get(name), after.get(name)
+        if old is None or new is None:
+            rows.append({"name": name, "baseline": old, "current": new, "unit": unit,
+                         "change": None, "status": "new" if old is None else "missing"})
+            continue
+        change = (new - old) / old if old else 0.0
+        status = "regression" if change > tolerance else "improvement" if change < -tolerance else "ok"
+        rows.append({"name": name, "baseline": old, "current": new, "unit": unit, "change": change, "status": status})
+    return rows
+
+
+def format_comparison(rows: list[dict]) -> str:
+    unit = rows[0]["unit"] if rows else ""
+    lines = [f"{'benchmark (' + unit + ')':<56} {'baseline':>12} {'current':>12} {'change':>8}  status"]
+    for row in rows:
+        old = f"{row['baseline']:.1f}" if row["baseline"] is not None else "-"
+        new = f"{row['current']:.1f}" if row["current"] is not None else "-"
+        change = f"{row['change']:+.0%}" if row["change"] is not None else "-"
+        lines.append(f"{row['name']:<56} {old:>12} {new:>12} {change:>8}  {row['status']}")
+    return "\n".join(lines)
+
+
+def _report_comparison(baseline_path: str, current: dict, tolerance: float) -> int:
+    with open(baseline_path, encoding="utf-8") as f:
+        rows = compare(json.load(f), current, tolerance)
+    print(format_comparison(rows))
+    regressions = [row["name"] for row in rows if row["status"] == "regression"]
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def _write(path: str, report: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--backend", action="append", choices=BACKENDS,
+                            help="Backend to benchmark, repeatable (default: sql and memory)")
+    run_parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                            help="Row counts of the fixtures, comma-separated")
+    run_parser.add_argument("--database-url", help="SQLAlchemy URL for the sql backend (default: a fresh SQLite file)")
+    run_parser.add_argument("--dynamodb-endpoint", help="DynamoDB Local endpoint, required for the dynamodb backend")
+    run_parser.add_argument("--only", help="Only run benchmarks whose name contains this")
+    run_parser.add_argument("--no-python", action="store_true", help="Skip the pure-Python benchmarks")
+    run_parser.add_argument("--min-time", type=float, default=0.2, help="Seconds spent measuring each benchmark")
+    run_parser.add_argument("--rounds", type=int, default=5)
+    run_parser.add_argument("--output", help="Write the results to this JSON file")
+    run_parser.add_argument("--save-baseline", help="Write the results to this baseline file")
+    run_parser.add_argument("--baseline", help="Compare the results with this baseline file")
+    run_parser.add_argument("--tolerance", type=float, default=0.25, help="Slowdown flagged as a regression")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.25, help="Slowdown flagged as a regression")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        with open(args.current, encoding="utf-8") as f:
+            return _report_comparison(args.baseline, json.load(f), args.tolerance)
+
+    backends = tuple(args.backend or ("sql", "memory"))
+    if "dynamodb" in backends and not args.dynamodb_endpoint:
+        parser.error("the dynamodb backend needs --dynamodb-endpoint")
+    configure(args.database_url, args.dynamodb_endpoint)
+    report = run(
+        backends, tuple(int(size) for size in args.sizes.split(",")), not args.no_python,
+        args.only, args.min_time, args.rounds,
+    )
+    for path in (args.output, args.save_baseline):
+        if path:
+            _write(path, report)
+    return _report_comparison(args.baseline, report, args.tolerance) if args.baseline else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""Replay of traffic recorded by the server's capture mode (see capture.py).
+
+Requests are sent in the order and at the pace they were captured: each one
+starts at its captured offset from the first, divided by --speed, so bursts
+such as a device pushing on suspend or pulling on wake come through as they
+happened. Requests from or about one user still wait for the response to
+the previous one, like a KOReader device does, so a slower build cannot
+reorder them.
+--speed 0 sends them as soon as they can go, keeping at most --concurrency
+in flight.
+
+Captures hold no credentials, so every pseudonymous user gets a password
+derived from their pseudonym. Users whose registration was captured are
+registered by the replay itself; the others are registered before the replay
+starts and are reported as setup. Admin requests, event streams and requests
+that matched no route are skipped.
+
+    python -m bench.replay capture.jsonl --speed 10
+    python -m bench.replay capture.jsonl --url http://localhost:8080 --output new.json
+    python -m bench.replay capture.jsonl --url http://localhost:8080 --baseline old.json
+
+The report has the same shape as a bench.load report: p50/p95/p99 latency
+per endpoint of the replay, plus the latencies recorded in the capture and
+the number of responses whose status differs from the captured one. To
+compare two builds, replay the same capture against each and pass the first
+report as --baseline to the second run (or use bench.micro compare).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import platform
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import quote
+
+import httpx
+
+from bench.load import BACKENDS, Recorder, _commit, configure_backend, format_report, http_client, in_process_client
+
+SKIPPED_ROUTES = ("/syncs/stream",)
+SKIPPED_PREFIXES = ("/admin/",)
+
+
+def load_capture(path: str) -> list[dict]:
+    """Records of a capture file, in start order."""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["t"])
+
+
+def replayable(record: dict) -> bool:
+    route = record.get("r")
+    return route is not None and route not in SKIPPED_ROUTES and not route.startswith(SKIPPED_PREFIXES)
+
+
+def password(user: str) -> str:
+    """The password a pseudonymous user has in replays, as KOReader sends it (an MD5 hex digest)."""
+    return hashlib.md5(f"replay:{user}".encode()).hexdigest()
+
+
+def users_to_register(records: list[dict]) -> list[str]:
+    """Users the capture uses without registering them."""
+    created = {record["b"]["username"] for record in records
+               if record["r"] == "/users/create" and isinstance(record.get("b"), dict) and "username" in record["b"]}
+    used = {record["u"] for record in records if record.get("u")}
+    used.update(record["p"]["username"] for record in records if "username" in record.get("p", {}))
+    return sorted(used - created)
+
+
+def _user(record: dict) -> Optional[str]:
+    """The user a request is from or about: the sender, the user registered or the owner of a card."""
+    body = record.get("b")
+    return (
+        record.get("u")
+        or (body.get("username") if isinstance(body, dict) else None)
+        or record.get("p", {}).get("username")
+    )
+
+
+def build_request(record: dict) -> dict:
+    """Keyword arguments of httpx.AsyncClient.request for a captured request."""
+    path_params = {name: quote(str(value), safe="") for name, value in record.get("p", {}).items()}
+    request: dict = {"method": record["m"], "url": record["r"].format(**path_params)}
+    if record.get("q"):
+        request["params"] = record["q"]
+    if record.get("u"):
+        request["headers"] = {"x-auth-user": record["u"], "x-auth-key": password(record["u"])}
+    body = record.get("b")
+    if body is not None:
+        if record["r"] == "/users/create" and isinstance(body, dict) and "username" in body:
+            body = {**body, "password": password(body["username"])}
+        request["json"] = body
+    return request
+
+
+async def _register(client: httpx.AsyncClient, recorder: Recorder, users: list[str], concurrency: int) -> None:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def register(user: str) -> None:
+        async with slots:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/users/create", json={"username": user, "password": password(user)})
+                # 402 when the user exists from an earlier replay
+                ok = response.status_code in (201, 402)
+            except httpx.HTTPError:
+                ok = False
+            recorder.record("POST /users/create", time.perf_counter() - start, ok)
+
+    await asyncio.gather(*(register(user) for user in users))
+
+
+async def replay(client: httpx.AsyncClient, records: list[dict], speed: float = 1.0, concurrency: int = 100) -> dict:
+    """Send the replayable records on their captured schedule and summarize the responses."""
+    selected = [record for record in records if replayable(record)]
+    setup = Recorder()
+    started = time.perf_counter()
+    await _register(client, setup, users_to_register(selected), concurrency)
+    setup_elapsed = time.perf_counter() - started
+
+    recorder = Recorder()
+    captured = Recorder()
+    mismatches: Counter = Counter()
+    slots = asyncio.Semaphore(concurrency)
+    max_lag = 0.0
+
+    async def send(record: dict, endpoint: str, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with slots:
+            start = time.perf_counter()
+            try:
+                response = await client.request(**build_request(record))
+            except httpx.HTTPError:
+                recorder.record(endpoint, time.perf_counter() - start, False)
+                return
+            recorder.record(endpoint, time.perf_counter() - start, response.status_code < 500)
+            if response.status_code != record["s"]:
+                mismatches[endpoint] += 1
+
+    tasks = []
+    # Last request of each user, which their next one waits for
+    last: dict[str, asyncio.Task] = {}
+    first = selected[0]["t"] if selected else 0.0
+    started = time.perf_counter()
+    for record in selected:
+        endpoint = f"{record['m']} {record['r']}"
+        captured.record(endpoint, record["d"] / 1000, record["s"] < 500)
+        if speed > 0:
+            delay = (record["t"] - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        key = _user(record)
+        task = asyncio.create_task(send(record, endpoint, last.get(key)))
+        if key is not None:
+            last[key] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    return {
+        "setup": setup.summary(setup_elapsed),
+        **recorder.summary(elapsed),
+        "status_mismatches": dict(sorted(mismatches.items())),
+        # Behind schedule by this much at worst; large values mean the replay could not keep the pace
+        "max_lag_seconds": round(max_lag, 3),
+        "skipped": len(records) - len(selected),
+        "captured": captured.summary(selected[-1]["t"] - first if selected else 0.0),
+    }
+
+
+async def main_async(args: argparse.Namespace) -> dict:
+    records = load_capture(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+    if args.url:
+        client_context = http_client(args.url, args.concurrency)
+    else:
+        configure_backend(args.backend, args.database_url, args.dynamodb_endpoint)
+        client_context = in_process_client()
+    started_at = datetime.now(timezone.utc).isoformat()
+    async with client_context as client:
+        results = await replay(client, records, args.speed, args.concurrency)
+    return {
+        "meta": {
+            "capture": args.capture,
+            "records": len(records),
+            "speed": args.speed,
+            "target": args.url or "in-process",
+            "backend": None if args.url else args.backend,
+            "started_at": started_at,
+            "commit": _commit(),
+            "python": platform.python_version(),
+        },
+        **results,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    from bench.micro import _report_comparison
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="Capture file written by the server with CAPTURE_FILE set")
+    parser.add_argument("--url", help="Replay against a running server at this base URL instead of the app in-process")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite", help="In-process backend (default sqlite)")
+    parser.add_argument("--database-url", help="SQLAlchemy URL for sqlite/postgres (default: a fresh SQLite file)")
+    parser.add_argument("--dynamodb-endpoint", default="http://localhost:8000", help="DynamoDB Local endpoint")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up over the captured pace; 0 for no delays")
+    parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight at most")
+    parser.add_argument("--limit", type=int, help="Replay only the first N captured requests")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    parser.add_argument("--baseline", help="Compare p95 latencies with this earlier replay report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Slowdown flagged as a regression (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+    print(format_report(report))
+    if report["status_mismatches"]:
+        print("Statuses differing from the capture: " + ", ".join(
+            f"{endpoint} x{count}" for endpoint, count in report["status_mismatches"].items()
+        ))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    failed = 1 if report["total"]["errors"] or report["setup"]["total"]["errors"] else 0
+    if args.baseline:
+        return _report_comparison(args.baseline, report, args.tolerance) or failed
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Scale test: endpoint latencies against latency budgets as libraries grow.
+
+Loads a bench.dataset dataset, then picks the users whose library sizes are
+closest to each checkpoint (10, 1,000 and 20,000 books by default). Each user
+repeatedly pushes progress, which drops their cached card, renders the card,
+lists their books and pulls the progress of a book. One push per user
+carries an edition hash the server has not seen, under the filename of a
+book already in the library, so the auto-linking path is measured too.
+
+The p95 latency of each endpoint, per library size, is checked against a
+budget in milliseconds; --budget overrides one. The command exits with
+status 1 when a budget is exceeded or a request fails.
+
+    python -m bench.scale --users 10000 --max-books 20000
+    python -m bench.scale --backend postgres --database-url postgresql://localhost/kosync --no-load
+    python -m bench.scale --url http://localhost:8080 --users 10000 --budget "GET /books=1500"
+
+With --url, the server's database must already hold the dataset, loaded by
+bench.dataset with the same --users, --max-books, --zipf-s, --seed and
+--prefix; the libraries are regenerated here rather than read back.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Optional
+
+import httpx
+
+from bench.dataset import DatasetConfig, Library, generate_library, load
+from bench.load import BACKENDS, Recorder, _call, configure_backend, http_client, in_process_client
+
+DEFAULT_SIZES = (10, 1000, 20_000)
+DEFAULT_BUDGETS_MS = {
+    "PUT /syncs/progress": 100.0,
+    "GET /syncs/progress/{document}": 50.0,
+    "GET /books": 2000.0,
+    "GET /card/{username}": 2000.0,
+}
+
+
+def pick_users(config: DatasetConfig, sizes: tuple[int, ...]) -> dict[int, int]:
+    """User index whose library size is closest to each size."""
+    picked = {}
+    for size in sizes:
+        # Inverse of DatasetConfig.library_size, then its neighbours for rounding
+        guess = int((config.max_books / max(size, 1)) ** (1 / config.zipf_s)) - 1
+        candidates = {min(max(index, 0), config.users - 1) for index in range(guess - 1, guess + 2)}
+        picked[size] = min(candidates, key=lambda index: abs(config.library_size(index) - size))
+    return picked
+
+
+async def measure_library(
+    client: httpx.AsyncClient, config: DatasetConfig, library: Library, iterations: int, seed: int,
+) -> dict:
+    """Time the endpoints for one user; also reports whether the unseen edition was auto-linked."""
+    rng = random.Random(f"{seed}:{library.index}")
+    headers = {"x-auth-user": library.username, "x-auth-key": config.password_md5}
+    # The first request per user checks the password with bcrypt; keep it out of the timings
+    await client.get("/users/auth", headers=headers)
+    recorder = Recorder()
+    auto_linked = False
+    started = time.perf_counter()
+    for iteration in range(iterations):
+        book = rng.randrange(len(library.books))
+        record = library.books[book]
+        # The first push is a new edition of a book the user already has
+        document = library.unseen_edition(book) if iteration == 0 else record.canonical_hash
+        await _call(
+            client, recorder, "PUT /syncs/progress", (200, 409),
+            url="/syncs/progress", headers=headers,
+            json={
+                "document": document,
+                "progress": record.progress,
+                "percentage": min(1.0, round(record.percentage + (iteration + 1) / 1000, 4)),
+                "device": record.device,
+                "device_id": record.device_id,
+                "filename": record.filename,
+            },
+        )
+        response = await _call(
+            client, recorder, "GET /syncs/progress/{document}", (200,),
+            url=f"/syncs/progress/{document}", headers=headers,
+        )
+        if iteration == 0:
+            # Linked editions resolve to the canonical document
+            auto_linked = response is not None and response.status_code == 200 \
+                and response.json()["document"] == record.canonical_hash
+        await _call(client, recorder, "GET /card/{username}", (200,), url=f"/card/{library.username}")
+        await _call(client, recorder, "GET /books", (200,), url="/books", headers=headers)
+    return {
+        "username": library.username,
+        "books": len(library.books),
+        "auto_linked": auto_linked,
+        **recorder.summary(time.perf_counter() - started),
+    }
+
+
+async def run_scale(
+    client: httpx.AsyncClient, config: DatasetConfig, sizes: tuple[int, ...] = DEFAULT_SIZES, iterations: int = 20,
+) -> dict:
+    """Measure the users closest to each library size, one at a time."""
+    now = int(time.time())
+    results = {}
+    for size, index in pick_users(config, sizes).items():
+        library = generate_library(config, index, now)
+        results[str(size)] = await measure_library(client, config, library, iterations, config.seed)
+    return {"sizes": results}
+
+
+def check_budgets(report: dict, budgets: dict[str, float]) -> list[str]:
+    """Budget violations and failed requests, one line each."""
+    problems = []
+    for size, result in report["sizes"].items():
+        if not result["auto_linked"]:
+            problems.append(f"{result['books']} books: the unseen edition was not auto-linked")
+        for endpoint, summary in result["endpoints"].items():
+            if summary["errors"]:
+                problems.append(f"{result['books']} books: {endpoint} failed {summary['errors']} times")
+            budget = budgets.get(endpoint)
+            if budget is not None and summary["p95_ms"] > budget:
+                problems.append(
+                    f"{result['books']} books: {endpoint} p95 {summary['p95_ms']:.1f} ms over its {budget:.0f} ms budget"
+                )
+    return problems
+
+
+def format_report(report: dict, budgets: dict[str, float]) -> str:
+    header = f"{'books':>7} {'endpoint':<32} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'budget':>8}"
+    lines = [header, "-" * len(header)]
+    for result in report["sizes"].values():
+        for endpoint, summary in result["endpoints"].items():
+            budget = budgets.get(endpoint)
+            lines.append(
+                f"{result['books']:>7} {endpoint:<32} {summary['count']:>6} {summary['p50_ms']:>8.2f} "
+                f"{summary['p95_ms']:>8.2f} {budget if budget is not None else '-':>8}"
+            )
+    return "\n".join(lines)
+
+
+def _parse_budget(value: str) -> tuple[str, float]:
+    endpoint, _, milliseconds = value.rpartition("=")
+    if not endpoint:
+        raise argparse.ArgumentTypeError(f"Expected ENDPOINT=MILLISECONDS, got {value!r}")
+    return endpoint.strip(), float(milliseconds)
+
+
+async def main_async(args: argparse.Namespace, config: DatasetConfig, sizes: tuple[int, ...]) -> dict:
+    if args.url:
+        client_context = http_client(args.url, 1)
+    else:
+        # Bulk inserts are slow statements by design
+        os.environ.setdefault("SLOW_QUERY_MS", "-1")
+        configure_backend(args.backend, args.database_url, args.dynamodb_endpoint)
+        if not args.no_load:
+            started = time.perf_counter()
+            counts = load(config, os.environ["DB_BACKEND"])
+            print(f"Loaded {sum(counts.values())} rows in {time.perf_counter() - started:.1f}s")
+        client_context = in_process_client()
+    async with client_context as client:
+        return await run_scale(client, config, sizes, args.iterations)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="Test a running server whose database already holds the dataset")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite", help="In-process backend (default sqlite)")
+    parser.add_argument("--database-url", help="SQLAlchemy URL for sqlite/postgres (default: a fresh SQLite file)")
+    parser.add_argument("--dynamodb-endpoint", default="http://localhost:8000", help="DynamoDB Local endpoint")
+    parser.add_argument("--no-load", action="store_true", help="The in-process database already holds the dataset")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--max-books", type=int, default=20_000, help="Books of the largest library")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent of library sizes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--prefix", default="scale", help="Prefix of the generated usernames")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Library sizes to measure at")
+    parser.add_argument("--iterations", type=int, default=20, help="Requests per endpoint and library size")
+    parser.add_argument("--budget", type=_parse_budget, action="append", default=[],
+                        help='p95 budget in milliseconds, e.g. "GET /books=1500"; repeatable')
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+    if args.no_load and args.backend in ("sqlite", "postgres") and not args.database_url:
+        parser.error("--no-load needs the --database-url holding the dataset")
+
+    config = DatasetConfig(users=args.users, max_books=args.max_books, zipf_s=args.zipf_s, seed=args.seed,
+                           prefix=args.prefix)
+    sizes = tuple(int(size) for size in args.sizes.split(","))
+    budgets = {**DEFAULT_BUDGETS_MS, **dict(args.budget)}
+    report = asyncio.run(main_async(args, config, sizes))
+    report["budgets_ms"] = budgets
+    print(format_report(report, budgets))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    problems = check_budgets(report, budgets)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""In-memory per-user search index over book labels and filenames.
+
+Each user's index maps word tokens to the canonical hashes whose label or
+filename contains them. Tokens are kept sorted, so every query word also
+matches as a prefix ("gats" finds "gatsby"). The index is built from the
+database on a user's first search, updated in place when this process writes
+progress or labels, and rebuilt after SEARCH_INDEX_TTL seconds to pick up
+writes made by other processes.
+"""
+
+import bisect
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from filename_match import normalize_filename, split_copy_marker
+
+# Seconds a user's search index is kept before it is rebuilt from the database
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "300"))
+# Users whose search index is kept in memory
+SEARCH_INDEX_MAX_USERS = int(os.getenv("SEARCH_INDEX_MAX_USERS", "1000"))
+
+# A word found in the label counts more than one found in the filename,
+# and a whole-word match more than a prefix match
+_FIELD_WEIGHTS = {"label": 2.0, "filename": 1.0}
+_PREFIX_FACTOR = 0.6
+
+_WORDS = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return _WORDS.findall(text)
+
+
+@dataclass
+class SearchEntry:
+    """What the index knows about one book."""
+    label: Optional[str] = None
+    filename: Optional[str] = None
+    timestamp: int = 0
+
+
+class _UserSearchIndex:
+    def __init__(self):
+        self.loaded_at = time.monotonic()
+        self.entries: dict[str, SearchEntry] = {}
+        # token -> {canonical_hash: field weight}
+        self.postings: dict[str, dict[str, float]] = {}
+        self.tokens: list[str] = []
+
+    def _field_tokens(self, entry: SearchEntry) -> dict[str, float]:
+        weights: dict[str, float] = {}
+        if entry.filename:
+            for token in tokenize(split_copy_marker(normalize_filename(entry.filename))[0]):
+                weights[token] = max(weights.get(token, 0.0), _FIELD_WEIGHTS["filename"])
+        if entry.label:
+            for token in tokenize(entry.label):
+                weights[token] = max(weights.get(token, 0.0), _FIELD_WEIGHTS["label"])
+        return weights
+
+    def put(self, canonical_hash: str, entry: SearchEntry) -> None:
+        previous = self.entries.get(canonical_hash)
+        if previous is not None:
+            for token in self._field_tokens(previous):
+                postings = self.postings.get(token)
+                if postings is not None:
+                    postings.pop(canonical_hash, None)
+                    if not postings:
+                        del self.postings[token]
+                        del self.tokens[bisect.bisect_left(self.tokens, token)]
+        self.entries[canonical_hash] = entry
+        for token, weight in self._field_tokens(entry).items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                bisect.insort(self.tokens, token)
+            self.postings[token][canonical_hash] = weight
+
+    def search(self, query: str) -> list[tuple[str, float]]:
+        """Canonical hashes matching every query word, with their scores."""
+        words = tokenize(query)
+        if not words:
+            return []
+        scores: Optional[dict[str, float]] = None
+        for word in words:
+            word_scores: dict[str, float] = {}
+            start = bisect.bisect_left(self.tokens, word)
+            for token in self.tokens[start:]:
+                if not token.startswith(word):
+                    break
+                factor = 1.0 if token == word else _PREFIX_FACTOR
+                for canonical_hash, weight in self.postings[token].items():
+                    score = weight * factor
+                    if score > word_scores.get(canonical_hash, 0.0):
+                        word_scores[canonical_hash] = score
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {h: s + word_scores[h] for h, s in scores.items() if h in word_scores}
+            if not scores:
+                return []
+        return sorted(
+            scores.items(),
+            key=lambda item: (item[1], self.entries[item[0]].timestamp),
+            reverse=True,
+        )
+
+
+class BookSearchIndex:
+    """Per-user search indexes, built on demand and bounded in number."""
+
+    def __init__(self, ttl: float = SEARCH_INDEX_TTL, max_users: int = SEARCH_INDEX_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users: OrderedDict[str, _UserSearchIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        load: Callable[[], dict[str, SearchEntry]],
+        limit: int = 20,
+        offset: int = 0,
+    ) -> list[str]:
+        """Canonical hashes of the best matches, best first.
+
+        `load` returns every book of the user and is only called when the
+        user's index is missing or expired.
+        """
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None and time.monotonic() - index.loaded_at < self.ttl:
+                self._users.move_to_end(user_id)
+            else:
+                index = None
+        if index is None:
+            index = _UserSearchIndex()
+            for canonical_hash, entry in load().items():
+                index.put(canonical_hash, entry)
+            with self._lock:
+                self._users[user_id] = index
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        with self._lock:
+            hits = index.search(query)
+        return [canonical_hash for canonical_hash, _ in hits[offset:offset + limit]]
+
+    def update_progress(self, user_id: str, canonical_hash: str, filename: Optional[str], timestamp: int) -> None:
+        """Reflect a progress write in the user's index, if it is loaded."""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return
+            current = index.entries.get(canonical_hash, SearchEntry())
+            index.put(canonical_hash, SearchEntry(
+                label=current.label,
+                filename=filename or current.filename,
+                timestamp=max(timestamp, current.timestamp),
+            ))
+
+    def update_label(self, user_id: str, canonical_hash: str, label: Optional[str]) -> None:
+        """Reflect a label change in the user's index, if it is loaded."""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None or canonical_hash not in index.entries:
+                return
+            current = index.entries[canonical_hash]
+            index.put(canonical_hash, SearchEntry(
+                label=label, filename=current.filename, timestamp=current.timestamp
+            ))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+
+book_search = BookSearchIndex()
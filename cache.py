@@ -0,0 +1,413 @@
+"""Cache shared by the endpoints, in-process or over the Redis protocol.
+
+CACHE_BACKEND=local keeps entries in an LRU dictionary inside the process,
+which is enough for a single worker. With several uvicorn workers or Lambda
+instances, CACHE_BACKEND=redis points every process at one Redis (or
+compatible) server at CACHE_URL, so they see the same entries and the same
+invalidations. RespStandIn serves a LocalCache over the same protocol for
+tests and local development without a Redis install.
+
+Entries are namespaced per user through UserCache. Each user and namespace
+has a version token that is part of every key; invalidating replaces the
+token, which orphans all of the user's entries at once without having to
+find and delete them (they expire through their TTL).
+
+The cache is an optimization only: a Redis that is down or slow counts as an
+error and a miss, never as a failed request.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from queue import Empty, LifoQueue
+from typing import Any, Optional, Protocol
+from urllib.parse import urlparse
+
+from metrics import counter
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "local")
+CACHE_URL = os.getenv("CACHE_URL", "redis://127.0.0.1:6379/0")
+# Prepended to every key, so several deployments can share one Redis
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "kosync")
+# Entries kept by the local backend
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+# Seconds to wait on the Redis server before treating a call as a miss
+CACHE_TIMEOUT = float(os.getenv("CACHE_TIMEOUT", "0.5"))
+# Seconds the Redis server is left alone after a failed call
+CACHE_RETRY_AFTER = float(os.getenv("CACHE_RETRY_AFTER", "5"))
+
+CACHE_HITS = counter("cache_hits_total", "Shared cache lookups that found an entry")
+CACHE_MISSES = counter("cache_misses_total", "Shared cache lookups that found nothing")
+CACHE_ERRORS = counter("cache_errors_total", "Shared cache calls that failed and were treated as misses")
+
+
+class Cache(Protocol):
+    """Byte-string key/value store with per-entry TTLs."""
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Value stored under key, or None if missing or expired."""
+        ...
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None, only_if_absent: bool = False) -> bool:
+        """Store value, expiring after ttl seconds if given. Returns False if
+        only_if_absent was set and the key already existed."""
+        ...
+
+    def delete(self, *keys: str) -> int:
+        """Remove keys. Returns how many existed."""
+        ...
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        ...
+
+    def stats(self) -> dict:
+        """Backend name and entry counts, for /stats."""
+        ...
+
+
+class LocalCache:
+    """Thread-safe in-process LRU cache with per-entry TTLs."""
+
+    def __init__(self, max_entries: Optional[int] = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (value, expires_at or None), least recently used first
+        self._entries: OrderedDict[str, tuple[bytes, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None, only_if_absent: bool = False) -> bool:
+        with self._lock:
+            if only_if_absent and self._live(key) is not None:
+                return False
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._entries.pop(key, None) is not None for key in keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "local", "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+def _encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by cache server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise RespError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("Connection closed by cache server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(payload)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected reply from cache server: {line!r}")
+
+
+class _Connection:
+    def __init__(self, host: str, port: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+
+    def command(self, *args):
+        self.sock.sendall(_encode_command(*args))
+        return _read_reply(self.reader)
+
+    def close(self) -> None:
+        self.reader.close()
+        self.sock.close()
+
+
+class RedisCache:
+    """Cache client for a Redis-protocol server at redis://host:port/db.
+
+    Connections are pooled per client. A failed call discards its connection,
+    counts an error and behaves like a miss, and further calls are skipped
+    for `retry_after` seconds so an unreachable server does not add a timeout
+    to every request. A server that refuses AUTH or SELECT is misconfigured
+    rather than broken, but is treated the same way. RespError replies to
+    other commands are raised, as they indicate a bug rather than an outage.
+    """
+
+    def __init__(
+        self,
+        url: str = CACHE_URL,
+        timeout: float = CACHE_TIMEOUT,
+        retry_after: float = CACHE_RETRY_AFTER,
+        pool_size: int = 16,
+    ):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._pool: LifoQueue[_Connection] = LifoQueue(maxsize=pool_size)
+
+    def _connect(self) -> _Connection:
+        connection = _Connection(self.host, self.port, self.timeout)
+        try:
+            if self.password:
+                connection.command("AUTH", self.password)
+            if self.db:
+                connection.command("SELECT", self.db)
+        except RespError as e:
+            connection.close()
+            raise ConnectionError(f"Cache server refused the connection: {e}") from e
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def _command(self, *args, default=None):
+        if time.monotonic() < self._down_until:
+            return default
+        try:
+            connection = self._pool.get_nowait()
+        except Empty:
+            connection = None
+        try:
+            if connection is None:
+                connection = self._connect()
+            reply = connection.command(*args)
+        except (OSError, ConnectionError):
+            if connection is not None:
+                connection.close()
+            self._down_until = time.monotonic() + self.retry_after
+            CACHE_ERRORS.inc()
+            return default
+        except RespError:
+            if connection is not None:
+                connection.close()
+            raise
+        try:
+            self._pool.put_nowait(connection)
+        except Exception:
+            connection.close()
+        return reply
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None, only_if_absent: bool = False) -> bool:
+        args = ["SET", key, value]
+        if ttl:
+            args += ["PX", max(1, int(ttl * 1000))]
+        if only_if_absent:
+            args.append("NX")
+        return self._command(*args) is not None
+
+    def delete(self, *keys: str) -> int:
+        return self._command("DEL", *keys, default=0) if keys else 0
+
+    def clear(self) -> None:
+        self._command("FLUSHDB")
+
+    def ping(self) -> bool:
+        return self._command("PING") == "PONG"
+
+    def stats(self) -> dict:
+        entries = self._command("DBSIZE")
+        # No address: /stats is public
+        return {"backend": "redis", "entries": entries}
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            if not isinstance(command, list) or not command:
+                self.wfile.write(b"-ERR Protocol error\r\n")
+                continue
+            name = command[0].decode().upper()
+            args = command[1:]
+            try:
+                reply = self._execute(self.server, name, args)
+            except (ValueError, IndexError):
+                reply = RespError(f"ERR wrong arguments for '{name.lower()}' command")
+            self.wfile.write(self._encode(reply))
+
+    @staticmethod
+    def _execute(server: "RespStandIn", name: str, args: list[bytes]):
+        cache = server.cache
+        if name == "PING":
+            return "PONG"
+        if name == "AUTH":
+            if server.password is not None and args[-1].decode() != server.password:
+                return RespError("WRONGPASS invalid username-password pair or user is disabled.")
+            return "OK"
+        if name == "SELECT":
+            return "OK"
+        if name == "GET":
+            return cache.get(args[0].decode())
+        if name == "SET":
+            key, value, options = args[0].decode(), args[1], [a.decode().upper() for a in args[2:]]
+            ttl = None
+            if "EX" in options:
+                ttl = float(options[options.index("EX") + 1])
+            elif "PX" in options:
+                ttl = float(options[options.index("PX") + 1]) / 1000
+            return "OK" if cache.set(key, value, ttl, only_if_absent="NX" in options) else None
+        if name == "DEL":
+            return cache.delete(*(a.decode() for a in args))
+        if name == "FLUSHDB":
+            cache.clear()
+            return "OK"
+        if name == "DBSIZE":
+            return cache.stats()["entries"]
+        return RespError(f"ERR unknown command '{name.lower()}'")
+
+    @staticmethod
+    def _encode(reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, RespError):
+            return b"-%s\r\n" % str(reply).encode()
+        if isinstance(reply, str):
+            return b"+%s\r\n" % reply.encode()
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """Minimal Redis-protocol server backed by a LocalCache.
+
+    Understands the commands RedisCache sends (AUTH, SELECT, PING, GET, SET
+    with PX/EX/NX, DEL, FLUSHDB, DBSIZE). AUTH is checked against `password`
+    if one is given. Port 0 picks a free port; see `url`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, password: Optional[str] = None):
+        super().__init__((host, port), _RespHandler)
+        self.cache = LocalCache(max_entries=None)
+        self.password = password
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "RespStandIn":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class UserCache:
+    """JSON values cached per user under one namespace, with versioned invalidation."""
+
+    def __init__(self, cache: Cache, namespace: str, ttl: float, prefix: str = CACHE_PREFIX):
+        self.cache = cache
+        self.namespace = namespace
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _version(self, user_id: str) -> str:
+        version_key = f"{self.prefix}:{self.namespace}:{user_id}:version"
+        version = self.cache.get(version_key)
+        if version is None:
+            # A fresh token rather than a counter, so a version key lost to
+            # eviction can never bring back entries written under an old one
+            self.cache.set(version_key, uuid.uuid4().hex.encode(), only_if_absent=True)
+            version = self.cache.get(version_key)
+            if version is None:
+                return ""
+        return version.decode()
+
+    def _key(self, user_id: str, version: str, key: str) -> str:
+        return f"{self.prefix}:{self.namespace}:{user_id}:{version}:{key}"
+
+    def get(self, user_id: str, key: str) -> Optional[Any]:
+        version = self._version(user_id)
+        value = self.cache.get(self._key(user_id, version, key)) if version else None
+        if value is None:
+            CACHE_MISSES.inc()
+            return None
+        CACHE_HITS.inc()
+        return json.loads(value)
+
+    def set(self, user_id: str, key: str, value: Any) -> None:
+        version = self._version(user_id)
+        if version:
+            self.cache.set(self._key(user_id, version, key), json.dumps(value).encode(), self.ttl)
+
+    def invalidate(self, user_id: str) -> None:
+        """Orphan every entry of the user in this namespace."""
+        version_key = f"{self.prefix}:{self.namespace}:{user_id}:version"
+        self.cache.set(version_key, uuid.uuid4().hex.encode())
+
+
+def create_cache() -> Cache:
+    if CACHE_BACKEND == "redis":
+        return RedisCache(CACHE_URL)
+    return LocalCache()
+
+
+shared_cache: Cache = create_cache()
@@ -0,0 +1,214 @@
+"""Opt-in capture of request traffic, for replay by bench.replay.
+
+With CAPTURE_FILE set, every HTTP request is appended to that file as one
+JSON line, once its response has been sent. A record keeps the request's
+shape and timing, never its credentials or identifiers:
+
+    t  start time, Unix seconds
+    m  method
+    r  route template, e.g. /syncs/progress/{document}; null if no route matched
+    p  path parameters
+    q  query parameters
+    u  the x-auth-user header
+    b  the JSON body, if any
+    s  response status
+    d  duration in milliseconds, up to the last byte of the response
+    n  response body bytes
+
+No other header is kept, and `password` fields are dropped from bodies.
+Usernames, document hashes, device ids, filenames and labels are replaced
+by pseudonyms: keyed HMACs under CAPTURE_KEY, so the same value always gets
+the same pseudonym within a capture and cannot be recovered without the key.
+Hashes keep their length. Filenames are pseudonymized after normalization,
+with their copy marker and extension kept, so names that match exactly
+still do and a copy still looks like one. Search terms are pseudonymized the
+same way, so a replayed search finds nothing.
+
+Without CAPTURE_KEY, each process draws a random key; set it when several
+workers append to one file, so their pseudonyms agree. Each record is written
+with a single append, so workers can share the file.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qsl
+
+from filename_match import normalize_filename, split_copy_marker
+from metrics import counter, route_template
+
+logger = logging.getLogger(__name__)
+
+# Empty disables capture
+CAPTURE_FILE = os.getenv("CAPTURE_FILE", "")
+CAPTURE_KEY = os.getenv("CAPTURE_KEY", "")
+# Larger request bodies are recorded without their content
+CAPTURE_MAX_BODY = int(os.getenv("CAPTURE_MAX_BODY", str(1024 * 1024)))
+
+CAPTURE_RECORDS = counter("capture_records_total", "Requests written to the traffic capture file")
+CAPTURE_FAILURES = counter("capture_failures_total", "Requests that could not be written to the traffic capture file")
+
+_CREDENTIALS = frozenset({"password"})
+
+
+class Pseudonymizer:
+    """Stable pseudonyms for the identifying values of a request."""
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self._fields: dict[str, Callable[[str], str]] = {
+            "username": self.user,
+            "document": self.hash,
+            "document_hash": self.hash,
+            "canonical_hash": self.hash,
+            "hashes": self.hash,
+            "documents": self.hash,
+            "device_id": self.hash,
+            "filename": self.filename,
+            "q": self.search,
+            "label": self.label,
+        }
+
+    def _token(self, value: str) -> str:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).hexdigest()
+
+    def user(self, username: str) -> str:
+        return f"user-{self._token('user:' + username)[:12]}"
+
+    def hash(self, value: str) -> str:
+        return self._token("hash:" + value)[:len(value) if 0 < len(value) <= 64 else 32]
+
+    def filename(self, filename: str) -> str:
+        extension = os.path.splitext(filename)[1].lower()
+        name, marker = split_copy_marker(normalize_filename(filename))
+        return (
+            self._token("name:" + name)[:16] + (f" {marker}" if marker else "")
+            + (extension if len(extension) <= 8 else "")
+        )
+
+    def search(self, query: str) -> str:
+        return self._token("name:" + split_copy_marker(normalize_filename(query))[0])[:16]
+
+    def label(self, label: str) -> str:
+        return f"label-{self._token('label:' + label)[:8]}"
+
+    def _value(self, key: str, value: Any) -> Any:
+        pseudonym = self._fields.get(key)
+        if isinstance(value, dict):
+            return self.fields(value)
+        if isinstance(value, list):
+            return [self._value(key, item) for item in value]
+        if pseudonym is not None and isinstance(value, str):
+            return pseudonym(value)
+        return value
+
+    def fields(self, data: dict) -> dict:
+        """Pseudonymize known fields, recursively, and drop credentials."""
+        return {key: self._value(key, value) for key, value in data.items() if key not in _CREDENTIALS}
+
+    def body(self, body: Any) -> Any:
+        if isinstance(body, (dict, list)):
+            return self._value("", body)
+        return None
+
+
+class TrafficCapture:
+    """Appends request records to a file, one JSON line each."""
+
+    def __init__(self, path: str = CAPTURE_FILE, key: str = CAPTURE_KEY, max_body: int = CAPTURE_MAX_BODY):
+        self.path = path
+        self.pseudonymizer = Pseudonymizer(key.encode() if key else os.urandom(32))
+        self.max_body = max_body
+        self._fd: Optional[int] = None
+        self._fd_path: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        try:
+            with self._lock:
+                if self._fd is None or self._fd_path != self.path:
+                    self.close()
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                    self._fd_path = self.path
+                # One write per line, so concurrent writers do not interleave
+                os.write(self._fd, line)
+            CAPTURE_RECORDS.inc()
+        except OSError:
+            CAPTURE_FAILURES.inc()
+            logger.warning("Could not write to the traffic capture %s", self.path, exc_info=True)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+capture = TrafficCapture()
+
+
+class CaptureMiddleware:
+    """Record each request to the traffic capture, when one is configured."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _record(self, scope, started_at: float, body: Optional[bytes], status: int, duration: float, sent: int) -> dict:
+        pseudonymizer = capture.pseudonymizer
+        route = route_template(scope)
+        record: dict[str, Any] = {"t": round(started_at, 3), "m": scope["method"], "r": route}
+        if route is not None and scope.get("path_params"):
+            record["p"] = pseudonymizer.fields(scope["path_params"])
+        query = scope.get("query_string", b"").decode("latin-1")
+        if query:
+            record["q"] = pseudonymizer.fields(dict(parse_qsl(query)))
+        user = next((v for k, v in scope["headers"] if k == b"x-auth-user"), None)
+        if user:
+            record["u"] = pseudonymizer.user(user.decode("latin-1"))
+        if body:
+            try:
+                record["b"] = pseudonymizer.body(json.loads(body))
+            except ValueError:
+                pass
+        record.update(s=status, d=round(duration * 1000, 3), n=sent)
+        return record
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not capture.path:
+            await self.app(scope, receive, send)
+            return
+        started_at = time.time()
+        start = time.perf_counter()
+        chunks: list[bytes] = []
+        size = 0
+        status = 500
+        sent = 0
+
+        async def receive_and_keep():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= capture.max_body:
+                    chunks.append(chunk)
+            return message
+
+        async def send_and_count(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_keep, send_and_count)
+        finally:
+            body = b"".join(chunks) if size <= capture.max_body else None
+            capture.write(self._record(scope, started_at, body, status, time.perf_counter() - start, sent))
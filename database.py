@@ -1,10 +1,19 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from request_stats import record_round_trip
+from slow_queries import slow_query_log
+
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/koreader.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# SQLite connections are shared with FastAPI's worker threads; other drivers reject the option
+_connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, connect_args=_connect_args)
+# Statements and commits are the round-trips counted per request
+event.listen(engine, "before_cursor_execute", record_round_trip)
+event.listen(engine, "commit", record_round_trip)
+slow_query_log.install(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -17,6 +26,29 @@ def get_db():
         db.close()
 
 
+def upgrade_schema():
+    """Add columns and indexes introduced after a table was first created.
+
+    create_all() only creates missing tables, so databases from earlier
+    versions would otherwise lack newer nullable columns and indexes.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
 def init_db():
+    import models  # noqa: F401 - Required to register models with Base.metadata
     os.makedirs("data", exist_ok=True)
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
@@ -27,6 +27,17 @@ cp "$PROJECT_ROOT/auth.py" "$BUILD_DIR/"
 cp "$PROJECT_ROOT/schemas.py" "$BUILD_DIR/"
 cp "$PROJECT_ROOT/lambda_handler.py" "$BUILD_DIR/"
 cp "$PROJECT_ROOT/svg_card.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/events.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/metrics.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/link_graph.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/filename_match.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/book_search.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/negative_cache.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/cache.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/request_stats.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/profiler.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/tracing.py" "$BUILD_DIR/"
+cp "$PROJECT_ROOT/capture.py" "$BUILD_DIR/"
 cp -r "$PROJECT_ROOT/repositories" "$BUILD_DIR/"
 
 # Create zip
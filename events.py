@@ -0,0 +1,91 @@
+"""In-process pub/sub for pushing progress updates to a user's other devices."""
+
+import asyncio
+import os
+import threading
+from typing import Optional
+
+# Events kept per connected device before the oldest ones are dropped
+SUBSCRIBER_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "16"))
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+# Concurrent streams allowed per user
+MAX_STREAMS_PER_USER = int(os.getenv("STREAM_MAX_PER_USER", "10"))
+
+
+class Subscription:
+    """A connected device's bounded event buffer, owned by one event loop."""
+
+    def __init__(self, user_id: str, device_id: Optional[str], buffer_size: int):
+        self.user_id = user_id
+        self.device_id = device_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+
+    def _deliver(self, event: dict) -> None:
+        # Runs on the subscriber's loop. A slow client loses the oldest
+        # updates rather than blocking publishers or growing without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class ProgressEventBus:
+    """Fans progress updates out to every subscription of the same user.
+
+    Publishing is safe from threadpool workers; delivery is handed over to
+    each subscriber's event loop. Subscriptions only see updates published in
+    the same process.
+    """
+
+    def __init__(self, buffer_size: int = SUBSCRIBER_BUFFER_SIZE, max_per_user: int = MAX_STREAMS_PER_USER):
+        self.buffer_size = buffer_size
+        self.max_per_user = max_per_user
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: str, device_id: Optional[str] = None) -> Subscription:
+        """Register a subscription. Must be called from a running event loop.
+
+        Raises ValueError when the user already has the maximum number of streams.
+        """
+        subscription = Subscription(user_id, device_id, self.buffer_size)
+        with self._lock:
+            subscribers = self._subscribers.setdefault(user_id, set())
+            if len(subscribers) >= self.max_per_user:
+                raise ValueError(f"Too many streams for user '{user_id}'")
+            subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: str, event: dict, source_device_id: Optional[str] = None) -> int:
+        """Send an event to the user's subscriptions, skipping the source device.
+
+        Returns the number of subscriptions the event was handed to.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        delivered = 0
+        for subscription in subscribers:
+            if source_device_id and subscription.device_id == source_device_id:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+                delivered += 1
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+        return delivered
+
+
+progress_events = ProgressEventBus()
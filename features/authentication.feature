@@ -13,6 +13,20 @@ Feature: User Authentication
     When I authenticate with username "testuser" and password "wrongpass"
     Then the authentication should fail with status 401
 
+  Scenario: Reject invalid password after a successful login
+    Given a user "cacheduser" with password "correctpass" exists
+    When I authenticate with username "cacheduser" and password "correctpass"
+    Then the authentication should succeed
+    When I authenticate with username "cacheduser" and password "wrongpass"
+    Then the authentication should fail with status 401
+
+  Scenario: Password checks stay out of the shared cache
+    Given a user "authuser" with password "authpass" exists
+    And the shared cache is served over the Redis protocol
+    When I authenticate with username "authuser" and password "authpass"
+    Then the authentication should succeed
+    And the Redis stand-in should hold no password checks
+
   Scenario: Reject unknown username
     When I authenticate with username "unknownuser" and password "anypass"
     Then the authentication should fail with status 401
@@ -0,0 +1,59 @@
+Feature: Performance Tooling
+  As a maintainer
+  I want repeatable load tests
+  So that performance regressions are caught before a release
+
+  Scenario: The load test simulates KOReader readers over HTTP
+    When I run the load test against the server with 3 users and 2 sessions each
+    Then the load test should succeed
+    And the load test report should include, without errors
+      | endpoint                       |
+      | GET /users/auth                |
+      | GET /syncs/progress/{document} |
+      | PUT /syncs/progress            |
+    And the load test report should give ordered latency percentiles
+
+  Scenario: Micro-benchmarks flag a regression against the stored baseline
+    When I run the micro-benchmarks on the memory backend with 10 rows
+    Then the micro-benchmarks should include
+      | benchmark                              |
+      | memory:progress.upsert[10]             |
+      | memory:progress.get_all_by_user[10]    |
+      | memory:document_link.get_canonical[10] |
+      | python:list_books.aggregate[10]        |
+      | python:render_progress_card[5]         |
+    And comparing with a baseline where "memory:progress.upsert[10]" was twice as fast should flag only it
+
+  Scenario: The scale test runs against a large synthetic library
+    Given a synthetic dataset of 20 users with up to 2000 books is loaded
+    When I run the scale test against the server at library sizes 10 and 2000
+    Then the scale test should measure library sizes 10 and 2000
+    And every request of the scale test should succeed and the new editions should auto-link
+
+  Scenario: Captured traffic is pseudonymized and replays with the captured statuses
+    Given traffic is being captured
+    When I register with username "capture-reader" and password "capture-secret"
+    And user "capture-reader" updates progress for document "0b5d4c3f2a1e9d8c7b6a5f4e3d2c1b0a"
+      | progress   | /body/DocFragment[3]/p[7]   |
+      | percentage | 0.25                        |
+      | device     | Kobo Libra                  |
+      | device_id  | capture-device-1            |
+      | filename   | Private Title - Author.epub |
+    And user "capture-reader" retrieves progress for document "0b5d4c3f2a1e9d8c7b6a5f4e3d2c1b0a"
+    And I request the SVG card for user "capture-reader"
+    Then the capture should hold 4 requests
+    And the capture should not contain
+      | text                             |
+      | capture-reader                   |
+      | 0b5d4c3f2a1e9d8c7b6a5f4e3d2c1b0a |
+      | capture-device-1                 |
+      | Private Title                    |
+      | password                         |
+    When I replay the captured traffic against the server
+    Then every replayed request should get its captured status
+
+  Scenario: A Lambda cold start fits the function's memory and timeout
+    When I measure a Lambda cold start requesting "/users/auth" on the memory backend
+    Then the cold start should have answered with status 401
+    And the cold start should fit the memory size and timeout in terraform/lambda.tf
+    And starting the Lambda handler should not import "svg_card"
@@ -113,3 +113,64 @@ Feature: Book Management
       | device_id  | kindle-001  |
     When I request the SVG card for user "reader" with limit 2
     Then the SVG response should succeed
+
+  Scenario: SVG card is cached until the user's books change
+    Given the shared cache is served over the Redis protocol
+    And user "reader" has saved progress for document "cachedcard"
+      | progress   | /body/p[50] |
+      | percentage | 0.50        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When I request the SVG card for user "reader"
+    Then the SVG response should succeed
+    And the Redis stand-in should hold a cached card
+    And the stats should not reveal the cache server
+    When user "reader" sets label "Children of Dune" for book "cachedcard"
+    And I request the SVG card for user "reader"
+    Then the SVG should contain "Children of Dune"
+
+  Scenario: SVG card is rendered while the cache server refuses its password
+    Given the shared cache is served over the Redis protocol with a wrong password
+    And user "reader" has saved progress for document "uncachedcard"
+      | progress   | /body/p[50] |
+      | percentage | 0.50        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When I request the SVG card for user "reader"
+    Then the SVG response should succeed
+    And the shared cache should have counted an error
+
+  Scenario: Linking merges whole groups and keeps links one hop deep
+    Given user "reader" has saved progress for document "edition-a"
+      | progress   | /body/p[40] |
+      | percentage | 0.40        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And user "reader" links documents "edition-a,edition-b"
+    And user "reader" links documents "edition-c,edition-d"
+    When user "reader" links documents "edition-c,edition-a"
+    Then every document link of user "reader" should point at "edition-a"
+    When user "reader" retrieves progress for document "edition-d"
+    Then the progress should show
+      | percentage | 0.40 |
+
+  Scenario: Search books by label and filename
+    Given user "reader" has saved progress for document "gatsby"
+      | progress   | /body/p[10]             |
+      | percentage | 0.10                    |
+      | device     | Kindle                  |
+      | device_id  | kindle-001              |
+      | filename   | The_Great_Gatsby.epub   |
+    And user "reader" has saved progress for document "hailmary"
+      | progress   | /body/p[20]             |
+      | percentage | 0.20                    |
+      | device     | Kindle                  |
+      | device_id  | kindle-001              |
+      | filename   | phm.epub                |
+    When user "reader" searches books for "gats"
+    Then the search should return books "gatsby"
+    When user "reader" searches books for "hail mary"
+    Then the search should return no books
+    When user "reader" sets label "Project Hail Mary" for book "hailmary"
+    And user "reader" searches books for "hail mary"
+    Then the search should return books "hailmary"
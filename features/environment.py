@@ -9,10 +9,20 @@ from sqlalchemy.orm import sessionmaker
 os.environ["DATABASE_URL"] = "sqlite:///./test_data/test.db"
 os.environ["PASSWORD_SALT"] = "test-salt"
 os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["ADMIN_TOKEN"] = "test-admin-token"
+# Keeps the change feed scenarios' waits short
+os.environ["CHANGES_FEED_LAG"] = "0"
+# DB_BACKEND=memory runs the suite against the in-process backend
+os.environ.setdefault("DB_BACKEND", "sql")
 
 from database import Base, engine
 import models  # noqa: F401 - Required to register models with Base.metadata
 from main import app
+from filename_match import filename_matcher
+from book_search import book_search
+from cache import shared_cache
+from auth import auth_cache
+from repositories import DB_BACKEND
 
 
 class ServerThread(threading.Thread):
@@ -47,6 +57,12 @@ def after_all(context):
 
 
 def before_scenario(context, scenario):
+    if "sql" in scenario.effective_tags and DB_BACKEND != "sql":
+        scenario.skip("Requires the SQL backend")
+        return
+    if DB_BACKEND == "memory":
+        from repositories.memory import get_memory_store
+        get_memory_store().clear()
     # Clear all tables before each scenario
     Session = sessionmaker(bind=engine)
     session = Session()
@@ -54,6 +70,11 @@ def before_scenario(context, scenario):
         session.execute(table.delete())
     session.commit()
     session.close()
+    # In-memory indexes outlive the tables they were built from
+    filename_matcher.clear()
+    book_search.clear()
+    shared_cache.clear()
+    auth_cache.cache.clear()
     context.users = {}
     context.last_response = None
     context.last_progress = None
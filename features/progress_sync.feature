@@ -49,3 +49,479 @@ Feature: Progress Synchronization
   Scenario: Unknown document returns 404
     When user "reader" retrieves progress for document "nonexistent"
     Then the request should fail with status 404
+
+  Scenario: Upload progress for several documents in one batch
+    When user "reader" uploads a progress batch
+      | document | progress    | percentage | device | device_id  |
+      | batch1   | /body/p[10] | 0.10       | Kindle | kindle-001 |
+      | batch2   | /body/p[20] | 0.20       | Kindle | kindle-001 |
+    Then the batch upload should report status "success" for "batch1"
+    And the batch upload should report status "success" for "batch2"
+    And user "reader" should have progress for document "batch1"
+    And user "reader" should have progress for document "batch2"
+
+  Scenario: Batch upload auto-links documents sharing a filename
+    When user "reader" uploads a progress batch
+      | document | progress    | percentage | device | device_id  | filename  |
+      | copy1    | /body/p[10] | 0.10       | Kindle | kindle-001 | book.epub |
+      | copy2    | /body/p[20] | 0.20       | Phone  | phone-001  | book.epub |
+    Then the batch upload should report status "success" for "copy2"
+    When user "reader" retrieves progress for document "copy2"
+    Then the progress should show
+      | progress   | /body/p[20] |
+      | percentage | 0.20        |
+      | device     | Phone       |
+
+  Scenario: Auto-linking a batch costs the same round-trips however many books it holds
+    When user "reader" uploads a progress batch
+      | document  | progress    | percentage | device | device_id  | filename     |
+      | kindle-a  | /body/p[10] | 0.10       | Kindle | kindle-001 | alpha.epub   |
+      | kindle-b  | /body/p[10] | 0.10       | Kindle | kindle-001 | beta.epub    |
+      | kindle-c  | /body/p[10] | 0.10       | Kindle | kindle-001 | gamma.epub   |
+      | kindle-d  | /body/p[10] | 0.10       | Kindle | kindle-001 | delta.epub   |
+      | kindle-e  | /body/p[10] | 0.10       | Kindle | kindle-001 | epsilon.epub |
+      | kindle-f  | /body/p[10] | 0.10       | Kindle | kindle-001 | zeta.epub    |
+    Then the request should have made at most 11 database round-trips
+    When user "reader" uploads a progress batch
+      | document  | progress    | percentage | device | device_id  | filename     |
+      | kobo-a    | /body/p[20] | 0.20       | Kobo   | kobo-001   | alpha.epub   |
+      | kobo-b    | /body/p[20] | 0.20       | Kobo   | kobo-001   | beta.epub    |
+      | kobo-c    | /body/p[20] | 0.20       | Kobo   | kobo-001   | gamma.epub   |
+      | kobo-d    | /body/p[20] | 0.20       | Kobo   | kobo-001   | delta.epub   |
+      | kobo-e    | /body/p[20] | 0.20       | Kobo   | kobo-001   | epsilon.epub |
+      | kobo-f    | /body/p[20] | 0.20       | Kobo   | kobo-001   | zeta.epub    |
+    Then the request should have made at most 11 database round-trips
+    When user "reader" retrieves progress for document "kindle-d"
+    Then the progress should show
+      | device | Kobo |
+
+  Scenario: A new copy of a known book is linked through the filename index
+    Given user "reader" has saved progress for document "paper-copy"
+      | progress   | /body/p[30] |
+      | percentage | 0.30        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+      | filename   | novel.epub  |
+    And stored progress is no longer searched by filename
+    When user "reader" updates progress for document "kepub-copy"
+      | progress   | /body/p[35] |
+      | percentage | 0.35        |
+      | device     | Kobo        |
+      | device_id  | kobo-001    |
+      | filename   | novel.epub  |
+    Then the progress update should succeed
+    When user "reader" retrieves progress for document "paper-copy"
+    Then the progress should show
+      | percentage | 0.35 |
+      | device     | Kobo |
+
+  Scenario Outline: Renamed copies of a book are auto-linked
+    Given user "reader" has saved progress for document "original"
+      | progress   | /body/p[30]  |
+      | percentage | 0.30         |
+      | device     | Kindle       |
+      | device_id  | kindle-001   |
+      | filename   | <first_name> |
+    When user "reader" updates progress for document "renamed"
+      | progress   | /body/p[35]   |
+      | percentage | 0.35          |
+      | device     | Kobo          |
+      | device_id  | kobo-001      |
+      | filename   | <second_name> |
+    Then the progress update should succeed
+    When user "reader" retrieves progress for document "original"
+    Then the progress should show
+      | percentage | 0.35 |
+
+    Examples:
+      | first_name                     | second_name                 |
+      | Dune Messiah.epub              | dune messiah (1).kepub.epub |
+      | Dune Messiah.epub              | Dune Messiah - Copy.epub    |
+      | The Left Hand of Darkness.epub | Left_Hand_of_Darkness.epub  |
+
+  Scenario Outline: Different books with similar names are not auto-linked
+    Given user "reader" has saved progress for document "first"
+      | progress   | /body/p[30]  |
+      | percentage | 0.30         |
+      | device     | Kindle       |
+      | device_id  | kindle-001   |
+      | filename   | <first_name> |
+    When user "reader" updates progress for document "second"
+      | progress   | /body/p[5]    |
+      | percentage | 0.05          |
+      | device     | Kindle        |
+      | device_id  | kindle-001    |
+      | filename   | <second_name> |
+    Then the progress update should succeed
+    When user "reader" retrieves progress for document "first"
+    Then the progress should show
+      | percentage | 0.30 |
+
+    Examples:
+      | first_name                              | second_name                               |
+      | Foundation Vol 1.epub                   | Foundation Vol 2.epub                     |
+      | Harry Potter (1).epub                   | Harry Potter (2).epub                     |
+      | Nineteen Eighty-Four (1949).epub        | Nineteen Eighty-Four (1984).epub          |
+      | Photo.epub                              | Photocopy.epub                            |
+      | The Way of Kings Part One.epub          | The Way of Kings Part Two.epub            |
+      | Stormlight Archive Book II.epub         | Stormlight Archive Book III.epub          |
+      | Histoire de France Tome I.epub          | Histoire de France Tome II.epub           |
+      | Encyclopedia Britannica Volume One.epub | Encyclopedia Britannica Volume Two.epub   |
+      | Complete Works of Shakespeare Vol.epub  | Complete Works of Shakespeare Vol II.epub |
+
+  Scenario: Batch upload reports incomplete records without failing the batch
+    When user "reader" uploads a progress batch
+      | document | progress    | percentage | device | device_id  |
+      | good     | /body/p[10] | 0.10       | Kindle | kindle-001 |
+      | bad      |             | 0.20       | Kindle | kindle-001 |
+    Then the batch upload should report status "success" for "good"
+    And the batch upload should report status "invalid" for "bad"
+    When user "reader" retrieves progress for document "bad"
+    Then the request should fail with status 404
+
+  Scenario: Query progress for several documents in one call
+    Given user "reader" has saved progress for document "shelf1"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And user "reader" has saved progress for document "shelf2"
+      | progress   | /body/p[20] |
+      | percentage | 0.20        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When user "reader" queries progress for documents "shelf1,shelf2,unknown"
+    Then the progress query should return 2 documents
+    And the progress query should show percentage 0.20 for "shelf2"
+
+  Scenario: Change feed returns only changes after the watermark
+    Given user "reader" has saved progress for document "feed1"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And the change feed has caught up
+    When user "reader" lists changes since 0
+    Then the change feed should contain progress for "feed1"
+    Given user "reader" has saved progress for document "feed2"
+      | progress   | /body/p[20] |
+      | percentage | 0.20        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And the change feed has caught up
+    When user "reader" lists changes since the last watermark
+    Then the change feed should contain progress for "feed2"
+    And the change feed should not contain progress for "feed1"
+
+  Scenario: Change feed reports deleted links and labels
+    Given user "reader" has saved progress for document "feed-book"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And user "reader" links documents "feed-book,feed-alias"
+    And user "reader" sets label "Feed Book" for book "feed-book"
+    And the change feed has caught up
+    When user "reader" lists changes since 0
+    And user "reader" unlinks document "feed-alias"
+    And user "reader" deletes label for book "feed-book"
+    Given the change feed has caught up
+    When user "reader" lists changes since the last watermark
+    Then the change feed should report the link of "feed-alias" as deleted
+    And the change feed should report the label of "feed-book" as deleted
+
+  Scenario: Progress recorded long ago by an offline device still reaches the change feed
+    Given the server keeps the newest progress
+    And the change feed has caught up
+    When user "reader" lists changes since 0
+    And user "reader" updates progress for document "offline-read" recorded at 1000
+      | progress   | /body/p[15] |
+      | percentage | 0.15        |
+      | device     | Kobo        |
+      | device_id  | kobo-001    |
+    Then the progress update should succeed
+    Given the change feed has caught up
+    When user "reader" lists changes since the last watermark
+    Then the change feed should contain progress for "offline-read"
+
+  Scenario: Progress pushed from one device is streamed to another
+    Given user "reader" is listening for progress updates on device "phone-001"
+    When user "reader" updates progress for document "streamed"
+      | progress   | /body/p[42] |
+      | percentage | 0.42        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then device "phone-001" should receive a progress update for "streamed"
+
+  Scenario: Re-syncing unchanged progress skips the write
+    Given user "reader" has saved progress for document "resync"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And the write counters have been recorded
+    When user "reader" updates progress for document "resync"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then the progress update should succeed
+    And 1 progress write should have been skipped
+
+  Scenario: Request, repository and password check timings are exported for Prometheus
+    Given user "reader" has saved progress for document "measured"
+      | progress   | /body/p[5] |
+      | percentage | 0.05       |
+      | device     | Kindle     |
+      | device_id  | kindle-001 |
+    When user "reader" retrieves progress for document "measured"
+    And I request the Prometheus metrics
+    Then the metrics should include
+      | sample                                                                                          |
+      | http_requests_total{method="GET",route="/syncs/progress/{document}",status="200"}               |
+      | http_request_duration_seconds_bucket{method="PUT",route="/syncs/progress",le="+Inf"}            |
+      | repository_call_duration_seconds_count{backend="sql",repository="progress",method="get_by_user_and_alias"} |
+      | bcrypt_verify_duration_seconds_count                                                            |
+      | threadpool_threads_in_use                                                                       |
+
+  @sql
+  Scenario: Slow statements are reported with redacted parameters and their plans
+    Given every SQL statement counts as slow
+    And user "reader" has saved progress for document "secret-hash"
+      | progress   | /body/p[5] |
+      | percentage | 0.05       |
+      | device     | Kindle     |
+      | device_id  | kindle-001 |
+    When user "reader" retrieves progress for document "secret-hash"
+    And I request the slow query report
+    Then the slow query report should include a plan for a query on "progress"
+    And the slow query report should not mention "secret-hash"
+
+  @sql
+  Scenario: Plans of slow statements keep no bound values
+    Given every SQL statement counts as slow
+    And slow statements are explained with their bound values in the plan, as PostgreSQL does
+    And user "reader" has saved progress for document "secret-hash"
+      | progress   | /body/p[5] |
+      | percentage | 0.05       |
+      | device     | Kindle     |
+      | device_id  | kindle-001 |
+    When user "reader" retrieves progress for document "secret-hash"
+    And I request the slow query report
+    Then the slow query report should include a plan for a query on "progress"
+    And the slow query report should not mention "secret-hash"
+    And the slow query plans should still show "Index Scan using ix_progress on progress"
+
+  Scenario: The slow query report requires the admin token
+    When I request the slow query report without the admin token
+    Then the request should fail with status 401
+
+  Scenario: The sampling profiler captures request handlers on demand
+    Given user "reader" has saved progress for document "profiled"
+      | progress   | /body/p[5] |
+      | percentage | 0.05       |
+      | device     | Kindle     |
+      | device_id  | kindle-001 |
+    And progress lookups take 20 milliseconds
+    When I profile the server for 1 second while user "reader" retrieves progress for document "profiled"
+    Then the collapsed profile should include the frame "get_progress"
+    And the speedscope profile should include the frame "get_progress"
+
+  Scenario: A traced progress update is exported with nested spans
+    Given every request is traced and exported to an OTLP stand-in collector
+    When user "reader" updates progress for document "traced"
+      | progress   | /body/p[5] |
+      | percentage | 0.05       |
+      | device     | Kindle     |
+      | device_id  | kindle-001 |
+    Then the progress update should succeed
+    And the collector should have received a "PUT /syncs/progress" trace with spans
+      | span                 | parent               |
+      | get_current_user     | PUT /syncs/progress  |
+      | user.get_by_username | get_current_user     |
+      | bcrypt.checkpw       | get_current_user     |
+      | progress.upsert      | PUT /syncs/progress  |
+
+  Scenario: A caller's traceparent does not turn tracing on
+    Given tracing is off and spans are exported to an OTLP stand-in collector
+    When I request "/health" with a sampled traceparent header
+    Then the response should not carry a traceparent header
+    And the collector should have received no spans
+
+  Scenario: The trace file is rotated once it is full
+    When 3 batches of spans are exported to a trace file rotated at 1 bytes
+    Then the trace file should hold only "batch-2" and the rotated file only "batch-1"
+
+  Scenario: Stale progress is rejected when the newest progress wins
+    Given the server keeps the newest progress
+    When user "reader" updates progress for document "raced" recorded at 2000
+      | progress   | /body/p[80] |
+      | percentage | 0.80        |
+      | device     | Phone       |
+      | device_id  | phone-001   |
+    Then the progress update should succeed
+    When user "reader" updates progress for document "raced" recorded at 1000
+      | progress   | /body/p[40] |
+      | percentage | 0.40        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then the request should fail with status 409
+    When user "reader" retrieves progress for document "raced"
+    Then the progress should show
+      | progress   | /body/p[80] |
+      | device     | Phone       |
+
+  Scenario: Buffered pushes are coalesced and readable before they are flushed
+    Given progress writes are buffered
+    And the write counters have been recorded
+    And user "reader" has saved progress for document "turning"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When user "reader" updates progress for document "turning"
+      | progress   | /body/p[11] |
+      | percentage | 0.11        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And user "reader" updates progress for document "turning"
+      | progress   | /body/p[12] |
+      | percentage | 0.12        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then 2 buffered pushes should have been coalesced
+    And the database should have no progress for document "turning" of user "reader"
+    When user "reader" retrieves progress for document "turning"
+    Then the progress should show
+      | percentage | 0.12 |
+    When user "reader" lists all books
+    Then a book with hash "turning" should have percentage 0.12
+    When the buffered progress is flushed
+    Then the database should have progress for document "turning" of user "reader" at 0.12
+
+  Scenario: Buffered progress is flushed on an interval
+    Given progress writes are buffered and flushed every 0.2 seconds
+    And user "reader" has saved progress for document "interval"
+      | progress   | /body/p[30] |
+      | percentage | 0.30        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then within 5 seconds the database should have progress for document "interval" of user "reader"
+
+  Scenario: Buffered progress is flushed once enough records are pending
+    Given progress writes are buffered and flushed once 2 records are pending
+    And user "reader" has saved progress for document "first-book"
+      | progress   | /body/p[10] |
+      | percentage | 0.10        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then the database should have no progress for document "first-book" of user "reader"
+    When user "reader" updates progress for document "second-book"
+      | progress   | /body/p[20] |
+      | percentage | 0.20        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then within 5 seconds the database should have progress for document "first-book" of user "reader"
+
+  Scenario: Buffered progress is flushed when the server shuts down
+    Given progress writes are buffered
+    And user "reader" has saved progress for document "shutdown"
+      | progress   | /body/p[50] |
+      | percentage | 0.50        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When the write buffer is stopped
+    Then the database should have progress for document "shutdown" of user "reader" at 0.50
+
+  Scenario: Buffered progress survives a failed flush
+    Given progress writes are buffered
+    And flushing buffered progress fails
+    And user "reader" has saved progress for document "retried"
+      | progress   | /body/p[40] |
+      | percentage | 0.40        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When the buffered progress is flushed
+    Then the database should have no progress for document "retried" of user "reader"
+    When user "reader" retrieves progress for document "retried"
+    Then the progress should show
+      | percentage | 0.40 |
+    When flushing buffered progress works again
+    And the buffered progress is flushed
+    Then the database should have progress for document "retried" of user "reader" at 0.40
+
+  Scenario: A buffered push does not overwrite newer progress stored by another server
+    Given the server keeps the newest progress
+    And progress writes are buffered
+    When user "reader" updates progress for document "contended" recorded at 1000
+      | progress   | /body/p[40] |
+      | percentage | 0.40        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    Then the progress update should succeed
+    Given another server stores progress for document "contended" of user "reader" at 0.80 recorded at 2000
+    When the buffered progress is flushed
+    Then the database should have progress for document "contended" of user "reader" at 0.80
+
+  Scenario: Buffered progress can be pulled through an alias before it is flushed
+    Given progress writes are buffered
+    And user "reader" has saved progress for document "buffered-edition"
+      | progress   | /body/p[27] |
+      | percentage | 0.27        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And user "reader" links documents "buffered-edition,buffered-alias"
+    When user "reader" retrieves progress for document "buffered-alias"
+    Then the progress should show
+      | document   | buffered-edition |
+      | percentage | 0.27             |
+
+  Scenario: Pulls for never-synced documents are answered by the negative cache
+    Given the negative cache is enabled
+    And the write counters have been recorded
+    When user "reader" retrieves progress for document "cached-book"
+    Then the request should fail with status 404
+    Given user "reader" has saved progress for document "cached-book"
+      | progress   | /body/p[12] |
+      | percentage | 0.12        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When user "reader" retrieves progress for document "cached-book"
+    Then the progress should show
+      | percentage | 0.12 |
+    When user "reader" retrieves progress for document "never-synced"
+    Then the request should fail with status 404
+    And the negative cache should have answered 2 pulls
+    Given user "reader" links documents "cached-book,cached-book-kepub"
+    When user "reader" retrieves progress for document "cached-book-kepub"
+    Then the progress should show
+      | percentage | 0.12 |
+
+  Scenario: Pushing the same document again does not fill the negative cache
+    Given the negative cache is enabled
+    And user "reader" has saved progress for document "page-turns"
+      | progress   | /body/p[12] |
+      | percentage | 0.12        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    When user "reader" retrieves progress for document "page-turns"
+    And the negative cache records document "page-turns" 1000 more times
+    And user "reader" retrieves progress for document "page-turns"
+    Then the progress should show
+      | percentage | 0.12 |
+    And the negative cache filter should not have been rebuilt
+
+  @sql
+  Scenario: Pulling progress through an alias is a single lookup
+    Given user "reader" has saved progress for document "main-edition"
+      | progress   | /body/p[64] |
+      | percentage | 0.64        |
+      | device     | Kindle      |
+      | device_id  | kindle-001  |
+    And user "reader" links documents "main-edition,alias-edition"
+    And database statements are being counted
+    When user "reader" retrieves progress for document "alias-edition" while counting statements
+    Then the progress should show
+      | percentage | 0.64 |
+    # One statement authenticates the user, one resolves the alias and reads the progress
+    And 2 database statements should have run
@@ -0,0 +1,198 @@
+import asyncio
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from behave import given, when, then
+
+
+@when("I run the load test against the server with {users:d} users and {sessions:d} sessions each")
+def step_run_load_test(context, users, sessions):
+    from bench.load import main
+    output = os.path.join(tempfile.mkdtemp(), "report.json")
+    context.load_test_exit_code = main([
+        "--url", context.base_url, "--users", str(users), "--sessions", str(sessions),
+        "--concurrency", str(users), "--output", output,
+    ])
+    with open(output, encoding="utf-8") as f:
+        context.load_test_report = json.load(f)
+
+
+@then("the load test should succeed")
+def step_load_test_succeeded(context):
+    assert context.load_test_exit_code == 0, json.dumps(context.load_test_report, indent=2)
+
+
+@then("the load test report should include, without errors")
+def step_load_test_endpoints(context):
+    endpoints = context.load_test_report["endpoints"]
+    for row in context.table:
+        summary = endpoints.get(row["endpoint"])
+        assert summary and summary["count"] > 0, f"No {row['endpoint']} requests in {sorted(endpoints)}"
+        assert summary["errors"] == 0, f"{row['endpoint']}: {summary}"
+
+
+@then("the load test report should give ordered latency percentiles")
+def step_load_test_percentiles(context):
+    for endpoint, summary in context.load_test_report["endpoints"].items():
+        assert summary["p50_ms"] <= summary["p95_ms"] <= summary["p99_ms"] <= summary["max_ms"], (endpoint, summary)
+        assert summary["throughput_rps"] > 0, (endpoint, summary)
+
+
+@when("I run the micro-benchmarks on the memory backend with {rows:d} rows")
+def step_run_micro_benchmarks(context, rows):
+    from bench.micro import run
+    context.micro_results = run(("memory",), sizes=(rows,), min_time=0.01, rounds=2, log=lambda line: None)
+
+
+@then("the micro-benchmarks should include")
+def step_micro_benchmarks_include(context):
+    benchmarks = context.micro_results["benchmarks"]
+    for row in context.table:
+        result = benchmarks.get(row["benchmark"])
+        assert result and result["median_s"] > 0, f"No {row['benchmark']} result in {sorted(benchmarks)}"
+
+
+@then('comparing with a baseline where "{name}" was twice as fast should flag only it')
+def step_micro_benchmarks_regression(context, name):
+    from bench.micro import compare
+    baseline = copy.deepcopy(context.micro_results)
+    baseline["benchmarks"][name]["median_s"] /= 2
+    rows = compare(baseline, context.micro_results, tolerance=0.25)
+    flagged = [row["name"] for row in rows if row["status"] == "regression"]
+    assert flagged == [name], flagged
+
+
+@given("a synthetic dataset of {users:d} users with up to {max_books:d} books is loaded")
+def step_load_dataset(context, users, max_books):
+    from bench.dataset import DatasetConfig, generate, loader_for
+    from repositories import DB_BACKEND
+    context.dataset = DatasetConfig(users=users, max_books=max_books, prefix=f"scale-{uuid.uuid4().hex[:8]}")
+    loader_for(DB_BACKEND).load(context.dataset, generate(context.dataset))
+
+
+@when("I run the scale test against the server at library sizes {small:d} and {large:d}")
+def step_run_scale_test(context, small, large):
+    from bench.load import http_client
+    from bench.scale import run_scale
+
+    async def run():
+        async with http_client(context.base_url, 1) as client:
+            return await run_scale(client, context.dataset, (small, large), iterations=5)
+
+    context.scale_report = asyncio.run(run())
+
+
+@then("the scale test should measure library sizes {small:d} and {large:d}")
+def step_scale_test_libraries(context, small, large):
+    sizes = context.scale_report["sizes"]
+    assert list(sizes) == [str(small), str(large)], list(sizes)
+    # The largest library is generated at exactly max_books; smaller ones are the closest the dataset has
+    assert sizes[str(large)]["books"] == large, sizes[str(large)]["books"]
+    for result in sizes.values():
+        assert result["endpoints"], f"Nothing measured for {result['books']} books"
+
+
+@then("every request of the scale test should succeed and the new editions should auto-link")
+def step_scale_test_succeeds(context):
+    # Latency budgets are checked by python -m bench.scale; too few samples here for a stable p95
+    from bench.scale import check_budgets
+    problems = check_budgets(context.scale_report, {})
+    assert not problems, "\n".join(problems)
+
+
+@given("traffic is being captured")
+def step_capture_traffic(context):
+    from capture import Pseudonymizer, capture
+    context.capture_file = os.path.join(tempfile.mkdtemp(), "capture.jsonl")
+    context.add_cleanup(setattr, capture, "pseudonymizer", capture.pseudonymizer)
+    context.add_cleanup(setattr, capture, "path", capture.path)
+    context.add_cleanup(capture.close)
+    capture.pseudonymizer = Pseudonymizer(b"test-capture-key")
+    capture.path = context.capture_file
+
+
+def _captured_lines(context) -> list[str]:
+    with open(context.capture_file, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+@then("the capture should hold {count:d} requests")
+def step_capture_count(context, count):
+    # Records are written once the response has been sent
+    deadline = time.monotonic() + 2
+    while len(_captured_lines(context)) < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    lines = _captured_lines(context)
+    assert len(lines) == count, lines
+
+
+@then("the capture should not contain")
+def step_capture_excludes(context):
+    content = "\n".join(_captured_lines(context))
+    for row in context.table:
+        assert row["text"] not in content, f"{row['text']!r} found in {content}"
+
+
+@when("I replay the captured traffic against the server")
+def step_replay_capture(context):
+    from bench.load import http_client
+    from bench.replay import load_capture, replay
+    from capture import capture
+    # Replayed requests are not captured again
+    capture.path = ""
+    context.captured_records = load_capture(context.capture_file)
+
+    async def run():
+        async with http_client(context.base_url, 10) as client:
+            return await replay(client, context.captured_records, speed=0)
+
+    context.replay_report = asyncio.run(run())
+
+
+@then("every replayed request should get its captured status")
+def step_replay_statuses(context):
+    report = context.replay_report
+    assert report["total"]["count"] == len(context.captured_records), report
+    assert report["total"]["errors"] == 0, report
+    assert report["status_mismatches"] == {}, report["status_mismatches"]
+
+
+def _lambda_environment() -> dict:
+    env = {**os.environ, "DB_BACKEND": "memory"}
+    env.pop("MEMORY_SNAPSHOT_PATH", None)
+    return env
+
+
+@when('I measure a Lambda cold start requesting "{path}" on the memory backend')
+def step_measure_cold_start(context, path):
+    from bench.coldstart import function_url_event, measure_cold_start, summarize
+    event = function_url_event(path, {"x-auth-user": "coldstart-nobody", "x-auth-key": "0" * 32})
+    context.cold_start = summarize([measure_cold_start(_lambda_environment(), event, prime=True)])
+
+
+@then("the cold start should have answered with status {status:d}")
+def step_cold_start_status(context, status):
+    assert context.cold_start["statuses"] == [status], context.cold_start
+
+
+@then("the cold start should fit the memory size and timeout in terraform/lambda.tf")
+def step_cold_start_limits(context):
+    from bench.coldstart import check_limits, lambda_limits
+    problems = check_limits({"primed": context.cold_start}, lambda_limits())
+    assert not problems, problems
+
+
+@then('starting the Lambda handler should not import "{module}"')
+def step_lambda_handler_imports(context, module):
+    from bench.coldstart import PROJECT_ROOT
+    result = subprocess.run(
+        [sys.executable, "-c", f"import sys, lambda_handler; print({module!r} in sys.modules)"],
+        cwd=PROJECT_ROOT, env=_lambda_environment(), capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.strip() == "False", f"{module} is imported with the Lambda handler"
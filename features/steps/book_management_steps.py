@@ -127,3 +127,119 @@ def step_svg_contains_text(context, text):
     svg_content = context.last_response.text
     assert text in svg_content, \
         f"Expected SVG to contain '{text}', but it doesn't. SVG content: {svg_content[:500]}"
+
+
+@given("the shared cache is served over the Redis protocol")
+def step_shared_cache_over_resp(context):
+    use_resp_stand_in(context)
+
+
+@given("the shared cache is served over the Redis protocol with a wrong password")
+def step_shared_cache_wrong_password(context):
+    from cache import CACHE_ERRORS
+
+    context.cache_errors = CACHE_ERRORS.value
+    use_resp_stand_in(context, password="secret", client_password="wrong")
+
+
+def use_resp_stand_in(context, password=None, client_password=None):
+    # Point the server's caches at a Redis-protocol stand-in for one scenario
+    import main
+    from cache import RedisCache, RespStandIn
+
+    context.resp_stand_in = RespStandIn(password=password).start()
+    context.add_cleanup(context.resp_stand_in.stop)
+    url = context.resp_stand_in.url
+    if client_password:
+        url = url.replace("redis://", f"redis://:{client_password}@")
+    redis_cache = RedisCache(url)
+    context.add_cleanup(setattr, main.card_cache, "cache", main.card_cache.cache)
+    main.card_cache.cache = redis_cache
+    context.add_cleanup(setattr, main, "shared_cache", main.shared_cache)
+    main.shared_cache = redis_cache
+
+
+@then("the shared cache should have counted an error")
+def step_shared_cache_error(context):
+    from cache import CACHE_ERRORS
+
+    assert CACHE_ERRORS.value > context.cache_errors, "No cache error was counted"
+
+
+@then("the Redis stand-in should hold no password checks")
+def step_stand_in_holds_no_auth(context):
+    keys = context.resp_stand_in.cache._entries
+    assert not any(key.startswith("kosync:auth:") for key in keys), \
+        f"Password checks reached the shared cache: {list(keys)}"
+
+
+@then("the stats should not reveal the cache server")
+def step_stats_hide_cache_server(context):
+    response = httpx.get(f"{context.base_url}/stats")
+    assert response.status_code == 200
+    cache = response.json()["cache"]
+    assert cache["backend"] == "redis", f"Unexpected cache stats {cache}"
+    port = str(context.resp_stand_in.server_address[1])
+    assert port not in response.text, f"/stats reveals the cache server: {cache}"
+
+
+@then("the Redis stand-in should hold a cached card")
+def step_stand_in_holds_card(context):
+    keys = context.resp_stand_in.cache._entries
+    assert any(key.startswith("kosync:card:") and not key.endswith(":version") for key in keys), \
+        f"No cached card in {list(keys)}"
+
+
+@when('user "{username}" links documents "{hashes}"')
+@given('user "{username}" links documents "{hashes}"')
+def step_link_documents(context, username, hashes):
+    context.last_response = httpx.post(
+        f"{context.base_url}/documents/link",
+        headers=get_auth_headers(context, username),
+        json={"hashes": hashes.split(",")},
+    )
+    assert context.last_response.status_code == 201, context.last_response.text
+
+
+@when('user "{username}" unlinks document "{document_hash}"')
+def step_unlink_document(context, username, document_hash):
+    context.last_response = httpx.delete(
+        f"{context.base_url}/documents/link/{document_hash}",
+        headers=get_auth_headers(context, username),
+    )
+    assert context.last_response.status_code == 200, context.last_response.text
+
+
+@then('every document link of user "{username}" should point at "{canonical_hash}"')
+def step_check_links_flat(context, username, canonical_hash):
+    response = httpx.get(
+        f"{context.base_url}/documents/links",
+        headers=get_auth_headers(context, username),
+    )
+    assert response.status_code == 200
+    links = response.json()
+    assert links, "Expected at least one link"
+    for link in links:
+        assert link["canonical_hash"] == canonical_hash, f"{link} does not point at {canonical_hash}"
+
+
+@when('user "{username}" searches books for "{query}"')
+def step_search_books(context, username, query):
+    context.last_response = httpx.get(
+        f"{context.base_url}/books/search",
+        headers=get_auth_headers(context, username),
+        params={"q": query},
+    )
+    assert context.last_response.status_code == 200, context.last_response.text
+    context.last_books = context.last_response.json()
+
+
+@then('the search should return books "{hashes}"')
+def step_check_search_results(context, hashes):
+    found = [book["canonical_hash"] for book in context.last_books["books"]]
+    assert found == hashes.split(","), f"Expected {hashes}, got {found}"
+
+
+@then("the search should return no books")
+def step_check_search_empty(context):
+    assert context.last_books["books"] == [], f"Expected no books, got {context.last_books['books']}"
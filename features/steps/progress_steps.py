@@ -1,4 +1,10 @@
 import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
 import httpx
 from behave import given, when, then, register_type
 import parse
@@ -43,16 +49,19 @@ def get_auth_headers(context, username):
 @given('user "{username}" has saved progress for document "{document}"')
 def step_user_has_progress(context, username, document):
     data = table_to_dict(context.table)
+    payload = {
+        "document": document,
+        "progress": data["progress"],
+        "percentage": float(data["percentage"]),
+        "device": data["device"],
+        "device_id": data["device_id"],
+    }
+    if "filename" in data:
+        payload["filename"] = data["filename"]
     response = httpx.put(
         f"{context.base_url}/syncs/progress",
         headers=get_auth_headers(context, username),
-        json={
-            "document": document,
-            "progress": data["progress"],
-            "percentage": float(data["percentage"]),
-            "device": data["device"],
-            "device_id": data["device_id"],
-        },
+        json=payload,
     )
     assert response.status_code == 200, f"Failed to save progress: {response.text}"
 
@@ -60,16 +69,19 @@ def step_user_has_progress(context, username, document):
 @when('user "{username}" updates progress for document "{document}"')
 def step_update_progress(context, username, document):
     data = table_to_dict(context.table)
+    payload = {
+        "document": document,
+        "progress": data["progress"],
+        "percentage": float(data["percentage"]),
+        "device": data["device"],
+        "device_id": data["device_id"],
+    }
+    if "filename" in data:
+        payload["filename"] = data["filename"]
     context.last_response = httpx.put(
         f"{context.base_url}/syncs/progress",
         headers=get_auth_headers(context, username),
-        json={
-            "document": document,
-            "progress": data["progress"],
-            "percentage": float(data["percentage"]),
-            "device": data["device"],
-            "device_id": data["device_id"],
-        },
+        json=payload,
     )
 
 
@@ -124,6 +136,9 @@ def step_progress_shows(context):
     expected = table_to_dict(context.table)
     actual = context.last_progress
 
+    if "document" in expected:
+        assert actual["document"] == expected["document"], \
+            f"Expected document {expected['document']}, got {actual['document']}"
     if "progress" in expected:
         assert actual["progress"] == expected["progress"], \
             f"Expected progress {expected['progress']}, got {actual['progress']}"
@@ -142,3 +157,592 @@ def step_progress_shows(context):
 def step_request_fail(context, status):
     assert context.last_response.status_code == status, \
         f"Expected status {status}, got {context.last_response.status_code}"
+
+
+@when('user "{username}" uploads a progress batch')
+def step_upload_progress_batch(context, username):
+    batch = []
+    for row in context.table:
+        record = {
+            "document": row["document"],
+            "progress": row["progress"],
+            "percentage": float(row["percentage"]),
+            "device": row["device"],
+            "device_id": row["device_id"],
+        }
+        if "filename" in row.headings:
+            record["filename"] = row["filename"]
+        batch.append(record)
+    context.last_response = httpx.put(
+        f"{context.base_url}/syncs/progress/batch",
+        headers=get_auth_headers(context, username),
+        json=batch,
+    )
+    assert context.last_response.status_code == 200, \
+        f"Batch upload failed: {context.last_response.text}"
+
+
+@then("the request should have made at most {count:d} database round-trips")
+def step_max_round_trips(context, count):
+    # Read back from the Server-Timing header: db;dur=...;desc="N calls, M round-trips"
+    timing = context.last_response.headers.get("server-timing", "")
+    match = re.search(r'(\d+) round-trips', timing)
+    assert match, f"No round-trip count in Server-Timing: {timing!r}"
+    assert int(match.group(1)) <= count, \
+        f"Expected at most {count} round-trips, got {match.group(1)} ({timing})"
+
+
+@then('the batch upload should report status "{status}" for "{document}"')
+def step_batch_item_status(context, status, document):
+    results = context.last_response.json()["results"]
+    result = next((r for r in results if r["document"] == document), None)
+    assert result is not None, f"No batch result for document {document}"
+    assert result["status"] == status, \
+        f"Expected status {status} for {document}, got {result['status']}"
+
+
+@when('user "{username}" queries progress for documents "{documents}"')
+def step_query_progress(context, username, documents):
+    context.last_response = httpx.post(
+        f"{context.base_url}/syncs/progress/query",
+        headers=get_auth_headers(context, username),
+        json={"documents": documents.split(",")},
+    )
+    assert context.last_response.status_code == 200, \
+        f"Progress query failed: {context.last_response.text}"
+
+
+@then("the progress query should return {count:d} documents")
+def step_query_count(context, count):
+    progress = context.last_response.json()["progress"]
+    assert len(progress) == count, f"Expected {count} documents, got {len(progress)}"
+
+
+@then('the progress query should show percentage {percentage:f} for "{document}"')
+def step_query_percentage(context, percentage, document):
+    progress = context.last_response.json()["progress"]
+    assert document in progress, f"Document {document} missing from query result"
+    assert abs(progress[document]["percentage"] - percentage) < 0.001, \
+        f"Expected percentage {percentage}, got {progress[document]['percentage']}"
+
+
+@given("the change feed has caught up")
+def step_change_feed_caught_up(context):
+    # The feed only reports whole seconds that passed CHANGES_FEED_LAG seconds ago
+    import main
+    time.sleep(1.1 + main.CHANGES_FEED_LAG)
+
+
+@when('user "{username}" lists changes since {since:d}')
+def step_list_changes(context, username, since):
+    context.last_response = httpx.get(
+        f"{context.base_url}/syncs/changes",
+        headers=get_auth_headers(context, username),
+        params={"since": since},
+    )
+    assert context.last_response.status_code == 200, \
+        f"Change feed failed: {context.last_response.text}"
+    context.last_changes = context.last_response.json()
+
+
+@when('user "{username}" lists changes since the last watermark')
+def step_list_changes_since_watermark(context, username):
+    step_list_changes(context, username, context.last_changes["next_since"])
+
+
+@then('the change feed should contain progress for "{document}"')
+def step_changes_contain(context, document):
+    documents = [p["document"] for p in context.last_changes["progress"]]
+    assert document in documents, f"Expected {document} in change feed, got {documents}"
+
+
+@then('the change feed should not contain progress for "{document}"')
+def step_changes_not_contain(context, document):
+    documents = [p["document"] for p in context.last_changes["progress"]]
+    assert document not in documents, f"Did not expect {document} in change feed, got {documents}"
+
+
+@then('the change feed should report the {kind} of "{document}" as deleted')
+def step_changes_report_deletion(context, kind, document):
+    deleted = context.last_changes[f"deleted_{kind}s"]
+    assert document in deleted, f"Expected {document} in deleted {kind}s, got {deleted}"
+
+
+@given('user "{username}" is listening for progress updates on device "{device_id}"')
+def step_listen_for_updates(context, username, device_id):
+    context.stream_events = []
+    connected = threading.Event()
+
+    def listen():
+        with httpx.stream(
+            "GET",
+            f"{context.base_url}/syncs/stream",
+            headers=get_auth_headers(context, username),
+            params={"device_id": device_id},
+            timeout=10,
+        ) as response:
+            for line in response.iter_lines():
+                connected.set()
+                if line.startswith("data: "):
+                    context.stream_events.append(json.loads(line[len("data: "):]))
+                    return
+
+    context.stream_thread = threading.Thread(target=listen, daemon=True)
+    context.stream_thread.start()
+    assert connected.wait(timeout=5), "Progress stream did not connect"
+
+
+@then('device "{device_id}" should receive a progress update for "{document}"')
+def step_receive_update(context, device_id, document):
+    context.stream_thread.join(timeout=5)
+    documents = [event["document"] for event in context.stream_events]
+    assert document in documents, f"Expected streamed update for {document}, got {documents}"
+
+
+def get_counters(context):
+    response = httpx.get(f"{context.base_url}/stats")
+    assert response.status_code == 200
+    return response.json()["counters"]
+
+
+@given("the write counters have been recorded")
+def step_record_counters(context):
+    context.recorded_counters = get_counters(context)
+
+
+@then("{count:d} progress write should have been skipped")
+def step_writes_skipped(context, count):
+    before = context.recorded_counters["progress_writes_skipped_total"]
+    after = get_counters(context)["progress_writes_skipped_total"]
+    assert after - before == count, f"Expected {count} skipped writes, got {after - before}"
+
+
+@when("I request the Prometheus metrics")
+def step_request_metrics(context):
+    context.last_response = httpx.get(f"{context.base_url}/metrics")
+    assert context.last_response.status_code == 200
+
+
+@then("the metrics should include")
+def step_metrics_include(context):
+    from repositories import DB_BACKEND
+    samples = {line.rsplit(" ", 1)[0] for line in context.last_response.text.splitlines() if not line.startswith("#")}
+    for row in context.table:
+        sample = row["sample"].replace('backend="sql"', f'backend="{DB_BACKEND}"')
+        assert sample in samples, f"{sample} not in metrics:\n{context.last_response.text}"
+
+
+@given("every SQL statement counts as slow")
+def step_all_statements_slow(context):
+    from slow_queries import slow_query_log
+    previous = slow_query_log.threshold_ms
+    slow_query_log.threshold_ms = 0
+    slow_query_log.clear()
+    context.add_cleanup(setattr, slow_query_log, "threshold_ms", previous)
+
+
+@given("slow statements are explained with their bound values in the plan, as PostgreSQL does")
+def step_explain_with_literals(context):
+    # psycopg2 interpolates parameters, so PostgreSQL plans show them as literals
+    from slow_queries import slow_query_log
+
+    def explain(cursor, statement, parameters):
+        values = parameters.values() if isinstance(parameters, dict) else parameters
+        conditions = " AND ".join(
+            f"(c{i} = '{value}'::text)" if isinstance(value, str) else f"(c{i} = {value})"
+            for i, value in enumerate(values)
+        )
+        table = re.search(r"FROM (\w+)", statement).group(1)
+        return [f"Index Scan using ix_{table} on {table}  (cost=0.15..8.17 rows=1 width=76)",
+                f"  Index Cond: ({conditions})"]
+
+    slow_query_log._run_explain = explain
+    context.add_cleanup(delattr, slow_query_log, "_run_explain")
+
+
+@then('the slow query plans should still show "{text}"')
+def step_slow_query_plan_shows(context, text):
+    plans = [line for q in context.last_response.json()["top"] for line in q["plan"] or []]
+    assert any(text in line for line in plans), plans
+
+
+@when("I request the slow query report")
+def step_request_slow_queries(context):
+    context.last_response = httpx.get(
+        f"{context.base_url}/admin/slow-queries",
+        params={"limit": 100},
+        headers={"x-admin-token": "test-admin-token"},
+    )
+    assert context.last_response.status_code == 200, context.last_response.text
+
+
+@when("I request the slow query report without the admin token")
+def step_request_slow_queries_unauthenticated(context):
+    context.last_response = httpx.get(f"{context.base_url}/admin/slow-queries")
+
+
+@then('the slow query report should include a plan for a query on "{table}"')
+def step_slow_query_plan(context, table):
+    top = context.last_response.json()["top"]
+    planned = [q for q in top if f"FROM {table}" in q["statement"] and q["plan"]]
+    assert planned, f"No planned query on {table} in {[q['statement'] for q in top]}"
+
+
+@then('the slow query report should not mention "{text}"')
+def step_slow_query_redacted(context, text):
+    assert text not in context.last_response.text, f"{text} leaked into the slow query report"
+
+
+@given("progress lookups take {milliseconds:d} milliseconds")
+def step_slow_progress_lookups(context, milliseconds):
+    from repositories import DB_BACKEND
+    if DB_BACKEND == "memory":
+        from repositories.memory import MemoryProgressRepository as repository_class
+    else:
+        from repositories.sql import SQLProgressRepository as repository_class
+
+    previous = repository_class.get_by_user_and_alias
+
+    def slow(self, user_id, document):
+        time.sleep(milliseconds / 1000)
+        return previous(self, user_id, document)
+
+    repository_class.get_by_user_and_alias = slow
+    context.add_cleanup(setattr, repository_class, "get_by_user_and_alias", previous)
+
+
+@when('I profile the server for {seconds:d} second while user "{username}" retrieves progress for document "{document}"')
+def step_profile_while_retrieving(context, seconds, username, document):
+    admin = {"x-admin-token": "test-admin-token"}
+    response = httpx.post(f"{context.base_url}/admin/profiler/start", params={"seconds": seconds}, headers=admin)
+    assert response.status_code == 200, response.text
+    context.add_cleanup(httpx.post, f"{context.base_url}/admin/profiler/stop", headers=admin)
+    headers = get_auth_headers(context, username)
+    deadline = time.monotonic() + seconds
+    with httpx.Client(base_url=context.base_url, headers=headers) as client:
+        while time.monotonic() < deadline:
+            client.get(f"/syncs/progress/{document}")
+    httpx.post(f"{context.base_url}/admin/profiler/stop", headers=admin)
+
+
+@then('the {fmt} profile should include the frame "{function}"')
+def step_profile_includes_frame(context, fmt, function):
+    response = httpx.get(
+        f"{context.base_url}/admin/profiler/profile",
+        params={"format": fmt},
+        headers={"x-admin-token": "test-admin-token"},
+    )
+    assert response.status_code == 200, response.text
+    if fmt == "speedscope":
+        frames = [frame["name"] for frame in response.json()["shared"]["frames"]]
+    else:
+        frames = [frame for line in response.text.splitlines() for frame in line.rsplit(" ", 1)[0].split(";")]
+    assert any(frame.startswith(f"{function} (") for frame in frames), f"No {function} frame in {frames}"
+
+
+@given("every request is traced and exported to an OTLP stand-in collector")
+def step_trace_to_collector(context):
+    from tracing import tracer, CollectorStandIn, OTLPExporter
+    collector = CollectorStandIn().start()
+    context.add_cleanup(collector.stop)
+    context.trace_collector = collector
+    for name, value in (("exporter", OTLPExporter(collector.url)), ("sample_rate", 1.0)):
+        context.add_cleanup(setattr, tracer, name, getattr(tracer, name))
+        setattr(tracer, name, value)
+
+
+@given("tracing is off and spans are exported to an OTLP stand-in collector")
+def step_tracing_off(context):
+    from tracing import tracer, CollectorStandIn, OTLPExporter
+    collector = CollectorStandIn().start()
+    context.add_cleanup(collector.stop)
+    context.trace_collector = collector
+    for name, value in (("exporter", OTLPExporter(collector.url)), ("sample_rate", 0.0)):
+        context.add_cleanup(setattr, tracer, name, getattr(tracer, name))
+        setattr(tracer, name, value)
+
+
+@when('I request "{path}" with a sampled traceparent header')
+def step_request_with_traceparent(context, path):
+    context.last_response = httpx.get(
+        f"{context.base_url}{path}",
+        headers={"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"},
+    )
+
+
+@then("the response should not carry a traceparent header")
+def step_no_traceparent(context):
+    assert context.last_response.status_code == 200, context.last_response.text
+    assert "traceparent" not in context.last_response.headers, context.last_response.headers
+
+
+@then("the collector should have received no spans")
+def step_collector_received_nothing(context):
+    from tracing import tracer
+    tracer.flush()
+    assert context.trace_collector.spans() == [], context.trace_collector.spans()
+
+
+@when("{count:d} batches of spans are exported to a trace file rotated at {max_bytes:d} bytes")
+def step_export_to_rotated_file(context, count, max_bytes):
+    from tracing import FileExporter, Span
+    context.trace_file = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+    exporter = FileExporter(context.trace_file, max_bytes=max_bytes)
+    for batch in range(count):
+        exporter.export([Span(f"batch-{batch}", f"{batch:032x}")])
+
+
+@then('the trace file should hold only "{current}" and the rotated file only "{rotated}"')
+def step_trace_files_hold(context, current, rotated):
+    for path, name in ((context.trace_file, current), (context.trace_file + ".1", rotated)):
+        with open(path, encoding="utf-8") as f:
+            names = [
+                span["name"]
+                for line in f
+                for resource_spans in json.loads(line)["resourceSpans"]
+                for scope_spans in resource_spans["scopeSpans"]
+                for span in scope_spans["spans"]
+            ]
+        assert names == [name], (path, names)
+
+
+@then('the collector should have received a "{root_name}" trace with spans')
+def step_collector_received_trace(context, root_name):
+    from tracing import tracer
+    # The root span ends just after the response is sent
+    deadline = time.monotonic() + 2
+    while True:
+        tracer.flush()
+        spans = context.trace_collector.spans()
+        roots = [span for span in spans if span["name"] == root_name]
+        if roots or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert roots, f"No {root_name} span in {[span['name'] for span in spans]}"
+    trace = {span["spanId"]: span for span in spans if span["traceId"] == roots[0]["traceId"]}
+    names = {span_id: span["name"] for span_id, span in trace.items()}
+    for row in context.table:
+        children = [span for span in trace.values() if span["name"] == row["span"]]
+        assert children, f"No {row['span']} span in {sorted(names.values())}"
+        parents = [names.get(span.get("parentSpanId")) for span in children]
+        assert row["parent"] in parents, f"{row['span']} is a child of {parents}, not {row['parent']}"
+
+
+@given("the server keeps the newest progress")
+def step_newest_progress_policy(context):
+    # The server runs in-process, so the policy can be switched for one scenario
+    import main
+    previous = main.PROGRESS_CONFLICT_POLICY
+    main.PROGRESS_CONFLICT_POLICY = "newest"
+    context.add_cleanup(setattr, main, "PROGRESS_CONFLICT_POLICY", previous)
+
+
+@when('user "{username}" updates progress for document "{document}" recorded at {timestamp:d}')
+def step_update_progress_at(context, username, document, timestamp):
+    data = table_to_dict(context.table)
+    context.last_response = httpx.put(
+        f"{context.base_url}/syncs/progress",
+        headers=get_auth_headers(context, username),
+        json={
+            "document": document,
+            "progress": data["progress"],
+            "percentage": float(data["percentage"]),
+            "device": data["device"],
+            "device_id": data["device_id"],
+            "timestamp": timestamp,
+        },
+    )
+
+
+@given("stored progress is no longer searched by filename")
+def step_disable_filename_search(context):
+    # Auto-linking a known filename must be answered by the filename index
+    from repositories import DB_BACKEND
+    if DB_BACKEND == "memory":
+        from repositories.memory import MemoryProgressRepository as repository_class
+    else:
+        from repositories.sql import SQLProgressRepository as repository_class
+
+    def fail(self, user_id, filenames):
+        raise AssertionError(f"Searched stored progress for {filenames}")
+
+    previous = repository_class.get_all_by_user_and_filenames
+    repository_class.get_all_by_user_and_filenames = fail
+    context.add_cleanup(setattr, repository_class, "get_all_by_user_and_filenames", previous)
+
+
+@given("progress writes are buffered")
+def step_buffer_progress_writes(context):
+    # Write-behind for one scenario; nothing is flushed unless a step asks for it
+    use_write_buffer(context, flush_interval=3600)
+
+
+@given("progress writes are buffered and flushed every {seconds:g} seconds")
+def step_buffer_progress_writes_interval(context, seconds):
+    use_write_buffer(context, flush_interval=seconds)
+
+
+@given("progress writes are buffered and flushed once {count:d} records are pending")
+def step_buffer_progress_writes_size(context, count):
+    use_write_buffer(context, flush_interval=3600, max_pending=count)
+
+
+def use_write_buffer(context, flush_interval, max_pending=500):
+    import repositories
+    from contextlib import contextmanager
+    from repositories.write_behind import ProgressWriteBuffer
+
+    buffer = ProgressWriteBuffer(
+        contextmanager(repositories._progress_repository), flush_interval=flush_interval, max_pending=max_pending,
+    )
+    context.add_cleanup(setattr, repositories, "progress_write_buffer", repositories.progress_write_buffer)
+    repositories.progress_write_buffer = buffer
+    buffer.start()
+    context.add_cleanup(buffer.stop)
+    context.write_buffer = buffer
+
+
+@given("flushing buffered progress fails")
+def step_buffer_flush_fails(context):
+    from contextlib import contextmanager
+
+    @contextmanager
+    def unavailable():
+        raise ConnectionError("database unavailable")
+        yield
+
+    buffer = context.write_buffer
+    context.add_cleanup(setattr, buffer, "repository_factory", buffer.repository_factory)
+    context.working_repository_factory = buffer.repository_factory
+    buffer.repository_factory = unavailable
+
+
+@when("flushing buffered progress works again")
+def step_buffer_flush_works(context):
+    context.write_buffer.repository_factory = context.working_repository_factory
+
+
+@when("the buffered progress is flushed")
+def step_flush_buffer(context):
+    context.write_buffer.flush()
+
+
+@when("the write buffer is stopped")
+def step_stop_buffer(context):
+    # What the app does at shutdown
+    context.write_buffer.stop()
+
+
+def stored_progress(username, document):
+    """Progress in the database itself, bypassing the write buffer."""
+    import repositories
+    from contextlib import contextmanager
+
+    with contextmanager(repositories.get_user_repository)() as user_repo:
+        user = user_repo.get_by_username(username)
+    with contextmanager(repositories._progress_repository)() as progress_repo:
+        return progress_repo.get_by_user_and_document(user.id, document)
+
+
+@given('another server stores progress for document "{document}" of user "{username}" at {percentage:f} recorded at {timestamp:d}')
+def step_other_server_stores_progress(context, document, username, percentage, timestamp):
+    # Straight to the database, as a worker or instance without this buffer would
+    import repositories
+    from contextlib import contextmanager
+    from repositories.protocols import ProgressEntity
+
+    with contextmanager(repositories.get_user_repository)() as user_repo:
+        user = user_repo.get_by_username(username)
+    with contextmanager(repositories._progress_repository)() as progress_repo:
+        progress_repo.upsert(ProgressEntity(
+            user_id=user.id, document=document, progress=f"/body/p[{int(percentage * 100)}]",
+            percentage=percentage, device="Phone", device_id="phone-001", timestamp=timestamp,
+        ))
+
+
+@then('the database should have no progress for document "{document}" of user "{username}"')
+def step_no_stored_progress(context, document, username):
+    progress = stored_progress(username, document)
+    assert progress is None, f"Expected nothing stored yet, found percentage {progress.percentage}"
+
+
+@then('the database should have progress for document "{document}" of user "{username}" at {percentage:f}')
+def step_stored_progress(context, document, username, percentage):
+    progress = stored_progress(username, document)
+    assert progress is not None, f"No stored progress for {document}"
+    assert abs(progress.percentage - percentage) < 0.001, \
+        f"Expected stored percentage {percentage}, got {progress.percentage}"
+
+
+@then('within {seconds:d} seconds the database should have progress for document "{document}" of user "{username}"')
+def step_stored_progress_eventually(context, seconds, document, username):
+    deadline = time.monotonic() + seconds
+    while stored_progress(username, document) is None:
+        assert time.monotonic() < deadline, f"Progress for {document} was not flushed within {seconds} seconds"
+        time.sleep(0.05)
+
+
+@then("{count:d} buffered pushes should have been coalesced")
+def step_pushes_coalesced(context, count):
+    before = context.recorded_counters.get("progress_writes_coalesced_total", 0)
+    after = get_counters(context)["progress_writes_coalesced_total"]
+    assert after - before == count, f"Expected {count} coalesced pushes, got {after - before}"
+
+
+@given("the negative cache is enabled")
+def step_enable_negative_cache(context):
+    import main
+    from negative_cache import NegativeCache
+    previous = main.negative_cache
+    main.negative_cache = NegativeCache()
+    context.add_cleanup(setattr, main, "negative_cache", previous)
+
+
+@when('the negative cache records document "{document}" {count:d} more times')
+def step_negative_cache_add_repeatedly(context, document, count):
+    # As every push of the document does, for the one user with a filter
+    import main
+    user_id, context.negative_filter = next(iter(main.negative_cache._users.items()))
+    for _ in range(count):
+        main.negative_cache.add(user_id, [document])
+
+
+@then("the negative cache filter should not have been rebuilt")
+def step_negative_cache_not_rebuilt(context):
+    import main
+    assert context.negative_filter in main.negative_cache._users.values(), "The user's filter was rebuilt"
+    assert context.negative_filter.bloom.count <= 1, \
+        f"Expected one distinct hash counted, got {context.negative_filter.bloom.count}"
+
+
+@then("the negative cache should have answered {count:d} pulls")
+def step_negative_cache_answered(context, count):
+    before = context.recorded_counters.get("negative_cache_short_circuited_total", 0)
+    after = get_counters(context)["negative_cache_short_circuited_total"]
+    assert after - before == count, f"Expected {count} short-circuited pulls, got {after - before}"
+
+
+@given("database statements are being counted")
+def step_count_statements(context):
+    from sqlalchemy import event
+    from database import engine
+
+    context.statements = []
+
+    def record(conn, cursor, statement, parameters, execution_context, executemany):
+        context.statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    context.add_cleanup(event.remove, engine, "before_cursor_execute", record)
+
+
+@when('user "{username}" retrieves progress for document "{document}" while counting statements')
+def step_retrieve_progress_counted(context, username, document):
+    context.statements.clear()
+    step_retrieve_progress(context, username, document)
+
+
+@then("{count:d} database statements should have run")
+def step_statements_ran(context, count):
+    assert len(context.statements) == count, \
+        f"Expected {count} statements, got {len(context.statements)}: {context.statements}"
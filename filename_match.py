@@ -0,0 +1,221 @@
+"""Filename normalization and fuzzy matching for auto-linking.
+
+Copies of the same book often arrive under slightly different names
+("book.kepub.epub", "Book_Title.epub", "Book (1).epub"). Filenames are
+normalized before they are indexed, which catches format and punctuation
+differences with an exact lookup. Copy markers are kept in the normalized
+name, since "Series (1)" and "Series (2)" may well be different books: for
+those and any other unknown name, a per-user trigram index over the
+normalized names finds the closest known name, which is only used when the
+similarity clears AUTO_LINK_FUZZY_THRESHOLD and both names carry the same
+numbers, whether written as digits, roman numerals or words ("Part One" and
+"Part II" are different books).
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# Minimum trigram similarity (0-1) for linking to a differently named book. 1 disables fuzzy matching.
+AUTO_LINK_FUZZY_THRESHOLD = float(os.getenv("AUTO_LINK_FUZZY_THRESHOLD", "0.85"))
+# Seconds a user's trigram index is kept before it is reloaded from the database
+FILENAME_INDEX_TTL = float(os.getenv("FILENAME_INDEX_TTL", "300"))
+# Users whose trigram index is kept in memory
+FILENAME_INDEX_MAX_USERS = int(os.getenv("FILENAME_INDEX_MAX_USERS", "1000"))
+
+# Shorter names share too many trigrams by chance to be matched fuzzily
+MIN_FUZZY_LENGTH = 6
+
+_EXTENSIONS = re.compile(
+    r"(\.(kepub|epub|mobi|azw3?|kfx|pdf|djvu|fb2|cbz|cbr|txt|rtf|docx?|html?|zip))+$"
+)
+# What a download or a file manager appends to a duplicate: " (1)" to " (9)", " - Copy", "copy 2"
+_COPY_MARKERS = re.compile(r"(\s*\([1-9]\)|\s*\bcopy\b(\s*\d+)?)+$")
+_SEPARATORS = re.compile(r"[\s_.\-]+")
+_NUMBERS = re.compile(r"(\d+)(st|nd|rd|th)?")
+_ROMAN_NUMERALS = re.compile(r"(x{0,3})(ix|iv|v?i{0,3})")
+_ROMAN_VALUES = {"i": 1, "v": 5, "x": 10}
+_NUMBER_WORDS = {
+    word: index
+    for words in (
+        ("one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+         "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen",
+         "nineteen", "twenty"),
+        ("first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"),
+    )
+    for index, word in enumerate(words, 1)
+}
+
+
+def normalize_filename(filename: str) -> str:
+    """Reduce a filename to the part that identifies the book.
+
+    Drops the directory, e-book extensions, case, accents and punctuation
+    differences. Copy markers are kept; see split_copy_marker.
+    """
+    name = filename.replace("\\", "/").rsplit("/", 1)[-1]
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c)).lower()
+    name = _EXTENSIONS.sub("", name)
+    name = _SEPARATORS.sub(" ", name).strip()
+    return name or filename.lower()
+
+
+def split_copy_marker(name: str) -> tuple[str, str]:
+    """Split a normalized name into the book's name and its trailing copy marker, "" if none."""
+    match = _COPY_MARKERS.search(name)
+    # A name that is nothing but a marker is the book's name
+    if match is None or match.start() == 0:
+        return name, ""
+    return name[:match.start()], match.group().strip()
+
+
+def _number(word: str) -> Optional[int]:
+    """Value of a word written as digits, a roman numeral or in English, None for other words."""
+    match = _NUMBERS.fullmatch(word)
+    if match:
+        return int(match.group(1))
+    if word in _NUMBER_WORDS:
+        return _NUMBER_WORDS[word]
+    if word and _ROMAN_NUMERALS.fullmatch(word):
+        values = [_ROMAN_VALUES[c] for c in word]
+        # Subtractive pairs: the "i" of "iv" and "ix"
+        return sum(-v if v < w else v for v, w in zip(values, values[1:] + [0]))
+    return None
+
+
+def _parts(name: str) -> tuple[list[int], str]:
+    base, marker = split_copy_marker(name)
+    numbers = [_number(word) for word in re.split(r"[^a-z0-9]+", base)]
+    return [number for number in numbers if number is not None], marker
+
+
+def trigrams(name: str) -> set[str]:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: str, b: str) -> float:
+    """Dice coefficient of the trigram sets of two normalized names."""
+    ta, tb = trigrams(a), trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return 2 * len(ta & tb) / (len(ta) + len(tb))
+
+
+class _UserIndex:
+    """Trigram postings over one user's normalized filenames."""
+
+    def __init__(self, names: dict[str, str]):
+        self.loaded_at = time.monotonic()
+        self.names: dict[str, str] = {}
+        # Trigrams of the book's name, without its copy marker
+        self.grams: dict[str, set[str]] = {}
+        # name -> (numbers in the book's name, copy marker)
+        self.parts: dict[str, tuple[list[int], str]] = {}
+        self.postings: dict[str, set[str]] = {}
+        for name, canonical_hash in names.items():
+            self.add(name, canonical_hash)
+
+    def add(self, name: str, canonical_hash: str) -> None:
+        if name in self.names:
+            return
+        self.names[name] = canonical_hash
+        grams = trigrams(split_copy_marker(name)[0])
+        self.grams[name] = grams
+        self.parts[name] = _parts(name)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(name)
+
+    def best_match(self, name: str) -> tuple[Optional[str], float]:
+        # Names are compared without their copy markers, which are checked separately
+        grams = trigrams(split_copy_marker(name)[0])
+        shared: dict[str, int] = {}
+        for gram in grams:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best, best_score = None, 0.0
+        numbers, marker = _parts(name)
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self.grams[candidate]))
+            if score <= best_score:
+                continue
+            candidate_numbers, candidate_marker = self.parts[candidate]
+            # "Vol 1" and "Vol II", "Part One" and "Part Two" are different books however
+            # similar the rest is, and so are "Title (1)" and "Title (2)": neither is a copy of the other
+            if candidate_numbers == numbers and not (marker and candidate_marker and marker != candidate_marker):
+                best, best_score = candidate, score
+        return best, best_score
+
+
+class FilenameMatcher:
+    """Per-user fuzzy lookup of known normalized filenames.
+
+    Each user's index is loaded on first use and kept for `ttl` seconds, for
+    at most `max_users` users (least recently used are evicted). Names indexed
+    by this process are added immediately; names indexed elsewhere show up
+    after a reload.
+    """
+
+    def __init__(
+        self,
+        threshold: float = AUTO_LINK_FUZZY_THRESHOLD,
+        ttl: float = FILENAME_INDEX_TTL,
+        max_users: int = FILENAME_INDEX_MAX_USERS,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users: OrderedDict[str, _UserIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def match(
+        self, user_id: str, name: str, load: Callable[[], dict[str, str]]
+    ) -> Optional[str]:
+        """Canonical hash of the closest known name, if it clears the threshold.
+
+        `load` returns the user's indexed name -> canonical_hash map and is
+        only called when the user's index is missing or expired.
+        """
+        if self.threshold >= 1 or len(split_copy_marker(name)[0]) < MIN_FUZZY_LENGTH:
+            return None
+        index = self._index(user_id, load)
+        with self._lock:
+            candidate, score = index.best_match(name)
+            if candidate is None or score < self.threshold:
+                return None
+            return index.names[candidate]
+
+    def add(self, user_id: str, names: dict[str, str]) -> None:
+        """Record newly indexed names in the user's cached index, if loaded."""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                for name, canonical_hash in names.items():
+                    index.add(name, canonical_hash)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+    def _index(self, user_id: str, load: Callable[[], dict[str, str]]) -> _UserIndex:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None and time.monotonic() - index.loaded_at < self.ttl:
+                self._users.move_to_end(user_id)
+                return index
+        # Load outside the lock; a concurrent load for the same user just wins the race
+        index = _UserIndex(load())
+        with self._lock:
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return index
+
+
+filename_matcher = FilenameMatcher()
@@ -1,4 +1,22 @@
+"""AWS Lambda entry point.
+
+Lambda imports this module in the init phase of a new execution environment,
+which runs with a full CPU burst before the first invocation. With
+LAMBDA_PRIME (the default), the DynamoDB client is created there too and its
+connection opened with one read, so the first request does not pay for
+importing boto3, loading the service model and the TLS handshake.
+
+The first invocation of each environment logs one JSON line (event
+"cold_start") with the init and first request durations and the peak RSS.
+"""
+
+import json
+import logging
 import os
+import resource
+import time
+
+_init_started = time.perf_counter()
 
 # Set DynamoDB backend before importing app
 os.environ.setdefault("DB_BACKEND", "dynamodb")
@@ -6,9 +24,58 @@ os.environ.setdefault("DB_BACKEND", "dynamodb")
 from mangum import Mangum
 from main import app
 
+logger = logging.getLogger(__name__)
+
+LAMBDA_PRIME = os.getenv("LAMBDA_PRIME", "true").lower() == "true"
+
 # Configure root_path for API Gateway path prefix (/reader)
 # This ensures FastAPI routes work correctly when accessed via /reader/...
 app.root_path = "/reader"
 
 # Mangum wraps the FastAPI ASGI app for Lambda
-handler = Mangum(app, lifespan="off")
+asgi_handler = Mangum(app, lifespan="off")
+
+
+def prime() -> None:
+    """Create the DynamoDB client and open its connection ahead of the first request."""
+    if os.getenv("DB_BACKEND") != "dynamodb":
+        return
+    from repositories.dynamodb import get_dynamodb_resource
+    table = get_dynamodb_resource().Table(os.getenv("DYNAMODB_USERS_TABLE", "reader-progress-users"))
+    try:
+        table.get_item(Key={"username": "__prime__"}, ProjectionExpression="username")
+    except Exception:
+        # The first request opens the connection instead
+        logger.warning("Could not prime the DynamoDB connection", exc_info=True)
+
+
+_primed_ms = None
+if LAMBDA_PRIME:
+    _prime_started = time.perf_counter()
+    prime()
+    _primed_ms = round((time.perf_counter() - _prime_started) * 1000, 1)
+_init_ms = round((time.perf_counter() - _init_started) * 1000, 1)
+_cold = True
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def handler(event, context):
+    global _cold
+    if not _cold:
+        return asgi_handler(event, context)
+    _cold = False
+    start = time.perf_counter()
+    try:
+        return asgi_handler(event, context)
+    finally:
+        logger.warning(json.dumps({
+            "event": "cold_start",
+            "init_ms": _init_ms,
+            "prime_ms": _primed_ms,
+            "first_request_ms": round((time.perf_counter() - start) * 1000, 1),
+            "max_rss_mb": max_rss_mb(),
+        }))
@@ -0,0 +1,89 @@
+"""Disjoint-set (union-find) view of a user's document links.
+
+Links are stored flat: every alias points directly at the root of its group,
+which is the canonical hash its progress is stored under, so resolving a hash
+is a single lookup. plan_merge() works out which stored links have to change
+to keep it that way when groups are merged, and which chains left behind by
+older versions need flattening.
+"""
+
+from dataclasses import dataclass, field
+
+
+class LinkForest:
+    """Union-find over document hashes with path compression."""
+
+    def __init__(self, links: dict[str, str]):
+        # document_hash -> canonical_hash
+        self.parent = dict(links)
+
+    def find(self, document_hash: str) -> str:
+        """Root of the group containing document_hash, compressing the path to it."""
+        path = []
+        seen = set()
+        node = document_hash
+        while node in self.parent:
+            if node in seen:
+                # A cycle (possible in legacy data): make this node the root
+                del self.parent[node]
+                break
+            seen.add(node)
+            path.append(node)
+            node = self.parent[node]
+        for member in path:
+            if member != node:
+                self.parent[member] = node
+        return node
+
+    def union(self, document_hash: str, canonical_hash: str) -> str:
+        """Merge document_hash's group into canonical_hash's group. Returns the root."""
+        root = self.find(canonical_hash)
+        other = self.find(document_hash)
+        if other != root:
+            self.parent[other] = root
+        return root
+
+
+@dataclass
+class LinkMerge:
+    """Stored-link changes needed to apply a merge."""
+    # Requested document_hash -> root of its merged group
+    roots: dict[str, str] = field(default_factory=dict)
+    # Former root -> new root. Every link pointing at a former root must be repointed.
+    absorbed: dict[str, str] = field(default_factory=dict)
+    # document_hash -> root for links to write (new, or stored pointing elsewhere)
+    rewrites: dict[str, str] = field(default_factory=dict)
+    # Stored links to remove (their hash turned out to be a root)
+    deletes: list[str] = field(default_factory=list)
+
+    def repoints(self) -> dict[str, list[str]]:
+        """Former roots grouped by the root they now belong to."""
+        grouped: dict[str, list[str]] = {}
+        for old_root, root in self.absorbed.items():
+            grouped.setdefault(root, []).append(old_root)
+        return grouped
+
+
+def plan_merge(stored: dict[str, str], links: dict[str, str]) -> LinkMerge:
+    """Plan merging links (document_hash -> canonical_hash) into stored links.
+
+    `stored` holds the existing links of every hash involved; with an empty
+    `links` the plan just flattens whatever chains or cycles `stored` contains.
+    """
+    forest = LinkForest(stored)
+    before = {forest.find(h) for pair in links.items() for h in pair}
+    for document_hash, canonical_hash in links.items():
+        forest.union(document_hash, canonical_hash)
+
+    merge = LinkMerge(roots={h: forest.find(h) for h in links})
+    for old_root in before:
+        root = forest.find(old_root)
+        if root != old_root:
+            merge.absorbed[old_root] = root
+    for document_hash in {*stored, *merge.absorbed}:
+        root = forest.find(document_hash)
+        if root == document_hash:
+            merge.deletes.append(document_hash)
+        elif stored.get(document_hash) != root:
+            merge.rewrites[document_hash] = root
+    return merge
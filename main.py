@@ -1,8 +1,12 @@
 import os
 import time
+import json
+import asyncio
+import anyio
+from typing import Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.middleware.base import BaseHTTPMiddleware
 from slowapi import Limiter
@@ -11,18 +15,52 @@ from slowapi.errors import RateLimitExceeded
 
 from schemas import (
     UserCreate, ProgressUpdate, ProgressResponse, LinkRequest, LinkResponse,
-    DocumentLinkResponse, BookSummary, BooksListResponse, BookLabelUpdate, BookLabelResponse
+    DocumentLinkResponse, BookSummary, BooksListResponse, BookLabelUpdate, BookLabelResponse,
+    ProgressBatchItemResult, ProgressBatchResponse, ProgressQueryRequest, ProgressQueryResponse,
+    ChangesResponse
 )
-from repositories import get_user_repository, get_progress_repository, get_document_link_repository, get_book_label_repository
-from svg_card import render_progress_card
+from repositories import (
+    get_user_repository, get_progress_repository, get_document_link_repository, get_book_label_repository,
+    progress_write_buffer,
+)
+from events import progress_events, HEARTBEAT_INTERVAL
+from filename_match import filename_matcher, normalize_filename
+from book_search import book_search, SearchEntry
+from negative_cache import negative_cache
+from cache import shared_cache, UserCache
+import metrics
+from request_stats import RequestStatsMiddleware, phase
+from profiler import profiler, ProfilerMiddleware
+from tracing import TracingMiddleware, span, tracer
+from capture import CaptureMiddleware, capture
 from repositories.protocols import UserEntity, ProgressEntity
-from auth import hash_password, get_current_user
+from auth import hash_password, get_current_user, require_admin
 
 
 # Rate limiter - disabled in test mode
 _rate_limit_enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
 limiter = Limiter(key_func=get_remote_address, enabled=_rate_limit_enabled)
 
+# Upper bound on records accepted by the batch progress endpoint
+MAX_BATCH_SIZE = 500
+
+# How concurrent pushes for the same book are resolved:
+#   last_write - the latest request wins (default)
+#   newest     - reject pushes whose timestamp is older than the stored one
+#   furthest   - reject pushes whose percentage is lower than the stored one
+PROGRESS_CONFLICT_POLICY = os.getenv("PROGRESS_CONFLICT_POLICY", "last_write")
+_CONFLICT_FIELDS = {"newest": "timestamp", "furthest": "percentage"}
+
+# Seconds the change feed stays behind the clock. Writes are stamped before
+# they commit, so a write still committing when a call is answered has to
+# fall after that call's watermark to be reported by the next one.
+CHANGES_FEED_LAG = int(os.getenv("CHANGES_FEED_LAG", "5"))
+
+# Rendered SVG cards, shared between workers when CACHE_BACKEND=redis.
+# Invalidated whenever the user's progress, links or labels change.
+CARD_CACHE_TTL = float(os.getenv("CARD_CACHE_TTL", "300"))
+card_cache = UserCache(shared_cache, "card", CARD_CACHE_TTL)
+
 
 class SecurityHeadersMiddleware(BaseHTTPMiddleware):
     """Add security headers to all responses."""
@@ -35,18 +73,91 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class RequestMetricsMiddleware:
+    """Count requests and time them per route template (not per raw path)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _route(scope) -> str:
+        return metrics.route_template(scope) or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                metrics.HTTP_REQUEST_DURATION.labels(scope["method"], self._route(scope)).observe(
+                    time.perf_counter() - start
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            metrics.HTTP_REQUESTS.labels(scope["method"], self._route(scope), str(status)).inc()
+
+
+def _threadpool_statistic(name: str):
+    # Sync endpoints run on anyio's default thread limiter; read from the event loop
+    return lambda: getattr(anyio.to_thread.current_default_thread_limiter().statistics(), name)
+
+
+metrics.gauge("threadpool_threads_in_use", "Worker threads running sync endpoints", _threadpool_statistic("borrowed_tokens"))
+metrics.gauge("threadpool_threads_max", "Worker threads available to sync endpoints", _threadpool_statistic("total_tokens"))
+metrics.gauge(
+    "threadpool_tasks_waiting", "Sync endpoint calls waiting for a free worker thread",
+    _threadpool_statistic("tasks_waiting"),
+)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that times its encoding as the request's serialize phase."""
+
+    def render(self, content) -> bytes:
+        with phase("serialize"):
+            return super().render(content)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Only initialize SQL database if using SQL backend
     if os.getenv("DB_BACKEND", "sql") == "sql":
-        from database import init_db
+        from database import init_db, SessionLocal
+        from repositories.sql import compact_link_chains
         init_db()
+        with SessionLocal() as db:
+            compact_link_chains(db)
+    elif os.getenv("DB_BACKEND") == "memory":
+        from repositories.memory import get_memory_store
+        # Replay the snapshot journal before the first request
+        get_memory_store()
+    if progress_write_buffer is not None:
+        progress_write_buffer.start()
     yield
+    if progress_write_buffer is not None:
+        # Flush coalesced progress before the process exits
+        progress_write_buffer.stop()
+    # Export the spans still queued
+    tracer.flush()
+    capture.close()
 
 
-app = FastAPI(title="KOReader Sync Server", lifespan=lifespan)
+app = FastAPI(title="KOReader Sync Server", lifespan=lifespan, default_response_class=TimedJSONResponse)
 app.state.limiter = limiter
 app.add_middleware(SecurityHeadersMiddleware)
+app.add_middleware(RequestStatsMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(CaptureMiddleware)
 
 
 @app.exception_handler(RateLimitExceeded)
@@ -78,6 +189,66 @@ def healthcheck():
     return {"state": "OK"}
 
 
+@app.get("/stats")
+def stats():
+    """Process-wide counters (progress writes, caches), shared cache and negative cache state."""
+    result = {"counters": metrics.snapshot(), "cache": shared_cache.stats()}
+    if negative_cache is not None:
+        result["negative_cache"] = negative_cache.stats()
+    return result
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Every metric in the Prometheus text format."""
+    # Async so the threadpool gauges are read on the event loop
+    return Response(content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+def slow_queries(limit: int = 20):
+    """Recent slow SQL statements and the ones with the most slow time (SQL backend only)."""
+    if os.getenv("DB_BACKEND", "sql") != "sql":
+        raise HTTPException(status_code=404, detail="The slow query log requires the SQL backend")
+    from slow_queries import slow_query_log
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "window_seconds": slow_query_log.window,
+        "top": slow_query_log.top(limit),
+        "recent": slow_query_log.recent(limit),
+    }
+
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+def start_profiler(seconds: Optional[float] = None, every: Optional[int] = None):
+    """Sample every thread for `seconds`, or during 1 in `every` requests until stopped."""
+    if (seconds is None) == (every is None):
+        raise HTTPException(status_code=400, detail="Pass either seconds or every")
+    if (seconds is not None and seconds <= 0) or (every is not None and every < 1):
+        raise HTTPException(status_code=400, detail="seconds and every must be positive")
+    try:
+        profiler.start(seconds=seconds, every=every)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+def stop_profiler():
+    profiler.stop()
+    return profiler.status()
+
+
+@app.get("/admin/profiler/profile", dependencies=[Depends(require_admin)])
+def get_profile(format: str = "collapsed"):
+    """Samples of the current or last session, as collapsed stacks or speedscope JSON."""
+    if format == "speedscope":
+        return profiler.speedscope()
+    if format != "collapsed":
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    return Response(profiler.collapsed(), media_type="text/plain")
+
+
 @app.post("/users/create", status_code=201)
 @limiter.limit("5/minute")
 def create_user(request: Request, user: UserCreate, user_repo=Depends(get_user_repository)):
@@ -96,6 +267,121 @@ def auth_user(request: Request, user: UserEntity = Depends(get_current_user)):
     return {"status": "authenticated"}
 
 
+def _missing_required_fields(progress_data: ProgressUpdate) -> bool:
+    return not all([
+        progress_data.document,
+        progress_data.progress,
+        progress_data.percentage is not None,
+        progress_data.device,
+        progress_data.device_id,
+    ])
+
+
+def _resolve_canonicals(user_id: str, updates: list[ProgressUpdate], progress_repo, link_repo) -> list[str]:
+    """Resolve the canonical hash for each update, auto-linking by filename.
+
+    Documents without a link are linked to the canonical indexed for their
+    normalized filename, the first document synced under that name, so the
+    canonical doesn't change once chosen. Filenames synced before the index
+    existed fall back to the oldest stored document with that exact name; new
+    names are matched fuzzily against the user's known names and only linked
+    above AUTO_LINK_FUZZY_THRESHOLD. Lookups and writes are batched, so the
+    cost doesn't grow with the number of updates or with how many files share
+    a name.
+    """
+    canonical_map = link_repo.get_canonicals(user_id, [u.document for u in updates])
+    names = {
+        u.filename: normalize_filename(u.filename)
+        for u in updates if u.filename and u.document not in canonical_map
+    }
+    if not names:
+        return [canonical_map.get(u.document, u.document) for u in updates]
+
+    new_links: dict[str, str] = {}
+    by_name = link_repo.get_filename_canonicals(user_id, list(set(names.values())))
+    unindexed = {filename: name for filename, name in names.items() if name not in by_name}
+    if unindexed:
+        # document -> timestamp of existing progress, per filename
+        matches: dict[str, dict[str, int]] = {}
+        for p in progress_repo.get_all_by_user_and_filenames(user_id, list(unindexed)):
+            matches.setdefault(p.filename, {})[p.document] = p.timestamp
+        candidates = {doc for docs in matches.values() for doc in docs} - canonical_map.keys()
+        if candidates:
+            canonical_map.update(link_repo.get_canonicals(user_id, list(candidates)))
+        for filename, docs in matches.items():
+            # Use the oldest existing document, or the root of its group if it
+            # has since been linked, and link the other unlinked copies to it
+            oldest = min(docs, key=docs.get)
+            canonical_hash = canonical_map.get(oldest, oldest)
+            by_name.setdefault(unindexed[filename], canonical_hash)
+            for doc in docs:
+                if doc != canonical_hash and doc not in canonical_map:
+                    canonical_map[doc] = canonical_hash
+                    new_links[doc] = canonical_hash
+        for name in set(unindexed.values()) - by_name.keys():
+            canonical_hash = filename_matcher.match(
+                user_id, name, lambda: link_repo.get_all_filename_canonicals(user_id)
+            )
+            if canonical_hash:
+                by_name[name] = canonical_hash
+
+    for u in updates:
+        if not u.filename or u.document in canonical_map:
+            continue
+        # A name seen for the first time makes this document its canonical
+        canonical_hash = by_name.setdefault(names[u.filename], u.document)
+        if canonical_hash != u.document:
+            canonical_map[u.document] = canonical_hash
+            new_links[u.document] = canonical_hash
+
+    if unindexed:
+        new_names = {name: by_name[name] for name in unindexed.values()}
+        link_repo.index_filenames(user_id, new_names)
+        filename_matcher.add(user_id, new_names)
+    if new_links:
+        # Documents being linked may already be the canonical of other hashes,
+        # and an indexed canonical may since have been merged into another group
+        canonical_map.update(link_repo.merge_links(user_id, new_links))
+    return [canonical_map.get(u.document, u.document) for u in updates]
+
+
+def _known_hashes(user_id: str, progress_repo, link_repo) -> list[str]:
+    """Every hash a progress pull can succeed for: documents with progress and their aliases."""
+    hashes = [p.document for p in progress_repo.get_all_by_user(user_id)]
+    hashes.extend(link.document_hash for link in link_repo.get_all_links(user_id))
+    return hashes
+
+
+def _publish_progress(progress: ProgressEntity) -> None:
+    """Push a stored update to the user's other devices listening on /syncs/stream."""
+    event = ProgressResponse(
+        document=progress.document,
+        progress=progress.progress,
+        percentage=progress.percentage,
+        device=progress.device,
+        device_id=progress.device_id,
+        timestamp=progress.timestamp,
+        filename=progress.filename,
+    )
+    progress_events.publish(progress.user_id, event.model_dump(), source_device_id=progress.device_id)
+
+
+def _progress_timestamp(progress_data: ProgressUpdate, now: int) -> int:
+    # Client timestamps only matter to the "newest" policy, and never from the future
+    if PROGRESS_CONFLICT_POLICY == "newest" and progress_data.timestamp is not None:
+        return min(progress_data.timestamp, now)
+    return now
+
+
+def _store_progress(progress_repo, progress: ProgressEntity) -> bool:
+    """Write progress under the configured conflict policy. Returns False if it was stale."""
+    field = _CONFLICT_FIELDS.get(PROGRESS_CONFLICT_POLICY)
+    if field is None:
+        progress_repo.upsert(progress)
+        return True
+    return progress_repo.upsert_if_newer(progress, field)
+
+
 @app.put("/syncs/progress")
 def update_progress(
     progress_data: ProgressUpdate,
@@ -103,43 +389,12 @@ def update_progress(
     progress_repo=Depends(get_progress_repository),
     link_repo=Depends(get_document_link_repository),
 ):
-    if not all([
-        progress_data.document,
-        progress_data.progress,
-        progress_data.percentage is not None,
-        progress_data.device,
-        progress_data.device_id,
-    ]):
+    if _missing_required_fields(progress_data):
         raise HTTPException(status_code=400, detail="Missing required fields")
 
-    document_hash = progress_data.document
-    canonical_hash = document_hash
-
-    # Check if this document hash already has a link
-    existing_canonical = link_repo.get_canonical(user.id, document_hash)
-    if existing_canonical:
-        canonical_hash = existing_canonical
-    elif progress_data.filename:
-        # Auto-link: find ALL documents with the same filename and link them together
-        all_with_filename = progress_repo.get_all_by_user_and_filename(user.id, progress_data.filename)
-
-        if all_with_filename:
-            # Use the first existing document as the canonical (the oldest one)
-            # This ensures consistency - the canonical doesn't change
-            canonical_hash = min(all_with_filename, key=lambda p: p.timestamp).document
-
-            # Link all documents (including the current one) to the canonical
-            for p in all_with_filename:
-                if p.document != canonical_hash:
-                    existing_link = link_repo.get_canonical(user.id, p.document)
-                    if not existing_link:
-                        link_repo.create_link(user.id, p.document, canonical_hash)
-
-            # Also link the current document if it's different from canonical
-            if document_hash != canonical_hash:
-                existing_link = link_repo.get_canonical(user.id, document_hash)
-                if not existing_link:
-                    link_repo.create_link(user.id, document_hash, canonical_hash)
+    [canonical_hash] = _resolve_canonicals(user.id, [progress_data], progress_repo, link_repo)
+    if negative_cache is not None:
+        negative_cache.add(user.id, [progress_data.document, canonical_hash])
 
     progress_entity = ProgressEntity(
         user_id=user.id,
@@ -148,14 +403,93 @@ def update_progress(
         percentage=progress_data.percentage,
         device=progress_data.device,
         device_id=progress_data.device_id,
-        timestamp=int(time.time()),
+        timestamp=_progress_timestamp(progress_data, int(time.time())),
         filename=progress_data.filename,
     )
 
-    progress_repo.upsert(progress_entity)
+    if not _store_progress(progress_repo, progress_entity):
+        raise HTTPException(status_code=409, detail="A newer progress is already stored")
+    _publish_progress(progress_entity)
+    book_search.update_progress(user.id, canonical_hash, progress_entity.filename, progress_entity.timestamp)
+    card_cache.invalidate(user.id)
     return {"status": "success"}
 
 
+@app.put("/syncs/progress/batch")
+def update_progress_batch(
+    batch: list[ProgressUpdate],
+    user: UserEntity = Depends(get_current_user),
+    progress_repo=Depends(get_progress_repository),
+    link_repo=Depends(get_document_link_repository),
+) -> ProgressBatchResponse:
+    """Apply many progress updates at once, e.g. when an offline device reconnects."""
+    if len(batch) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} records per batch")
+
+    valid = [p for p in batch if not _missing_required_fields(p)]
+    resolved_canonicals = _resolve_canonicals(user.id, valid, progress_repo, link_repo) if valid else []
+    if negative_cache is not None:
+        negative_cache.add(user.id, [*(p.document for p in valid), *resolved_canonicals])
+    canonicals = iter(resolved_canonicals)
+
+    now = int(time.time())
+    conflict_field = _CONFLICT_FIELDS.get(PROGRESS_CONFLICT_POLICY)
+    # Records resolving to the same book collapse into one write: the last one
+    # wins, or under a conflict policy the newest/furthest one
+    entities: dict[str, tuple[int, ProgressEntity]] = {}
+    resolved: list[Optional[tuple[int, ProgressEntity]]] = []
+    for index, progress_data in enumerate(batch):
+        if _missing_required_fields(progress_data):
+            resolved.append(None)
+            continue
+        canonical_hash = next(canonicals)
+        entity = ProgressEntity(
+            user_id=user.id,
+            document=canonical_hash,
+            progress=progress_data.progress,
+            percentage=progress_data.percentage,
+            device=progress_data.device,
+            device_id=progress_data.device_id,
+            timestamp=_progress_timestamp(progress_data, now),
+            filename=progress_data.filename,
+        )
+        resolved.append((index, entity))
+        current = entities.get(canonical_hash)
+        if current is None or conflict_field is None or \
+                getattr(entity, conflict_field) >= getattr(current[1], conflict_field):
+            entities[canonical_hash] = (index, entity)
+
+    if conflict_field is None:
+        progress_repo.upsert_many([entity for _, entity in entities.values()])
+        stored = {index for index, _ in entities.values()}
+    else:
+        # Each conditional write is checked against the stored record on its own
+        stored = {
+            index for index, entity in entities.values()
+            if progress_repo.upsert_if_newer(entity, conflict_field)
+        }
+
+    results = []
+    for progress_data, item in zip(batch, resolved):
+        if item is None:
+            results.append(ProgressBatchItemResult(document=progress_data.document, status="invalid"))
+            continue
+        index, entity = item
+        superseded = entities[entity.document][0] != index
+        ok = index in stored or (superseded and conflict_field is None)
+        results.append(ProgressBatchItemResult(
+            document=progress_data.document, status="success" if ok else "stale", canonical=entity.document
+        ))
+
+    for index, entity in entities.values():
+        if index in stored:
+            _publish_progress(entity)
+            book_search.update_progress(user.id, entity.document, entity.filename, entity.timestamp)
+    if stored:
+        card_cache.invalidate(user.id)
+    return ProgressBatchResponse(results=results)
+
+
 @app.get("/syncs/progress/{document}")
 def get_progress(
     document: str,
@@ -163,13 +497,17 @@ def get_progress(
     progress_repo=Depends(get_progress_repository),
     link_repo=Depends(get_document_link_repository),
 ):
-    # Resolve canonical hash if this document is linked
-    canonical_hash = link_repo.get_canonical(user.id, document)
-    lookup_hash = canonical_hash if canonical_hash else document
+    if negative_cache is not None and not negative_cache.might_have(
+        user.id, document, lambda: _known_hashes(user.id, progress_repo, link_repo)
+    ):
+        raise HTTPException(status_code=404, detail="Progress not found")
 
-    progress = progress_repo.get_by_user_and_document(user.id, lookup_hash)
+    # Resolves the canonical hash if this document is linked, in the same lookup
+    progress = progress_repo.get_by_user_and_alias(user.id, document)
 
     if not progress:
+        if negative_cache is not None:
+            negative_cache.record_miss()
         raise HTTPException(status_code=404, detail="Progress not found")
 
     return ProgressResponse(
@@ -183,6 +521,123 @@ def get_progress(
     )
 
 
+@app.get("/syncs/stream")
+async def stream_progress(
+    request: Request,
+    device_id: Optional[str] = None,
+    user: UserEntity = Depends(get_current_user),
+):
+    """Server-Sent Events stream of progress pushed by the user's other devices.
+
+    Updates pushed with the same `device_id` as the listener are not echoed back.
+    """
+    try:
+        subscription = progress_events.subscribe(user.id, device_id)
+    except ValueError:
+        raise HTTPException(status_code=429, detail="Too many open streams")
+
+    async def event_stream():
+        try:
+            # Ask clients to wait a few seconds before reconnecting
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+        finally:
+            progress_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/syncs/progress/query")
+def query_progress(
+    query: ProgressQueryRequest,
+    user: UserEntity = Depends(get_current_user),
+    progress_repo=Depends(get_progress_repository),
+    link_repo=Depends(get_document_link_repository),
+) -> ProgressQueryResponse:
+    """Get progress for many documents in one call, keyed by the requested hash."""
+    if len(query.documents) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} documents per query")
+
+    canonical_map = link_repo.get_canonicals(user.id, query.documents)
+    lookup = {document: canonical_map.get(document, document) for document in query.documents}
+    found = progress_repo.get_by_user_and_documents(user.id, list(set(lookup.values())))
+
+    return ProgressQueryResponse(progress={
+        document: ProgressResponse(
+            document=progress.document,
+            progress=progress.progress,
+            percentage=progress.percentage,
+            device=progress.device,
+            device_id=progress.device_id,
+            timestamp=progress.timestamp,
+            filename=progress.filename,
+        )
+        for document, lookup_hash in lookup.items()
+        if (progress := found.get(lookup_hash))
+    })
+
+
+@app.get("/syncs/changes")
+def list_changes(
+    since: int = 0,
+    user: UserEntity = Depends(get_current_user),
+    progress_repo=Depends(get_progress_repository),
+    link_repo=Depends(get_document_link_repository),
+    label_repo=Depends(get_book_label_repository),
+) -> ChangesResponse:
+    """List progress, links and labels changed or deleted after the `since` watermark."""
+    # Timestamps have one-second resolution, so stop short of the current
+    # second, and CHANGES_FEED_LAG more for writes that have yet to commit
+    until = int(time.time()) - 1 - CHANGES_FEED_LAG
+    if since >= until:
+        return ChangesResponse(progress=[], links=[], labels=[], next_since=since)
+
+    links = link_repo.get_links_since(user.id, since, until)
+    labels = label_repo.get_labels_since(user.id, since, until)
+    # A link or label deleted and then created again in the window exists now
+    linked = {link.document_hash for link in links}
+    labeled = {label.canonical_hash for label in labels}
+
+    return ChangesResponse(
+        progress=[
+            ProgressResponse(
+                document=p.document,
+                progress=p.progress,
+                percentage=p.percentage,
+                device=p.device,
+                device_id=p.device_id,
+                timestamp=p.timestamp,
+                filename=p.filename,
+            )
+            for p in progress_repo.get_all_by_user_since(user.id, since, until)
+        ],
+        links=[
+            DocumentLinkResponse(document_hash=link.document_hash, canonical_hash=link.canonical_hash)
+            for link in links
+        ],
+        labels=[
+            BookLabelResponse(canonical_hash=label.canonical_hash, label=label.label)
+            for label in labels
+        ],
+        deleted_links=[h for h in link_repo.get_deleted_links_since(user.id, since, until) if h not in linked],
+        deleted_labels=[h for h in label_repo.get_deleted_labels_since(user.id, since, until) if h not in labeled],
+        next_since=until,
+    )
+
+
 @app.post("/documents/link", status_code=201)
 def link_documents(
     link_request: LinkRequest,
@@ -194,29 +649,20 @@ def link_documents(
         raise HTTPException(status_code=400, detail="At least 2 hashes required to create a link")
 
     # Find the canonical hash: the first one with existing progress, or the first one
-    canonical_hash = None
-    for h in link_request.hashes:
-        progress = progress_repo.get_by_user_and_document(user.id, h)
-        if progress:
-            canonical_hash = h
-            break
-
-    if not canonical_hash:
-        canonical_hash = link_request.hashes[0]
-
-    # Create links for all other hashes
-    linked = []
-    for h in link_request.hashes:
-        if h != canonical_hash:
-            # Check if this hash already has a different canonical
-            existing = link_repo.get_canonical(user.id, h)
-            if existing and existing != canonical_hash:
-                # Update the link to point to the new canonical
-                link_repo.delete_link(user.id, h)
-            link_repo.create_link(user.id, h, canonical_hash)
-            linked.append(h)
-
-    return LinkResponse(canonical=canonical_hash, linked=linked)
+    stored = progress_repo.get_by_user_and_documents(user.id, link_request.hashes)
+    canonical_hash = next((h for h in link_request.hashes if h in stored), link_request.hashes[0])
+
+    # Merge the groups of all other hashes into the canonical's group. If the
+    # canonical is itself linked, its root stays the canonical for everyone.
+    links = {h: canonical_hash for h in link_request.hashes if h != canonical_hash}
+    roots = link_repo.merge_links(user.id, links)
+    if negative_cache is not None:
+        negative_cache.add(user.id, link_request.hashes)
+    card_cache.invalidate(user.id)
+    root = next(iter(roots.values()), canonical_hash)
+    linked = [h for h in dict.fromkeys(link_request.hashes) if h != root]
+
+    return LinkResponse(canonical=root, linked=linked)
 
 
 @app.get("/documents/links")
@@ -243,23 +689,12 @@ def unlink_document(
     deleted = link_repo.delete_link(user.id, document_hash)
     if not deleted:
         raise HTTPException(status_code=404, detail="Link not found")
+    card_cache.invalidate(user.id)
     return {"status": "success"}
 
 
-@app.get("/books")
-def list_books(
-    limit: int = 50,
-    offset: int = 0,
-    user: UserEntity = Depends(get_current_user),
-    progress_repo=Depends(get_progress_repository),
-    link_repo=Depends(get_document_link_repository),
-    label_repo=Depends(get_book_label_repository),
-) -> BooksListResponse:
-    """List all books with their progress for the authenticated user."""
-    all_progress = progress_repo.get_all_by_user(user.id)
-    all_links = link_repo.get_all_links(user.id)
-    all_labels = label_repo.get_all_labels(user.id)
-
+def _summarize_books(all_progress, all_links, all_labels) -> list[BookSummary]:
+    """One summary per canonical book with its latest progress, most recent first."""
     label_map = {label.canonical_hash: label.label for label in all_labels}
     reverse_link_map: dict[str, list[str]] = {}
     for link in all_links:
@@ -296,10 +731,76 @@ def list_books(
                 timestamp=p.timestamp,
             )
 
-    sorted_books = sorted(books.values(), key=lambda b: b.timestamp, reverse=True)
-    # Apply pagination
-    paginated_books = sorted_books[offset:offset + limit]
-    return BooksListResponse(books=paginated_books)
+    return sorted(books.values(), key=lambda b: b.timestamp, reverse=True)
+
+
+@app.get("/books")
+def list_books(
+    limit: int = 50,
+    offset: int = 0,
+    user: UserEntity = Depends(get_current_user),
+    progress_repo=Depends(get_progress_repository),
+    link_repo=Depends(get_document_link_repository),
+    label_repo=Depends(get_book_label_repository),
+) -> BooksListResponse:
+    """List all books with their progress for the authenticated user."""
+    all_progress = progress_repo.get_all_by_user(user.id)
+    all_links = link_repo.get_all_links(user.id)
+    all_labels = label_repo.get_all_labels(user.id)
+
+    with span("list_books.aggregate", progress_records=len(all_progress), links=len(all_links)):
+        sorted_books = _summarize_books(all_progress, all_links, all_labels)
+    return BooksListResponse(books=sorted_books[offset:offset + limit])
+
+
+@app.get("/books/search")
+def search_books(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    user: UserEntity = Depends(get_current_user),
+    progress_repo=Depends(get_progress_repository),
+    link_repo=Depends(get_document_link_repository),
+    label_repo=Depends(get_book_label_repository),
+) -> BooksListResponse:
+    """Search the authenticated user's books by label and filename, best match first.
+
+    Every word must match the start of a word in the label or filename.
+    Only the returned page of books is read from the database.
+    """
+    def load_library() -> dict[str, SearchEntry]:
+        labels = {label.canonical_hash: label.label for label in label_repo.get_all_labels(user.id)}
+        entries: dict[str, SearchEntry] = {}
+        for p in progress_repo.get_all_by_user(user.id):
+            if p.document not in entries or p.timestamp > entries[p.document].timestamp:
+                entries[p.document] = SearchEntry(
+                    label=labels.get(p.document), filename=p.filename, timestamp=p.timestamp
+                )
+        return entries
+
+    hits = book_search.search(user.id, q, load_library, limit=limit, offset=offset)
+    if not hits:
+        return BooksListResponse(books=[])
+    progress_map = progress_repo.get_by_user_and_documents(user.id, hits)
+    label_map = label_repo.get_labels(user.id, hits)
+    linked_map = link_repo.get_linked_hashes_by_canonical(user.id, hits)
+    books = []
+    for canonical_hash in hits:
+        p = progress_map.get(canonical_hash)
+        if p is None:
+            continue
+        books.append(BookSummary(
+            canonical_hash=canonical_hash,
+            linked_hashes=linked_map.get(canonical_hash, []),
+            label=label_map.get(canonical_hash),
+            filename=p.filename,
+            progress=p.progress,
+            percentage=p.percentage,
+            device=p.device,
+            device_id=p.device_id,
+            timestamp=p.timestamp,
+        ))
+    return BooksListResponse(books=books)
 
 
 @app.put("/books/label")
@@ -315,6 +816,8 @@ def update_book_label(
         raise HTTPException(status_code=404, detail="Book not found")
 
     label_entity = label_repo.set_label(user.id, request.canonical_hash, request.label)
+    book_search.update_label(user.id, request.canonical_hash, label_entity.label)
+    card_cache.invalidate(user.id)
     return BookLabelResponse(
         canonical_hash=label_entity.canonical_hash,
         label=label_entity.label,
@@ -331,6 +834,8 @@ def delete_book_label(
     deleted = label_repo.delete_label(user.id, canonical_hash)
     if not deleted:
         raise HTTPException(status_code=404, detail="Label not found")
+    book_search.update_label(user.id, canonical_hash, None)
+    card_cache.invalidate(user.id)
     return {"status": "success"}
 
 
@@ -348,49 +853,26 @@ def get_progress_card(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    all_progress = progress_repo.get_all_by_user(user.id)
-    all_links = link_repo.get_all_links(user.id)
-    all_labels = label_repo.get_all_labels(user.id)
-
-    label_map = {label.canonical_hash: label.label for label in all_labels}
-    reverse_link_map: dict[str, list[str]] = {}
-    for link in all_links:
-        if link.canonical_hash not in reverse_link_map:
-            reverse_link_map[link.canonical_hash] = []
-        reverse_link_map[link.canonical_hash].append(link.document_hash)
-
-    books: dict[str, BookSummary] = {}
-    for p in all_progress:
-        canonical_hash = p.document
-        if canonical_hash in books:
-            if p.timestamp > books[canonical_hash].timestamp:
-                books[canonical_hash] = BookSummary(
-                    canonical_hash=canonical_hash,
-                    linked_hashes=reverse_link_map.get(canonical_hash, []),
-                    label=label_map.get(canonical_hash),
-                    filename=p.filename,
-                    progress=p.progress,
-                    percentage=p.percentage,
-                    device=p.device,
-                    device_id=p.device_id,
-                    timestamp=p.timestamp,
-                )
-        else:
-            books[canonical_hash] = BookSummary(
-                canonical_hash=canonical_hash,
-                linked_hashes=reverse_link_map.get(canonical_hash, []),
-                label=label_map.get(canonical_hash),
-                filename=p.filename,
-                progress=p.progress,
-                percentage=p.percentage,
-                device=p.device,
-                device_id=p.device_id,
-                timestamp=p.timestamp,
-            )
+    svg_content = card_cache.get(user.id, f"limit={limit}")
+    if svg_content is not None:
+        return Response(
+            content=svg_content,
+            media_type="image/svg+xml",
+            headers={"Cache-Control": "max-age=1800"}
+        )
 
+    books = _summarize_books(
+        progress_repo.get_all_by_user(user.id),
+        link_repo.get_all_links(user.id),
+        label_repo.get_all_labels(user.id),
+    )
     # Sort by progress (highest first), then by timestamp (most recent first)
-    sorted_books = sorted(books.values(), key=lambda b: (b.percentage, b.timestamp), reverse=True)[:limit]
-    svg_content = render_progress_card(sorted_books)
+    sorted_books = sorted(books, key=lambda b: (b.percentage, b.timestamp), reverse=True)[:limit]
+    # Imported here so that cold starts serving other routes skip it
+    from svg_card import render_progress_card
+    with phase("render"), span("render_progress_card", books=len(sorted_books)):
+        svg_content = render_progress_card(sorted_books)
+    card_cache.set(user.id, f"limit={limit}", svg_content)
 
     return Response(
         content=svg_content,
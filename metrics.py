@@ -0,0 +1,257 @@
+"""Process-wide operational metrics.
+
+Unlabeled counters are summarized on GET /stats; every metric is exposed in
+the Prometheus text format on GET /metrics.
+
+Metrics are updated on every request, so updates take no lock: each thread
+increments its own cell and reads add the cells up. Histograms have fixed
+buckets, so an observation is one bisect and a few increments.
+"""
+
+import bisect
+import threading
+import weakref
+from typing import Callable, Iterable, Optional
+
+# Seconds; suits everything from a dict lookup to a slow bcrypt round
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Cells:
+    """One list of numbers per thread, created on the thread's first update."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._all: list[list] = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> list:
+        cells = getattr(self._local, "cells", None)
+        if cells is None:
+            cells = [0] * self.size
+            self._local.cells = cells
+            with self._lock:
+                self._all.append(cells)
+        return cells
+
+    def totals(self) -> list:
+        with self._lock:
+            all_cells = list(self._all)
+        totals = [0] * self.size
+        for cells in all_cells:
+            for i, value in enumerate(cells):
+                totals[i] += value
+        return totals
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self, name: str, description: str, labels: Optional[dict[str, str]] = None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._cells = _Cells(1)
+
+    def inc(self, amount: int = 1) -> None:
+        self._cells.mine()[0] += amount
+
+    @property
+    def value(self) -> int:
+        return self._cells.totals()[0]
+
+
+class Histogram:
+    """Counts of observations per fixed bucket, with their sum."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        labels: Optional[dict[str, str]] = None,
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.labels = labels or {}
+        # One cell per bucket, one for +Inf, then the sum
+        self._cells = _Cells(len(self.buckets) + 2)
+
+    def observe(self, value: float) -> None:
+        cells = self._cells.mine()
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        """Cumulative count per bucket (the last one is +Inf), and the sum."""
+        totals = self._cells.totals()
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+class Gauge:
+    """A value read from a callback when metrics are collected."""
+
+    def __init__(self, name: str, description: str, read: Callable[[], float]):
+        self.name = name
+        self.description = description
+        self.read = read
+
+
+class Family:
+    """Metrics sharing a name and description, one child per label combination."""
+
+    def __init__(self, kind: type, name: str, description: str, labelnames: tuple[str, ...], **options):
+        self.kind = kind
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.options = options
+        self._children: dict[tuple, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self.kind(
+                        self.name, self.description, labels=dict(zip(self.labelnames, values)), **self.options
+                    )
+                    self._children[values] = child
+        return child
+
+    def children(self) -> list:
+        with self._lock:
+            return list(self._children.values())
+
+
+_registry: dict[str, Counter | Histogram | Gauge | Family] = {}
+_registry_lock = threading.Lock()
+
+
+def _register(name: str, create: Callable[[], object]):
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = create()
+        return _registry[name]
+
+
+def counter(name: str, description: str, labels: tuple[str, ...] = ()) -> Counter | Family:
+    """Get or create the counter registered under name (a Family if labels are given)."""
+    if labels:
+        return _register(name, lambda: Family(Counter, name, description, labels))
+    return _register(name, lambda: Counter(name, description))
+
+
+def histogram(
+    name: str, description: str, labels: tuple[str, ...] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+) -> Histogram | Family:
+    """Get or create the histogram registered under name (a Family if labels are given)."""
+    if labels:
+        return _register(name, lambda: Family(Histogram, name, description, labels, buckets=buckets))
+    return _register(name, lambda: Histogram(name, description, buckets))
+
+
+def gauge(name: str, description: str, read: Callable[[], float]) -> Gauge:
+    """Register a gauge whose value is read from `read` at collection time."""
+    return _register(name, lambda: Gauge(name, description, read))
+
+
+def snapshot() -> dict[str, int]:
+    """Current value of every registered unlabeled counter."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: m.value for m in metrics if isinstance(m, Counter)}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str], **extra: str) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        kind = metric.kind if isinstance(metric, Family) else type(metric)
+        if kind is Gauge:
+            try:
+                value = metric.read()
+            except Exception:
+                # A gauge that cannot be read right now is left out of this scrape
+                continue
+        type_name = {Counter: "counter", Histogram: "histogram", Gauge: "gauge"}[kind]
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {type_name}")
+        if kind is Gauge:
+            lines.append(f"{metric.name} {_format_value(value)}")
+            continue
+        for child in metric.children() if isinstance(metric, Family) else [metric]:
+            if isinstance(child, Counter):
+                lines.append(f"{child.name}{_format_labels(child.labels)} {child.value}")
+                continue
+            cumulative, total = child.snapshot()
+            for bound, count in zip([*map(str, child.buckets), "+Inf"], cumulative):
+                lines.append(f"{child.name}_bucket{_format_labels(child.labels, le=bound)} {count}")
+            lines.append(f"{child.name}_sum{_format_labels(child.labels)} {_format_value(total)}")
+            lines.append(f"{child.name}_count{_format_labels(child.labels)} {cumulative[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# app -> {endpoint: route template}, built on the first routed request
+_route_templates: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def route_template(scope) -> Optional[str]:
+    """Route template of an ASGI request, e.g. /syncs/progress/{document}.
+
+    None when no route matched. The router sets the endpoint, so call this
+    once the app has handled the request (or while sending its response).
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return None
+    app = scope["app"]
+    templates = _route_templates.get(app)
+    if templates is None:
+        templates = _route_templates[app] = {
+            route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")
+        }
+    return templates.get(endpoint)
+
+
+PROGRESS_WRITES = counter("progress_writes_total", "Progress records written to the database")
+PROGRESS_WRITES_SKIPPED = counter(
+    "progress_writes_skipped_total", "Progress pushes identical to the stored record, not rewritten"
+)
+PROGRESS_WRITES_COALESCED = counter(
+    "progress_writes_coalesced_total", "Progress pushes replaced in the write-behind buffer before a flush"
+)
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests handled", labels=("method", "route", "status"))
+HTTP_REQUEST_DURATION = histogram(
+    "http_request_duration_seconds", "Time to produce the response headers", labels=("method", "route")
+)
+REPOSITORY_CALL_DURATION = histogram(
+    "repository_call_duration_seconds", "Time spent in repository methods",
+    labels=("backend", "repository", "method"),
+)
+BCRYPT_VERIFY_DURATION = histogram("bcrypt_verify_duration_seconds", "Time spent checking a password with bcrypt")
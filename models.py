@@ -1,5 +1,5 @@
 import time
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, UniqueConstraint, Index
 from pydantic import BaseModel
 from database import Base
 
@@ -24,6 +24,12 @@ class Progress(Base):
     device_id = Column(String, nullable=False)
     timestamp = Column(Integer, default=lambda: int(time.time()))
     filename = Column(String, nullable=True, index=True)
+    # Server time of the last write; timestamp is the client's under PROGRESS_CONFLICT_POLICY=newest
+    modified_at = Column(Integer, nullable=True, default=lambda: int(time.time()))
+
+    __table_args__ = (
+        Index('ix_progress_user_timestamp', 'user_id', 'timestamp'),
+    )
 
 
 class DocumentLink(Base):
@@ -33,6 +39,26 @@ class DocumentLink(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     document_hash = Column(String, nullable=False, index=True)
     canonical_hash = Column(String, nullable=False)
+    timestamp = Column(Integer, nullable=True, default=lambda: int(time.time()))
+
+    __table_args__ = (
+        Index('ix_document_links_user_timestamp', 'user_id', 'timestamp'),
+        Index('ix_document_links_user_canonical', 'user_id', 'canonical_hash'),
+    )
+
+
+class FilenameIndex(Base):
+    """First canonical hash seen for each of a user's filenames, for auto-linking."""
+    __tablename__ = "filename_index"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String, nullable=False)
+    canonical_hash = Column(String, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'filename', name='uq_user_filename'),
+    )
 
 
 class BookLabel(Base):
@@ -42,9 +68,28 @@ class BookLabel(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     canonical_hash = Column(String, nullable=False, index=True)
     label = Column(String, nullable=False)
+    timestamp = Column(Integer, nullable=True, default=lambda: int(time.time()))
 
     __table_args__ = (
         UniqueConstraint('user_id', 'canonical_hash', name='uq_user_canonical'),
+        Index('ix_book_labels_user_timestamp', 'user_id', 'timestamp'),
+    )
+
+
+class Deletion(Base):
+    """When a link or label was deleted, so the change feed can report it."""
+    __tablename__ = "deletions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # "link" (hash is the alias's document_hash) or "label" (hash is the canonical_hash)
+    kind = Column(String, nullable=False)
+    hash = Column(String, nullable=False)
+    timestamp = Column(Integer, nullable=False, default=lambda: int(time.time()))
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'kind', 'hash', name='uq_user_deletion'),
+        Index('ix_deletions_user_timestamp', 'user_id', 'timestamp'),
     )
 
 
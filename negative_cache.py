@@ -0,0 +1,195 @@
+"""Per-user Bloom filters over document hashes that have progress.
+
+KOReader asks for progress on every book open, including books that were
+never synced. With the cache enabled, GET /syncs/progress/{document} checks
+the user's filter first: a hash the filter has never seen (neither a document
+with progress nor a linked alias) is a definite miss and gets a 404 without
+touching the database.
+
+A filter is built from the database on the user's first pull, updated when
+this process writes progress or links, and rebuilt after NEGATIVE_CACHE_TTL
+seconds or once it is fuller than it was sized for. Writes made by other
+instances are only seen after a rebuild, so until then a pull of a book first
+synced elsewhere can be answered 404; keep the TTL short when several
+instances serve the same users.
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from metrics import counter
+
+NEGATIVE_CACHE_ENABLED = os.getenv("NEGATIVE_CACHE_ENABLED", "false").lower() == "true"
+# Seconds a user's filter is trusted before it is rebuilt from the database
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "60"))
+# Target false-positive rate the filters are sized for
+NEGATIVE_CACHE_FP_RATE = float(os.getenv("NEGATIVE_CACHE_FP_RATE", "0.01"))
+# Users whose filter is kept in memory
+NEGATIVE_CACHE_MAX_USERS = int(os.getenv("NEGATIVE_CACHE_MAX_USERS", "10000"))
+
+# Room for documents added after a build before the filter is resized
+_GROWTH = 2
+_MIN_CAPACITY = 256
+
+SHORT_CIRCUITED = counter(
+    "negative_cache_short_circuited_total", "Progress pulls answered 404 by the negative cache"
+)
+FALSE_POSITIVES = counter(
+    "negative_cache_false_positives_total", "Progress pulls the negative cache let through that found nothing"
+)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings."""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # Kirsch-Mitzenmacher: k positions from two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        new = False
+        for position in self._positions(item):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                new = True
+        # Items already present (every page turn re-adds its document) do not fill the filter
+        if new:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def estimated_fp_rate(self) -> float:
+        """Expected false-positive rate at the current fill."""
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+
+class _UserFilter:
+    def __init__(self, hashes: list[str], fp_rate: float):
+        self.loaded_at = time.monotonic()
+        self.bloom = BloomFilter(max(_MIN_CAPACITY, len(hashes) * _GROWTH), fp_rate)
+        for document_hash in hashes:
+            self.bloom.add(document_hash)
+
+
+class NegativeCache:
+    """Per-user Bloom filters answering "definitely has no progress"."""
+
+    def __init__(
+        self,
+        ttl: float = NEGATIVE_CACHE_TTL,
+        fp_rate: float = NEGATIVE_CACHE_FP_RATE,
+        max_users: int = NEGATIVE_CACHE_MAX_USERS,
+    ):
+        self.ttl = ttl
+        self.fp_rate = fp_rate
+        self.max_users = max_users
+        self._users: OrderedDict[str, _UserFilter] = OrderedDict()
+        # Hashes written while a user's filter is being built, and the number of builds running
+        self._building: dict[str, tuple[set[str], list[int]]] = {}
+        self._lock = threading.Lock()
+
+    def might_have(self, user_id: str, document_hash: str, load: Callable[[], list[str]]) -> bool:
+        """False if document_hash definitely has no progress or link for the user.
+
+        `load` returns every document and alias hash of the user and is only
+        called when the user's filter is missing, expired or overfull.
+        """
+        user_filter = self._filter(user_id, load)
+        with self._lock:
+            present = document_hash in user_filter.bloom
+        if not present:
+            SHORT_CIRCUITED.inc()
+        return present
+
+    def record_miss(self) -> None:
+        """Report that a hash the filter let through turned out to have no progress."""
+        FALSE_POSITIVES.inc()
+
+    def add(self, user_id: str, document_hashes: Iterable[str]) -> None:
+        """Record hashes that now have progress or a link."""
+        document_hashes = list(document_hashes)
+        with self._lock:
+            building = self._building.get(user_id)
+            if building is not None:
+                building[0].update(document_hashes)
+            user_filter = self._users.get(user_id)
+            if user_filter is not None:
+                for document_hash in document_hashes:
+                    user_filter.bloom.add(document_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            filters = [f.bloom for f in self._users.values()]
+        short_circuited = SHORT_CIRCUITED.value
+        false_positives = FALSE_POSITIVES.value
+        misses = short_circuited + false_positives
+        return {
+            "users": len(filters),
+            "short_circuited": short_circuited,
+            "false_positives": false_positives,
+            # Share of pulls for unknown hashes that still reached the database
+            "observed_fp_rate": false_positives / misses if misses else 0.0,
+            "estimated_fp_rate": max((f.estimated_fp_rate() for f in filters), default=0.0),
+            "memory_bytes": sum(len(f.bits) for f in filters),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+            self._building.clear()
+
+    def _filter(self, user_id: str, load: Callable[[], list[str]]) -> _UserFilter:
+        with self._lock:
+            user_filter = self._users.get(user_id)
+            if user_filter is not None and self._fresh(user_filter):
+                self._users.move_to_end(user_id)
+                return user_filter
+            written, builds = self._building.setdefault(user_id, (set(), [0]))
+            builds[0] += 1
+        try:
+            user_filter = _UserFilter(load(), self.fp_rate)
+        except Exception:
+            with self._lock:
+                self._end_build(user_id, builds)
+            raise
+        with self._lock:
+            self._end_build(user_id, builds)
+            # Writes that may have missed the snapshot load() read
+            for document_hash in written:
+                user_filter.bloom.add(document_hash)
+            self._users[user_id] = user_filter
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return user_filter
+
+    def _end_build(self, user_id: str, builds: list[int]) -> None:
+        builds[0] -= 1
+        if not builds[0]:
+            self._building.pop(user_id, None)
+
+    def _fresh(self, user_filter: _UserFilter) -> bool:
+        return (
+            time.monotonic() - user_filter.loaded_at < self.ttl
+            and user_filter.bloom.count <= user_filter.bloom.capacity
+        )
+
+
+negative_cache: Optional[NegativeCache] = NegativeCache() if NEGATIVE_CACHE_ENABLED else None
@@ -0,0 +1,208 @@
+"""On-demand sampling profiler for the running server process.
+
+While armed, a background thread snapshots the stack of every other thread
+with sys._current_frames() every PROFILER_INTERVAL_MS and counts identical
+stacks. Nothing is hooked into the interpreter, so the profiled code runs at
+full speed; the cost is the sampler thread itself. When the profiler is off
+(the default) there is no sampler thread and requests only read one
+attribute.
+
+Two modes:
+  - for N seconds: every sample is kept;
+  - 1 in K requests: samples are only kept while one of the selected requests
+    is in flight. Requests running concurrently on other threads are sampled
+    too, so under load this mode favors precision over isolation.
+
+Profiles are returned in the collapsed-stack format used by flamegraph.pl and
+speedscope, or as a speedscope JSON document. With several workers, only the
+process that served the admin request is profiled.
+"""
+
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+# Upper bound on a profiling session, whatever the admin asked for
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+
+_PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_STDLIB = sysconfig.get_paths()["stdlib"] + os.sep
+# Stacks whose innermost frame sits in one of these is a thread waiting for work.
+# With uvloop the event loop waits in C, under asyncio's Runner.run.
+_IDLE_MODULES = tuple(
+    os.path.join(_STDLIB, name)
+    for name in ("threading.py", "selectors.py", "queue.py", "socketserver.py", os.path.join("asyncio", "runners.py"))
+)
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_PROJECT_ROOT):
+        filename = filename[len(_PROJECT_ROOT):]
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(_STDLIB):
+        filename = filename[len(_STDLIB):]
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Collects stack samples of all threads while armed."""
+
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, max_seconds: float = PROFILER_MAX_SECONDS):
+        self.interval_ms = interval_ms
+        self.max_seconds = max_seconds
+        # Read on every request, so it is the only thing checked when off
+        self.every: Optional[int] = None
+        self._every_request = True
+        self._request_count = 0
+        self._active_requests = 0
+        self._samples: Counter = Counter()
+        self._labels: dict = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self.mode: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: Optional[float] = None, every: Optional[int] = None) -> None:
+        """Profile for `seconds`, or only during 1 in `every` requests (until stop()
+        or max_seconds). Raises RuntimeError if a session is already running."""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("The profiler is already running")
+            self._samples = Counter()
+            self._labels = {}
+            self._stop.clear()
+            self._request_count = 0
+            self._active_requests = 0
+            duration = min(seconds or self.max_seconds, self.max_seconds)
+            self.mode = f"1 in {every} requests" if every else f"{duration:g} seconds"
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._every_request = not every
+            self.every = every
+            self._thread = threading.Thread(
+                target=self._run, args=(time.monotonic() + duration,), name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self.every = None
+            thread = self._thread
+            self._stop.set()
+        if thread is not None:
+            thread.join()
+
+    def request_started(self) -> bool:
+        """Called per request while `every` is set; True if this one is profiled."""
+        with self._lock:
+            if self.every is None:
+                return False
+            self._request_count += 1
+            if self._request_count % self.every:
+                return False
+            self._active_requests += 1
+            return True
+
+    def request_finished(self) -> None:
+        with self._lock:
+            self._active_requests -= 1
+
+    def _run(self, deadline: float) -> None:
+        interval = self.interval_ms / 1000
+        me = threading.get_ident()
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                if self._every_request or self._active_requests > 0:
+                    self._sample(me)
+                self._stop.wait(interval)
+        finally:
+            with self._lock:
+                self.every = None
+                self.stopped_at = time.time()
+
+    def _sample(self, me: int) -> None:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me or frame.f_code.co_filename.startswith(_IDLE_MODULES):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.reverse()
+            self._samples[tuple(stack)] += 1
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "mode": self.mode,
+            "interval_ms": self.interval_ms,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "samples": sum(self._samples.values()),
+        }
+
+    def collapsed(self) -> str:
+        """One "root;...;leaf count" line per distinct stack."""
+        samples = dict(self._samples)
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(samples.items()))
+
+    def speedscope(self) -> dict:
+        """The samples as a speedscope "sampled" profile."""
+        samples = dict(self._samples)
+        frames: dict[str, int] = {}
+        stacks, weights = [], []
+        for stack, count in samples.items():
+            stacks.append([frames.setdefault(label, len(frames)) for label in stack])
+            weights.append(count * self.interval_ms)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": label} for label in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"koreader-sync ({self.mode})",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": stacks,
+                "weights": weights,
+            }],
+            "name": "koreader-sync",
+            "exporter": "koreader-sync profiler",
+        }
+
+
+profiler = SamplingProfiler()
+
+
+class ProfilerMiddleware:
+    """Marks the requests selected by the 1-in-K mode of the profiler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if profiler.every is None or scope["type"] != "http" or not profiler.request_started():
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.request_finished()
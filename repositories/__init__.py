@@ -1,7 +1,10 @@
 import os
+from contextlib import contextmanager
 from typing import Generator
 
 from repositories.protocols import UserRepository, ProgressRepository, DocumentLinkRepository, BookLabelRepository
+from repositories.timing import TimedRepository
+from repositories.write_behind import ProgressWriteBuffer, WriteBehindProgressRepository
 
 DB_BACKEND = os.getenv("DB_BACKEND", "sql")
 
@@ -10,43 +13,73 @@ def get_user_repository() -> Generator[UserRepository, None, None]:
     """Factory for user repository based on DB_BACKEND environment variable."""
     if DB_BACKEND == "dynamodb":
         from repositories.dynamodb import DynamoUserRepository
-        yield DynamoUserRepository()
+        yield TimedRepository(DynamoUserRepository(), DB_BACKEND, "user")
+    elif DB_BACKEND == "memory":
+        from repositories.memory import MemoryUserRepository
+        yield TimedRepository(MemoryUserRepository(), DB_BACKEND, "user")
     else:
         from database import get_db
         from repositories.sql import SQLUserRepository
         db = next(get_db())
         try:
-            yield SQLUserRepository(db)
+            yield TimedRepository(SQLUserRepository(db), DB_BACKEND, "user")
         finally:
             db.close()
 
 
-def get_progress_repository() -> Generator[ProgressRepository, None, None]:
-    """Factory for progress repository based on DB_BACKEND environment variable."""
+def _progress_repository() -> Generator[ProgressRepository, None, None]:
     if DB_BACKEND == "dynamodb":
         from repositories.dynamodb import DynamoProgressRepository
-        yield DynamoProgressRepository()
+        yield TimedRepository(DynamoProgressRepository(), DB_BACKEND, "progress")
+    elif DB_BACKEND == "memory":
+        from repositories.memory import MemoryProgressRepository
+        yield TimedRepository(MemoryProgressRepository(), DB_BACKEND, "progress")
     else:
         from database import get_db
         from repositories.sql import SQLProgressRepository
         db = next(get_db())
         try:
-            yield SQLProgressRepository(db)
+            yield TimedRepository(SQLProgressRepository(db), DB_BACKEND, "progress")
         finally:
             db.close()
 
 
+# Optional write-behind mode: progress pushes are coalesced in memory and
+# flushed in batches. Requires the app lifespan to run so pending writes are
+# flushed at shutdown, so leave it off for AWS Lambda.
+PROGRESS_WRITE_BEHIND = os.getenv("PROGRESS_WRITE_BEHIND", "false").lower() == "true"
+progress_write_buffer = ProgressWriteBuffer(
+    contextmanager(_progress_repository),
+    flush_interval=float(os.getenv("PROGRESS_FLUSH_INTERVAL", "5")),
+    max_pending=int(os.getenv("PROGRESS_FLUSH_MAX_PENDING", "500")),
+) if PROGRESS_WRITE_BEHIND else None
+
+
+def get_progress_repository() -> Generator[ProgressRepository, None, None]:
+    """Factory for progress repository based on DB_BACKEND environment variable."""
+    for repository in _progress_repository():
+        if progress_write_buffer is not None:
+            yield WriteBehindProgressRepository(
+                repository, progress_write_buffer, contextmanager(get_document_link_repository)
+            )
+        else:
+            yield repository
+
+
 def get_document_link_repository() -> Generator[DocumentLinkRepository, None, None]:
     """Factory for document link repository based on DB_BACKEND environment variable."""
     if DB_BACKEND == "dynamodb":
         from repositories.dynamodb import DynamoDocumentLinkRepository
-        yield DynamoDocumentLinkRepository()
+        yield TimedRepository(DynamoDocumentLinkRepository(), DB_BACKEND, "document_link")
+    elif DB_BACKEND == "memory":
+        from repositories.memory import MemoryDocumentLinkRepository
+        yield TimedRepository(MemoryDocumentLinkRepository(), DB_BACKEND, "document_link")
     else:
         from database import get_db
         from repositories.sql import SQLDocumentLinkRepository
         db = next(get_db())
         try:
-            yield SQLDocumentLinkRepository(db)
+            yield TimedRepository(SQLDocumentLinkRepository(db), DB_BACKEND, "document_link")
         finally:
             db.close()
 
@@ -55,12 +88,15 @@ def get_book_label_repository() -> Generator[BookLabelRepository, None, None]:
     """Factory for book label repository based on DB_BACKEND environment variable."""
     if DB_BACKEND == "dynamodb":
         from repositories.dynamodb import DynamoBookLabelRepository
-        yield DynamoBookLabelRepository()
+        yield TimedRepository(DynamoBookLabelRepository(), DB_BACKEND, "book_label")
+    elif DB_BACKEND == "memory":
+        from repositories.memory import MemoryBookLabelRepository
+        yield TimedRepository(MemoryBookLabelRepository(), DB_BACKEND, "book_label")
     else:
         from database import get_db
         from repositories.sql import SQLBookLabelRepository
         db = next(get_db())
         try:
-            yield SQLBookLabelRepository(db)
+            yield TimedRepository(SQLBookLabelRepository(db), DB_BACKEND, "book_label")
         finally:
             db.close()
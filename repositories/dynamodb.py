@@ -1,19 +1,190 @@
 import os
+import threading
+import time
+from functools import lru_cache
 from typing import Optional
 from decimal import Decimal
 import boto3
+from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
+from link_graph import LinkMerge, plan_merge
+from metrics import PROGRESS_WRITES, PROGRESS_WRITES_SKIPPED
+from request_stats import record_round_trip
 from repositories.protocols import UserEntity, ProgressEntity, DocumentLinkEntity, BookLabelEntity
 
 
-def get_dynamodb_resource():
-    """Get DynamoDB resource, supporting local testing."""
+@lru_cache(maxsize=None)
+def _shared_dynamodb_resource():
     endpoint_url = os.getenv("DYNAMODB_ENDPOINT_URL")
     region = os.getenv("AWS_REGION", "us-east-1")
 
     if endpoint_url:
-        return boto3.resource("dynamodb", endpoint_url=endpoint_url, region_name=region)
-    return boto3.resource("dynamodb", region_name=region)
+        resource = boto3.resource("dynamodb", endpoint_url=endpoint_url, region_name=region)
+    else:
+        resource = boto3.resource("dynamodb", region_name=region)
+    # Every API call (including retries) is a round-trip of the current request
+    resource.meta.client.meta.events.register("before-send.dynamodb", record_round_trip)
+    return resource
+
+
+_thread_resources = threading.local()
+
+
+def get_dynamodb_resource():
+    """Get DynamoDB resource, supporting local testing.
+
+    Building a resource loads the service model, which took about 20 ms per
+    repository per request, so that happens once per process. boto3 resources
+    are not thread-safe, so each thread gets its own resource object, built
+    around the one low-level client (which is thread-safe and keeps the
+    connections opened so far).
+    """
+    resource = getattr(_thread_resources, "resource", None)
+    if resource is None:
+        shared = _shared_dynamodb_resource()
+        resource = _thread_resources.resource = type(shared)(client=shared.meta.client)
+    return resource
+
+
+# BatchGetItem accepts at most 100 keys per call, and IN (...) filters 100 operands
+BATCH_GET_LIMIT = 100
+
+
+def _batch_get_items(dynamodb, table_name: str, keys: list[dict], consistent: bool = False) -> list[dict]:
+    """Fetch items by key with BatchGetItem, retrying unprocessed keys."""
+    items = []
+    for i in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {table_name: {"Keys": keys[i:i + BATCH_GET_LIMIT], "ConsistentRead": consistent}}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get("Responses", {}).get(table_name, []))
+            request = response.get("UnprocessedKeys")
+    return items
+
+
+def _batch_get_tables(dynamodb, request: dict) -> dict[str, list[dict]]:
+    """Fetch items from several tables in one BatchGetItem, retrying unprocessed keys."""
+    items: dict[str, list[dict]] = {table_name: [] for table_name in request}
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        for table_name, table_items in response.get("Responses", {}).items():
+            items[table_name].extend(table_items)
+        request = response.get("UnprocessedKeys")
+    return items
+
+
+def _query_all(table, **kwargs) -> list[dict]:
+    """Run a query and follow pagination until the result set is exhausted."""
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return items
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+# GSI (PK=user_id, SK=timestamp) on the progress, document links and book labels tables
+TIMESTAMP_INDEX = "user_id-timestamp-index"
+# GSI (PK=user_id, SK=modified_at) on the progress table
+MODIFIED_INDEX = "user_id-modified_at-index"
+# GSI (PK=user_id, SK=canonical_hash) on the document links table
+CANONICAL_INDEX = "user_id-canonical_hash-index"
+
+
+def _query_changed(
+    table, user_id: str, since: int, until: int, attribute: str = "timestamp", index: str = TIMESTAMP_INDEX
+) -> list[dict]:
+    """Items with since < attribute <= until, using the index on that attribute."""
+    if since <= 0:
+        # Full sync: items written before change tracking lack the attribute and
+        # are absent from the sparse index, so read the whole partition
+        items = _query_all(table, KeyConditionExpression=Key("user_id").eq(user_id))
+        return [item for item in items if int(item.get(attribute, 0)) <= until]
+    return _query_all(
+        table,
+        IndexName=index,
+        KeyConditionExpression=Key("user_id").eq(user_id) & Key(attribute).between(since + 1, until),
+    )
+
+
+def _deletions_table(dynamodb):
+    # PK=user_id, SK=key ("link#<document_hash>" or "label#<canonical_hash>")
+    return dynamodb.Table(os.getenv("DYNAMODB_DELETIONS_TABLE", "reader-progress-deletions"))
+
+
+def _record_deletions(table, user_id: str, kind: str, hashes: list[str], timestamp: int) -> None:
+    """Record when the links or labels of hashes were deleted, replacing earlier records."""
+    with table.batch_writer(overwrite_by_pkeys=["user_id", "key"]) as batch:
+        for deleted_hash in hashes:
+            batch.put_item(Item={
+                "user_id": user_id,
+                "key": f"{kind}#{deleted_hash}",
+                "kind": kind,
+                "hash": deleted_hash,
+                "timestamp": timestamp
+            })
+
+
+def _deleted_between(table, user_id: str, kind: str, since: int, until: int) -> list[str]:
+    # A full sync (since=0) only lists what exists
+    if since <= 0:
+        return []
+    items = _query_all(
+        table,
+        IndexName=TIMESTAMP_INDEX,
+        KeyConditionExpression=Key("user_id").eq(user_id) & Key("timestamp").between(since + 1, until),
+        FilterExpression=Attr("kind").eq(kind),
+    )
+    return [item["hash"] for item in items]
+
+
+def _item_to_link(item: dict) -> DocumentLinkEntity:
+    return DocumentLinkEntity(
+        user_id=item["user_id"],
+        document_hash=item["document_hash"],
+        canonical_hash=item["canonical_hash"],
+        timestamp=int(item["timestamp"]) if "timestamp" in item else None
+    )
+
+
+def _item_to_label(item: dict) -> BookLabelEntity:
+    return BookLabelEntity(
+        user_id=item["user_id"],
+        canonical_hash=item["canonical_hash"],
+        label=item["label"],
+        timestamp=int(item["timestamp"]) if "timestamp" in item else None
+    )
+
+
+def _item_to_progress(item: dict) -> ProgressEntity:
+    return ProgressEntity(
+        user_id=item["user_id"],
+        document=item["document"],
+        progress=item["progress"],
+        percentage=float(item["percentage"]),
+        device=item["device"],
+        device_id=item["device_id"],
+        timestamp=int(item["timestamp"]),
+        filename=item.get("filename"),
+        modified_at=int(item["modified_at"]) if "modified_at" in item else None
+    )
+
+
+def _progress_to_item(progress: ProgressEntity) -> dict:
+    item = {
+        "user_id": progress.user_id,
+        "document": progress.document,
+        "progress": progress.progress,
+        "percentage": Decimal(str(progress.percentage)),
+        "device": progress.device,
+        "device_id": progress.device_id,
+        "timestamp": progress.timestamp,
+        "modified_at": int(time.time())
+    }
+    if progress.filename:
+        item["filename"] = progress.filename
+    return item
 
 
 class DynamoUserRepository:
@@ -21,8 +192,8 @@ class DynamoUserRepository:
 
     def __init__(self):
         dynamodb = get_dynamodb_resource()
-        table_name = os.getenv("DYNAMODB_USERS_TABLE", "reader-progress-users")
-        self.table = dynamodb.Table(table_name)
+        self.table_name = os.getenv("DYNAMODB_USERS_TABLE", "reader-progress-users")
+        self.table = dynamodb.Table(self.table_name)
 
     def get_by_username(self, username: str) -> Optional[UserEntity]:
         try:
@@ -65,9 +236,10 @@ class DynamoProgressRepository:
     """DynamoDB-based progress repository."""
 
     def __init__(self):
-        dynamodb = get_dynamodb_resource()
-        table_name = os.getenv("DYNAMODB_PROGRESS_TABLE", "reader-progress-progress")
-        self.table = dynamodb.Table(table_name)
+        self.dynamodb = get_dynamodb_resource()
+        self.table_name = os.getenv("DYNAMODB_PROGRESS_TABLE", "reader-progress-progress")
+        self.table = self.dynamodb.Table(self.table_name)
+        self.links_table_name = os.getenv("DYNAMODB_DOCUMENT_LINKS_TABLE", "reader-progress-document-links")
 
     def get_by_user_and_document(
         self, user_id: str, document: str
@@ -82,18 +254,38 @@ class DynamoProgressRepository:
             item = response.get("Item")
             if not item:
                 return None
-            return ProgressEntity(
-                user_id=item["user_id"],
-                document=item["document"],
-                progress=item["progress"],
-                percentage=float(item["percentage"]),
-                device=item["device"],
-                device_id=item["device_id"],
-                timestamp=int(item["timestamp"]),
-                filename=item.get("filename")
-            )
+            return _item_to_progress(item)
+        except ClientError:
+            return None
+
+    def get_by_user_and_alias(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        # The link and the progress item are read together. Unlinked and
+        # canonical hashes need nothing more; an alias needs one more read
+        # for its canonical's progress.
+        try:
+            items = _batch_get_tables(self.dynamodb, {
+                self.table_name: {"Keys": [{"user_id": user_id, "document": document}]},
+                self.links_table_name: {"Keys": [{"user_id": user_id, "document_hash": document}]},
+            })
         except ClientError:
             return None
+        links = items[self.links_table_name]
+        if links:
+            return self.get_by_user_and_document(user_id, links[0]["canonical_hash"])
+        progress = items[self.table_name]
+        return _item_to_progress(progress[0]) if progress else None
+
+    def get_by_user_and_documents(
+        self, user_id: str, documents: list[str]
+    ) -> dict[str, ProgressEntity]:
+        keys = [{"user_id": user_id, "document": document} for document in set(documents)]
+        try:
+            items = _batch_get_items(self.dynamodb, self.table_name, keys)
+        except ClientError:
+            return {}
+        return {item["document"]: _item_to_progress(item) for item in items}
 
     def get_by_user_and_filename(
         self, user_id: str, filename: str
@@ -113,16 +305,7 @@ class DynamoProgressRepository:
                 return None
             # Return the most recent one
             item = max(items, key=lambda x: int(x.get("timestamp", 0)))
-            return ProgressEntity(
-                user_id=item["user_id"],
-                document=item["document"],
-                progress=item["progress"],
-                percentage=float(item["percentage"]),
-                device=item["device"],
-                device_id=item["device_id"],
-                timestamp=int(item["timestamp"]),
-                filename=item.get("filename")
-            )
+            return _item_to_progress(item)
         except ClientError:
             return None
 
@@ -137,67 +320,108 @@ class DynamoProgressRepository:
                     ":fname": filename
                 }
             )
-            return [
-                ProgressEntity(
-                    user_id=item["user_id"],
-                    document=item["document"],
-                    progress=item["progress"],
-                    percentage=float(item["percentage"]),
-                    device=item["device"],
-                    device_id=item["device_id"],
-                    timestamp=int(item["timestamp"]),
-                    filename=item.get("filename")
-                )
-                for item in response.get("Items", [])
-            ]
+            return [_item_to_progress(item) for item in response.get("Items", [])]
+        except ClientError:
+            return []
+
+    def get_all_by_user_and_filenames(
+        self, user_id: str, filenames: list[str]
+    ) -> list[ProgressEntity]:
+        unique = list(set(filenames))
+        items = []
+        try:
+            # Query the user's partition instead of scanning the whole table
+            for i in range(0, len(unique), BATCH_GET_LIMIT):
+                items.extend(_query_all(
+                    self.table,
+                    KeyConditionExpression=Key("user_id").eq(user_id),
+                    FilterExpression=Attr("filename").is_in(unique[i:i + BATCH_GET_LIMIT]),
+                ))
         except ClientError:
             return []
+        return [_item_to_progress(item) for item in items]
 
     def upsert(self, progress: ProgressEntity) -> ProgressEntity:
-        item = {
-            "user_id": progress.user_id,
-            "document": progress.document,
-            "progress": progress.progress,
-            "percentage": Decimal(str(progress.percentage)),
-            "device": progress.device,
-            "device_id": progress.device_id,
-            "timestamp": progress.timestamp
-        }
+        # Only write when something besides the timestamp differs from the stored
+        # item; an identical re-sync fails the condition and nothing is rewritten
+        condition = (
+            Attr("document").not_exists()
+            | Attr("progress").ne(progress.progress)
+            | Attr("percentage").ne(Decimal(str(progress.percentage)))
+            | Attr("device").ne(progress.device)
+            | Attr("device_id").ne(progress.device_id)
+        )
         if progress.filename:
-            item["filename"] = progress.filename
-        self.table.put_item(Item=item)
+            condition = condition | Attr("filename").ne(progress.filename)
+        try:
+            self.table.put_item(Item=_progress_to_item(progress), ConditionExpression=condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            PROGRESS_WRITES_SKIPPED.inc()
+            return progress
+        PROGRESS_WRITES.inc()
         return progress
 
+    def upsert_if_newer(self, progress: ProgressEntity, field: str = "timestamp") -> bool:
+        item = _progress_to_item(progress)
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression=Attr("document").not_exists() | Attr(field).lte(item[field])
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        PROGRESS_WRITES.inc()
+        return True
+
+    def upsert_many(self, progress_list: list[ProgressEntity]) -> list[ProgressEntity]:
+        # Later entries for the same key replace earlier ones instead of failing the batch
+        with self.table.batch_writer(overwrite_by_pkeys=["user_id", "document"]) as batch:
+            for progress in progress_list:
+                batch.put_item(Item=_progress_to_item(progress))
+        PROGRESS_WRITES.inc(len(progress_list))
+        return progress_list
+
     def get_all_by_user(self, user_id: str) -> list[ProgressEntity]:
         try:
             response = self.table.query(
                 KeyConditionExpression="user_id = :uid",
                 ExpressionAttributeValues={":uid": user_id}
             )
-            return [
-                ProgressEntity(
-                    user_id=item["user_id"],
-                    document=item["document"],
-                    progress=item["progress"],
-                    percentage=float(item["percentage"]),
-                    device=item["device"],
-                    device_id=item["device_id"],
-                    timestamp=int(item["timestamp"]),
-                    filename=item.get("filename")
+            return [_item_to_progress(item) for item in response.get("Items", [])]
+        except ClientError:
+            return []
+
+    def get_all_by_user_since(self, user_id: str, since: int, until: int) -> list[ProgressEntity]:
+        try:
+            items = _query_changed(self.table, user_id, since, until, "modified_at", MODIFIED_INDEX)
+            if since > 0:
+                # Items written before modified_at was added are only in the timestamp index
+                items += _query_all(
+                    self.table,
+                    IndexName=TIMESTAMP_INDEX,
+                    KeyConditionExpression=Key("user_id").eq(user_id) & Key("timestamp").between(since + 1, until),
+                    FilterExpression=Attr("modified_at").not_exists(),
                 )
-                for item in response.get("Items", [])
-            ]
         except ClientError:
             return []
+        return [_item_to_progress(item) for item in items]
 
 
 class DynamoDocumentLinkRepository:
     """DynamoDB-based document link repository."""
 
     def __init__(self):
-        dynamodb = get_dynamodb_resource()
-        table_name = os.getenv("DYNAMODB_DOCUMENT_LINKS_TABLE", "reader-progress-document-links")
-        self.table = dynamodb.Table(table_name)
+        self.dynamodb = get_dynamodb_resource()
+        self.table_name = os.getenv("DYNAMODB_DOCUMENT_LINKS_TABLE", "reader-progress-document-links")
+        self.table = self.dynamodb.Table(self.table_name)
+        # PK=user_id, SK=filename
+        self.filename_table_name = os.getenv("DYNAMODB_FILENAME_INDEX_TABLE", "reader-progress-filename-index")
+        self.filename_table = self.dynamodb.Table(self.filename_table_name)
+        self.deletions_table = _deletions_table(self.dynamodb)
 
     def get_canonical(self, user_id: str, document_hash: str) -> Optional[str]:
         try:
@@ -212,71 +436,206 @@ class DynamoDocumentLinkRepository:
         except ClientError:
             return None
 
+    def get_canonicals(self, user_id: str, document_hashes: list[str]) -> dict[str, str]:
+        keys = [
+            {"user_id": user_id, "document_hash": document_hash}
+            for document_hash in set(document_hashes)
+        ]
+        try:
+            items = _batch_get_items(self.dynamodb, self.table_name, keys)
+        except ClientError:
+            return {}
+        return {item["document_hash"]: item["canonical_hash"] for item in items}
+
     def create_link(self, user_id: str, document_hash: str, canonical_hash: str) -> DocumentLinkEntity:
+        timestamp = int(time.time())
         self.table.put_item(
             Item={
                 "user_id": user_id,
                 "document_hash": document_hash,
-                "canonical_hash": canonical_hash
+                "canonical_hash": canonical_hash,
+                "timestamp": timestamp
             }
         )
         return DocumentLinkEntity(
             user_id=user_id,
             document_hash=document_hash,
-            canonical_hash=canonical_hash
+            canonical_hash=canonical_hash,
+            timestamp=timestamp
         )
 
+    def create_links(self, user_id: str, links: dict[str, str]) -> list[DocumentLinkEntity]:
+        timestamp = int(time.time())
+        with self.table.batch_writer() as batch:
+            for document_hash, canonical_hash in links.items():
+                batch.put_item(
+                    Item={
+                        "user_id": user_id,
+                        "document_hash": document_hash,
+                        "canonical_hash": canonical_hash,
+                        "timestamp": timestamp
+                    }
+                )
+        return [
+            DocumentLinkEntity(
+                user_id=user_id,
+                document_hash=document_hash,
+                canonical_hash=canonical_hash,
+                timestamp=timestamp
+            )
+            for document_hash, canonical_hash in links.items()
+        ]
+
+    def merge_links(self, user_id: str, links: dict[str, str]) -> dict[str, str]:
+        if not links:
+            return {}
+        keys = [
+            {"user_id": user_id, "document_hash": document_hash}
+            for document_hash in {h for pair in links.items() for h in pair}
+        ]
+        # Strongly consistent, so a link written just before is never missed
+        stored = _batch_get_items(self.dynamodb, self.table_name, keys, consistent=True)
+        merge = plan_merge({item["document_hash"]: item["canonical_hash"] for item in stored}, links)
+        self._apply_merge(user_id, merge)
+        return merge.roots
+
+    def compact_links(self, user_id: str) -> int:
+        stored = {link.document_hash: link.canonical_hash for link in self.get_all_links(user_id)}
+        merge = plan_merge(stored, {})
+        self._apply_merge(user_id, merge)
+        return len(merge.rewrites) + len(merge.deletes)
+
+    def _apply_merge(self, user_id: str, merge: LinkMerge) -> None:
+        if not (merge.absorbed or merge.rewrites or merge.deletes):
+            return
+        timestamp = int(time.time())
+        rewrites = dict(merge.rewrites)
+        if merge.absorbed:
+            # Members of absorbed groups are read from the base table rather than
+            # the eventually consistent canonical index, which may not list a
+            # member linked moments ago and would leave it two hops deep
+            members = _query_all(
+                self.table,
+                KeyConditionExpression=Key("user_id").eq(user_id),
+                FilterExpression=Attr("canonical_hash").is_in(list(merge.absorbed)),
+                ConsistentRead=True,
+            )
+            for item in members:
+                rewrites[item["document_hash"]] = merge.absorbed[item["canonical_hash"]]
+        with self.table.batch_writer(overwrite_by_pkeys=["user_id", "document_hash"]) as batch:
+            for document_hash in merge.deletes:
+                batch.delete_item(Key={"user_id": user_id, "document_hash": document_hash})
+            for document_hash, root in rewrites.items():
+                batch.put_item(
+                    Item={
+                        "user_id": user_id,
+                        "document_hash": document_hash,
+                        "canonical_hash": root,
+                        "timestamp": timestamp
+                    }
+                )
+        if merge.deletes:
+            _record_deletions(self.deletions_table, user_id, "link", merge.deletes, timestamp)
+
     def get_all_links(self, user_id: str) -> list[DocumentLinkEntity]:
         try:
             response = self.table.query(
                 KeyConditionExpression="user_id = :uid",
                 ExpressionAttributeValues={":uid": user_id}
             )
-            return [
-                DocumentLinkEntity(
-                    user_id=item["user_id"],
-                    document_hash=item["document_hash"],
-                    canonical_hash=item["canonical_hash"]
-                )
-                for item in response.get("Items", [])
-            ]
+            return [_item_to_link(item) for item in response.get("Items", [])]
         except ClientError:
             return []
 
     def delete_link(self, user_id: str, document_hash: str) -> bool:
         try:
-            self.table.delete_item(
+            response = self.table.delete_item(
                 Key={
                     "user_id": user_id,
                     "document_hash": document_hash
-                }
+                },
+                ReturnValues="ALL_OLD"
             )
-            return True
         except ClientError:
             return False
+        if "Attributes" not in response:
+            return False
+        _record_deletions(self.deletions_table, user_id, "link", [document_hash], int(time.time()))
+        return True
 
     def get_linked_hashes(self, user_id: str, canonical_hash: str) -> list[str]:
         try:
-            # Scan with filter (would be better with GSI on canonical_hash)
-            response = self.table.scan(
-                FilterExpression="user_id = :uid AND canonical_hash = :chash",
-                ExpressionAttributeValues={
-                    ":uid": user_id,
-                    ":chash": canonical_hash
-                }
+            items = _query_all(
+                self.table,
+                IndexName=CANONICAL_INDEX,
+                KeyConditionExpression=Key("user_id").eq(user_id) & Key("canonical_hash").eq(canonical_hash),
             )
-            return [item["document_hash"] for item in response.get("Items", [])]
         except ClientError:
             return []
+        return [item["document_hash"] for item in items]
+
+    def get_linked_hashes_by_canonical(self, user_id: str, canonical_hashes: list[str]) -> dict[str, list[str]]:
+        # One index query per canonical; callers pass a page of results, not a library
+        linked = {}
+        for canonical_hash in set(canonical_hashes):
+            hashes = self.get_linked_hashes(user_id, canonical_hash)
+            if hashes:
+                linked[canonical_hash] = hashes
+        return linked
+
+    def get_links_since(self, user_id: str, since: int, until: int) -> list[DocumentLinkEntity]:
+        try:
+            items = _query_changed(self.table, user_id, since, until)
+        except ClientError:
+            return []
+        return [_item_to_link(item) for item in items]
+
+    def get_deleted_links_since(self, user_id: str, since: int, until: int) -> list[str]:
+        try:
+            return _deleted_between(self.deletions_table, user_id, "link", since, until)
+        except ClientError:
+            return []
+
+    def get_filename_canonicals(self, user_id: str, filenames: list[str]) -> dict[str, str]:
+        keys = [{"user_id": user_id, "filename": filename} for filename in set(filenames)]
+        try:
+            items = _batch_get_items(self.dynamodb, self.filename_table_name, keys)
+        except ClientError:
+            return {}
+        return {item["filename"]: item["canonical_hash"] for item in items}
+
+    def get_all_filename_canonicals(self, user_id: str) -> dict[str, str]:
+        try:
+            items = _query_all(self.filename_table, KeyConditionExpression=Key("user_id").eq(user_id))
+        except ClientError:
+            return {}
+        return {item["filename"]: item["canonical_hash"] for item in items}
+
+    def index_filenames(self, user_id: str, entries: dict[str, str]) -> None:
+        for filename, canonical_hash in entries.items():
+            try:
+                self.filename_table.put_item(
+                    Item={
+                        "user_id": user_id,
+                        "filename": filename,
+                        "canonical_hash": canonical_hash
+                    },
+                    ConditionExpression=Attr("filename").not_exists()
+                )
+            except ClientError as e:
+                # An existing entry wins, so a filename's canonical never changes
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
 
 
 class DynamoBookLabelRepository:
     """DynamoDB-based book label repository."""
 
     def __init__(self):
-        dynamodb = get_dynamodb_resource()
-        table_name = os.getenv("DYNAMODB_BOOK_LABELS_TABLE", "reader-progress-book-labels")
-        self.table = dynamodb.Table(table_name)
+        self.dynamodb = get_dynamodb_resource()
+        self.table_name = os.getenv("DYNAMODB_BOOK_LABELS_TABLE", "reader-progress-book-labels")
+        self.table = self.dynamodb.Table(self.table_name)
+        self.deletions_table = _deletions_table(self.dynamodb)
 
     def get_label(self, user_id: str, canonical_hash: str) -> Optional[str]:
         try:
@@ -291,31 +650,49 @@ class DynamoBookLabelRepository:
         except ClientError:
             return None
 
+    def get_labels(self, user_id: str, canonical_hashes: list[str]) -> dict[str, str]:
+        keys = [
+            {"user_id": user_id, "canonical_hash": canonical_hash}
+            for canonical_hash in set(canonical_hashes)
+        ]
+        try:
+            items = _batch_get_items(self.dynamodb, self.table_name, keys)
+        except ClientError:
+            return {}
+        return {item["canonical_hash"]: item["label"] for item in items}
+
     def set_label(self, user_id: str, canonical_hash: str, label: str) -> BookLabelEntity:
+        timestamp = int(time.time())
         self.table.put_item(
             Item={
                 "user_id": user_id,
                 "canonical_hash": canonical_hash,
-                "label": label
+                "label": label,
+                "timestamp": timestamp
             }
         )
         return BookLabelEntity(
             user_id=user_id,
             canonical_hash=canonical_hash,
-            label=label
+            label=label,
+            timestamp=timestamp
         )
 
     def delete_label(self, user_id: str, canonical_hash: str) -> bool:
         try:
-            self.table.delete_item(
+            response = self.table.delete_item(
                 Key={
                     "user_id": user_id,
                     "canonical_hash": canonical_hash
-                }
+                },
+                ReturnValues="ALL_OLD"
             )
-            return True
         except ClientError:
             return False
+        if "Attributes" not in response:
+            return False
+        _record_deletions(self.deletions_table, user_id, "label", [canonical_hash], int(time.time()))
+        return True
 
     def get_all_labels(self, user_id: str) -> list[BookLabelEntity]:
         try:
@@ -323,13 +700,19 @@ class DynamoBookLabelRepository:
                 KeyConditionExpression="user_id = :uid",
                 ExpressionAttributeValues={":uid": user_id}
             )
-            return [
-                BookLabelEntity(
-                    user_id=item["user_id"],
-                    canonical_hash=item["canonical_hash"],
-                    label=item["label"]
-                )
-                for item in response.get("Items", [])
-            ]
+            return [_item_to_label(item) for item in response.get("Items", [])]
+        except ClientError:
+            return []
+
+    def get_labels_since(self, user_id: str, since: int, until: int) -> list[BookLabelEntity]:
+        try:
+            items = _query_changed(self.table, user_id, since, until)
+        except ClientError:
+            return []
+        return [_item_to_label(item) for item in items]
+
+    def get_deleted_labels_since(self, user_id: str, since: int, until: int) -> list[str]:
+        try:
+            return _deleted_between(self.deletions_table, user_id, "label", since, until)
         except ClientError:
             return []
@@ -0,0 +1,558 @@
+"""In-process repository backend (DB_BACKEND=memory).
+
+Everything lives in per-user dicts indexed the way the protocols look things
+up: progress by document and by filename, links by document and by canonical
+hash, filename index entries and labels by key. Nothing is shared between
+processes, so this backend suits a single-node server, the test suite and
+benchmarks that should measure the endpoints rather than the database.
+
+With MEMORY_SNAPSHOT_PATH set, every write is appended to that file as one
+JSON line and the file is replayed on startup. Once the journal holds well
+over twice as many records as are live it is rewritten as a snapshot of the
+current state. Lines are flushed but not fsynced, so a machine crash can lose
+the last writes; a line cut short by a crash is ignored on replay.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, replace
+from typing import Optional
+
+from link_graph import LinkMerge, plan_merge
+from metrics import PROGRESS_WRITES, PROGRESS_WRITES_SKIPPED
+from repositories.protocols import UserEntity, ProgressEntity, DocumentLinkEntity, BookLabelEntity
+
+MEMORY_SNAPSHOT_PATH = os.getenv("MEMORY_SNAPSHOT_PATH") or None
+
+# Journal lines allowed beyond twice the live records before it is compacted
+_COMPACT_SLACK = 1000
+
+
+def _changed_between(timestamp: Optional[int], since: int, until: int) -> bool:
+    # Records written before change tracking have no timestamp; a full sync (since=0) includes them
+    if timestamp is None:
+        return since <= 0
+    if since <= 0:
+        return timestamp <= until
+    return since < timestamp <= until
+
+
+def _modified_at(progress: ProgressEntity) -> Optional[int]:
+    # Records journaled before modified_at was added fall back to their timestamp
+    return progress.modified_at if progress.modified_at is not None else progress.timestamp
+
+
+def _is_unchanged(stored: ProgressEntity, progress: ProgressEntity) -> bool:
+    """Whether writing progress over stored would change nothing but the timestamp."""
+    return (
+        stored.progress == progress.progress
+        and stored.percentage == progress.percentage
+        and stored.device == progress.device
+        and stored.device_id == progress.device_id
+        and (not progress.filename or stored.filename == progress.filename)
+    )
+
+
+class MemoryStore:
+    """All data of the memory backend, guarded by one lock."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.lock = threading.RLock()
+        self.path = path
+        self._journal = None
+        self._journal_lines = 0
+        self._reset()
+        if path:
+            self._replay()
+            self._journal = open(path, "a", encoding="utf-8")
+
+    def _reset(self) -> None:
+        self.users: dict[str, UserEntity] = {}
+        self.next_user_id = 1
+        # user_id -> document -> progress
+        self.progress: dict[str, dict[str, ProgressEntity]] = {}
+        # user_id -> filename -> documents
+        self.progress_by_filename: dict[str, dict[str, set[str]]] = {}
+        # user_id -> document_hash -> link
+        self.links: dict[str, dict[str, DocumentLinkEntity]] = {}
+        # user_id -> canonical_hash -> document hashes
+        self.links_by_canonical: dict[str, dict[str, set[str]]] = {}
+        # user_id -> normalized filename -> canonical_hash
+        self.filename_index: dict[str, dict[str, str]] = {}
+        # user_id -> canonical_hash -> label
+        self.labels: dict[str, dict[str, BookLabelEntity]] = {}
+        # user_id -> ("unlink" or "unlabel", hash) -> when the link or label was deleted
+        self.deletions: dict[str, dict[tuple[str, str], int]] = {}
+
+    # Writes. Each is applied to the indexes, then journaled as one line.
+
+    def write(self, *records: tuple[str, dict]) -> None:
+        """Apply (op, data) records atomically and append them to the journal."""
+        with self.lock:
+            for op, data in records:
+                self._apply(op, data)
+            if self._journal is not None and records:
+                self._journal.write(json.dumps(records, separators=(",", ":")) + "\n")
+                self._journal.flush()
+                self._journal_lines += 1
+                if self._journal_lines > 2 * self._live_records() + _COMPACT_SLACK:
+                    self.compact()
+
+    def _apply(self, op: str, data: dict) -> None:
+        user_id = data.get("user_id")
+        if op == "user":
+            user = UserEntity(**data)
+            self.users[user.username] = user
+            self.next_user_id = max(self.next_user_id, int(user.id) + 1)
+        elif op == "progress":
+            progress = ProgressEntity(**data)
+            documents = self.progress.setdefault(user_id, {})
+            previous = documents.get(progress.document)
+            if previous is not None and previous.filename != progress.filename:
+                self._unindex_filename(user_id, previous)
+            documents[progress.document] = progress
+            if progress.filename:
+                self.progress_by_filename.setdefault(user_id, {}).setdefault(
+                    progress.filename, set()
+                ).add(progress.document)
+        elif op == "link":
+            link = DocumentLinkEntity(**data)
+            self.deletions.get(user_id, {}).pop(("unlink", link.document_hash), None)
+            self._remove_link(user_id, link.document_hash)
+            self.links.setdefault(user_id, {})[link.document_hash] = link
+            self.links_by_canonical.setdefault(user_id, {}).setdefault(
+                link.canonical_hash, set()
+            ).add(link.document_hash)
+        elif op == "unlink":
+            self._remove_link(user_id, data["document_hash"])
+            self._record_deletion(op, data, data["document_hash"])
+        elif op == "filename":
+            self.filename_index.setdefault(user_id, {}).setdefault(data["filename"], data["canonical_hash"])
+        elif op == "label":
+            label = BookLabelEntity(**data)
+            self.deletions.get(user_id, {}).pop(("unlabel", label.canonical_hash), None)
+            self.labels.setdefault(user_id, {})[label.canonical_hash] = label
+        elif op == "unlabel":
+            self.labels.get(user_id, {}).pop(data["canonical_hash"], None)
+            self._record_deletion(op, data, data["canonical_hash"])
+        else:
+            raise ValueError(f"Unknown memory store record: {op}")
+
+    def _record_deletion(self, op: str, data: dict, deleted_hash: str) -> None:
+        # Journals written before deletions were tracked carry no timestamp
+        if data.get("timestamp") is not None:
+            self.deletions.setdefault(data["user_id"], {})[(op, deleted_hash)] = data["timestamp"]
+
+    def _unindex_filename(self, user_id: str, progress: ProgressEntity) -> None:
+        documents = self.progress_by_filename.get(user_id, {}).get(progress.filename)
+        if documents is not None:
+            documents.discard(progress.document)
+            if not documents:
+                del self.progress_by_filename[user_id][progress.filename]
+
+    def _remove_link(self, user_id: str, document_hash: str) -> Optional[DocumentLinkEntity]:
+        link = self.links.get(user_id, {}).pop(document_hash, None)
+        if link is not None:
+            members = self.links_by_canonical[user_id][link.canonical_hash]
+            members.discard(document_hash)
+            if not members:
+                del self.links_by_canonical[user_id][link.canonical_hash]
+        return link
+
+    # Journal
+
+    def _records(self):
+        for user in self.users.values():
+            yield "user", asdict(user)
+        for op, table in (("progress", self.progress), ("link", self.links), ("label", self.labels)):
+            for entries in table.values():
+                for entity in entries.values():
+                    yield op, asdict(entity)
+        for user_id, names in self.filename_index.items():
+            for filename, canonical_hash in names.items():
+                yield "filename", {"user_id": user_id, "filename": filename, "canonical_hash": canonical_hash}
+        # A re-created link or label drops its tombstone, so replaying these deletes nothing live
+        for user_id, deletions in self.deletions.items():
+            for (op, deleted_hash), timestamp in deletions.items():
+                key = "document_hash" if op == "unlink" else "canonical_hash"
+                yield op, {"user_id": user_id, key: deleted_hash, "timestamp": timestamp}
+
+    def _live_records(self) -> int:
+        return (
+            len(self.users)
+            + sum(len(entries) for entries in self.progress.values())
+            + sum(len(entries) for entries in self.links.values())
+            + sum(len(entries) for entries in self.labels.values())
+            + sum(len(entries) for entries in self.filename_index.values())
+            + sum(len(entries) for entries in self.deletions.values())
+        )
+
+    def _replay(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as journal:
+            end = 0
+            for line in journal:
+                try:
+                    records = json.loads(line)
+                except json.JSONDecodeError:
+                    records = None
+                if records is None or not line.endswith(b"\n"):
+                    # A write cut short by a crash; drop it so new lines start clean
+                    journal.truncate(end)
+                    break
+                for op, data in records:
+                    self._apply(op, data)
+                self._journal_lines += 1
+                end += len(line)
+
+    def compact(self) -> None:
+        """Rewrite the journal as one record per live entry."""
+        with self.lock:
+            if not self.path:
+                return
+            temporary = f"{self.path}.tmp"
+            lines = 0
+            with open(temporary, "w", encoding="utf-8") as snapshot:
+                for record in self._records():
+                    snapshot.write(json.dumps([record], separators=(",", ":")) + "\n")
+                    lines += 1
+            if self._journal is not None:
+                self._journal.close()
+            os.replace(temporary, self.path)
+            self._journal = open(self.path, "a", encoding="utf-8")
+            self._journal_lines = lines
+
+    def clear(self) -> None:
+        """Drop all data, including the journal."""
+        with self.lock:
+            self._reset()
+            if self._journal is not None:
+                self._journal.truncate(0)
+                self._journal_lines = 0
+
+    def close(self) -> None:
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+_store: Optional[MemoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store() -> MemoryStore:
+    """The process-wide store, loaded from MEMORY_SNAPSHOT_PATH on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MemoryStore(MEMORY_SNAPSHOT_PATH)
+        return _store
+
+
+def _deleted_between(store: MemoryStore, user_id: str, op: str, since: int, until: int) -> list[str]:
+    # A full sync (since=0) only lists what exists
+    if since <= 0:
+        return []
+    with store.lock:
+        deleted = [
+            (timestamp, deleted_hash)
+            for (kind, deleted_hash), timestamp in store.deletions.get(user_id, {}).items()
+            if kind == op and since < timestamp <= until
+        ]
+    return [deleted_hash for _, deleted_hash in sorted(deleted)]
+
+
+class MemoryUserRepository:
+    """In-memory user repository."""
+
+    def __init__(self, store: Optional[MemoryStore] = None):
+        self.store = store or get_memory_store()
+
+    def get_by_username(self, username: str) -> Optional[UserEntity]:
+        user = self.store.users.get(username)
+        return replace(user) if user else None
+
+    def create(self, username: str, password_hash: str) -> UserEntity:
+        with self.store.lock:
+            if username in self.store.users:
+                raise ValueError(f"Username {username} already exists")
+            user = UserEntity(id=str(self.store.next_user_id), username=username, password_hash=password_hash)
+            self.store.write(("user", asdict(user)))
+        return user
+
+    def exists(self, username: str) -> bool:
+        return username in self.store.users
+
+
+class MemoryProgressRepository:
+    """In-memory progress repository."""
+
+    def __init__(self, store: Optional[MemoryStore] = None):
+        self.store = store or get_memory_store()
+
+    def get_by_user_and_document(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        progress = self.store.progress.get(user_id, {}).get(document)
+        return replace(progress) if progress else None
+
+    def get_by_user_and_alias(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        with self.store.lock:
+            link = self.store.links.get(user_id, {}).get(document)
+            return self.get_by_user_and_document(user_id, link.canonical_hash if link else document)
+
+    def get_by_user_and_documents(
+        self, user_id: str, documents: list[str]
+    ) -> dict[str, ProgressEntity]:
+        with self.store.lock:
+            stored = self.store.progress.get(user_id, {})
+            return {d: replace(stored[d]) for d in documents if d in stored}
+
+    def get_by_user_and_filename(
+        self, user_id: str, filename: str
+    ) -> Optional[ProgressEntity]:
+        records = self.get_all_by_user_and_filename(user_id, filename)
+        return max(records, key=lambda p: p.timestamp or 0) if records else None
+
+    def get_all_by_user_and_filename(
+        self, user_id: str, filename: str
+    ) -> list[ProgressEntity]:
+        return self.get_all_by_user_and_filenames(user_id, [filename])
+
+    def get_all_by_user_and_filenames(
+        self, user_id: str, filenames: list[str]
+    ) -> list[ProgressEntity]:
+        with self.store.lock:
+            stored = self.store.progress.get(user_id, {})
+            by_filename = self.store.progress_by_filename.get(user_id, {})
+            return [
+                replace(stored[document])
+                for filename in set(filenames)
+                for document in by_filename.get(filename, ())
+            ]
+
+    def _write(self, progress: ProgressEntity) -> bool:
+        stored = self.store.progress.get(progress.user_id, {}).get(progress.document)
+        if stored is not None and _is_unchanged(stored, progress):
+            # Periodic re-syncs repeat the stored position; skip the write
+            PROGRESS_WRITES_SKIPPED.inc()
+            return False
+        record = replace(progress, modified_at=int(time.time()))
+        if stored is not None and not progress.filename:
+            record.filename = stored.filename
+        self.store.write(("progress", asdict(record)))
+        return True
+
+    def upsert(self, progress: ProgressEntity) -> ProgressEntity:
+        with self.store.lock:
+            if self._write(progress):
+                PROGRESS_WRITES.inc()
+        return progress
+
+    def upsert_if_newer(self, progress: ProgressEntity, field: str = "timestamp") -> bool:
+        with self.store.lock:
+            stored = self.store.progress.get(progress.user_id, {}).get(progress.document)
+            if stored is not None and (getattr(stored, field) or 0) > getattr(progress, field):
+                return False
+            record = replace(progress, modified_at=int(time.time()))
+            if stored is not None and not progress.filename:
+                record.filename = stored.filename
+            self.store.write(("progress", asdict(record)))
+        PROGRESS_WRITES.inc()
+        return True
+
+    def upsert_many(self, progress_list: list[ProgressEntity]) -> list[ProgressEntity]:
+        written = 0
+        with self.store.lock:
+            for progress in progress_list:
+                written += self._write(progress)
+        if written:
+            PROGRESS_WRITES.inc(written)
+        return progress_list
+
+    def get_all_by_user(self, user_id: str) -> list[ProgressEntity]:
+        with self.store.lock:
+            records = [replace(p) for p in self.store.progress.get(user_id, {}).values()]
+        return sorted(records, key=lambda p: p.timestamp or 0, reverse=True)
+
+    def get_all_by_user_since(self, user_id: str, since: int, until: int) -> list[ProgressEntity]:
+        with self.store.lock:
+            records = [
+                replace(p) for p in self.store.progress.get(user_id, {}).values()
+                if _changed_between(_modified_at(p), since, until)
+            ]
+        return sorted(records, key=lambda p: _modified_at(p) or 0)
+
+
+class MemoryDocumentLinkRepository:
+    """In-memory document link repository."""
+
+    def __init__(self, store: Optional[MemoryStore] = None):
+        self.store = store or get_memory_store()
+
+    def get_canonical(self, user_id: str, document_hash: str) -> Optional[str]:
+        link = self.store.links.get(user_id, {}).get(document_hash)
+        return link.canonical_hash if link else None
+
+    def get_canonicals(self, user_id: str, document_hashes: list[str]) -> dict[str, str]:
+        with self.store.lock:
+            links = self.store.links.get(user_id, {})
+            return {h: links[h].canonical_hash for h in document_hashes if h in links}
+
+    def create_link(self, user_id: str, document_hash: str, canonical_hash: str) -> DocumentLinkEntity:
+        return self.create_links(user_id, {document_hash: canonical_hash})[0]
+
+    def create_links(self, user_id: str, links: dict[str, str]) -> list[DocumentLinkEntity]:
+        timestamp = int(time.time())
+        entities = [
+            DocumentLinkEntity(
+                user_id=user_id,
+                document_hash=document_hash,
+                canonical_hash=canonical_hash,
+                timestamp=timestamp
+            )
+            for document_hash, canonical_hash in links.items()
+        ]
+        self.store.write(*[("link", asdict(link)) for link in entities])
+        return entities
+
+    def merge_links(self, user_id: str, links: dict[str, str]) -> dict[str, str]:
+        if not links:
+            return {}
+        involved = list({h for pair in links.items() for h in pair})
+        # Planned and applied under the lock, so concurrent merges cannot interleave
+        with self.store.lock:
+            merge = plan_merge(self.get_canonicals(user_id, involved), links)
+            self._apply_merge(user_id, merge)
+        return merge.roots
+
+    def compact_links(self, user_id: str) -> int:
+        with self.store.lock:
+            stored = {h: link.canonical_hash for h, link in self.store.links.get(user_id, {}).items()}
+            merge = plan_merge(stored, {})
+            self._apply_merge(user_id, merge)
+        return len(merge.rewrites) + len(merge.deletes)
+
+    def _apply_merge(self, user_id: str, merge: LinkMerge) -> None:
+        timestamp = int(time.time())
+        by_canonical = self.store.links_by_canonical.get(user_id, {})
+        targets = {}
+        for old_root, root in merge.absorbed.items():
+            for document_hash in by_canonical.get(old_root, ()):
+                targets[document_hash] = root
+        targets.update(merge.rewrites)
+        records = [("unlink", {"user_id": user_id, "document_hash": h, "timestamp": timestamp}) for h in merge.deletes]
+        records.extend(
+            ("link", asdict(DocumentLinkEntity(
+                user_id=user_id,
+                document_hash=document_hash,
+                canonical_hash=root,
+                timestamp=timestamp
+            )))
+            for document_hash, root in targets.items()
+            if document_hash not in merge.deletes
+        )
+        self.store.write(*records)
+
+    def get_all_links(self, user_id: str) -> list[DocumentLinkEntity]:
+        with self.store.lock:
+            return [replace(link) for link in self.store.links.get(user_id, {}).values()]
+
+    def delete_link(self, user_id: str, document_hash: str) -> bool:
+        with self.store.lock:
+            if document_hash not in self.store.links.get(user_id, {}):
+                return False
+            self.store.write(
+                ("unlink", {"user_id": user_id, "document_hash": document_hash, "timestamp": int(time.time())})
+            )
+        return True
+
+    def get_linked_hashes(self, user_id: str, canonical_hash: str) -> list[str]:
+        return self.get_linked_hashes_by_canonical(user_id, [canonical_hash]).get(canonical_hash, [])
+
+    def get_linked_hashes_by_canonical(self, user_id: str, canonical_hashes: list[str]) -> dict[str, list[str]]:
+        with self.store.lock:
+            by_canonical = self.store.links_by_canonical.get(user_id, {})
+            return {c: sorted(by_canonical[c]) for c in canonical_hashes if by_canonical.get(c)}
+
+    def get_links_since(self, user_id: str, since: int, until: int) -> list[DocumentLinkEntity]:
+        with self.store.lock:
+            links = [
+                replace(link) for link in self.store.links.get(user_id, {}).values()
+                if _changed_between(link.timestamp, since, until)
+            ]
+        return sorted(links, key=lambda link: link.timestamp or 0)
+
+    def get_deleted_links_since(self, user_id: str, since: int, until: int) -> list[str]:
+        return _deleted_between(self.store, user_id, "unlink", since, until)
+
+    def get_filename_canonicals(self, user_id: str, filenames: list[str]) -> dict[str, str]:
+        with self.store.lock:
+            names = self.store.filename_index.get(user_id, {})
+            return {f: names[f] for f in filenames if f in names}
+
+    def get_all_filename_canonicals(self, user_id: str) -> dict[str, str]:
+        with self.store.lock:
+            return dict(self.store.filename_index.get(user_id, {}))
+
+    def index_filenames(self, user_id: str, entries: dict[str, str]) -> None:
+        with self.store.lock:
+            names = self.store.filename_index.get(user_id, {})
+            self.store.write(*[
+                ("filename", {"user_id": user_id, "filename": filename, "canonical_hash": canonical_hash})
+                for filename, canonical_hash in entries.items()
+                if filename not in names
+            ])
+
+
+class MemoryBookLabelRepository:
+    """In-memory book label repository."""
+
+    def __init__(self, store: Optional[MemoryStore] = None):
+        self.store = store or get_memory_store()
+
+    def get_label(self, user_id: str, canonical_hash: str) -> Optional[str]:
+        label = self.store.labels.get(user_id, {}).get(canonical_hash)
+        return label.label if label else None
+
+    def get_labels(self, user_id: str, canonical_hashes: list[str]) -> dict[str, str]:
+        with self.store.lock:
+            labels = self.store.labels.get(user_id, {})
+            return {h: labels[h].label for h in canonical_hashes if h in labels}
+
+    def set_label(self, user_id: str, canonical_hash: str, label: str) -> BookLabelEntity:
+        entity = BookLabelEntity(
+            user_id=user_id, canonical_hash=canonical_hash, label=label, timestamp=int(time.time())
+        )
+        self.store.write(("label", asdict(entity)))
+        return entity
+
+    def delete_label(self, user_id: str, canonical_hash: str) -> bool:
+        with self.store.lock:
+            if canonical_hash not in self.store.labels.get(user_id, {}):
+                return False
+            self.store.write(
+                ("unlabel", {"user_id": user_id, "canonical_hash": canonical_hash, "timestamp": int(time.time())})
+            )
+        return True
+
+    def get_all_labels(self, user_id: str) -> list[BookLabelEntity]:
+        with self.store.lock:
+            return [replace(label) for label in self.store.labels.get(user_id, {}).values()]
+
+    def get_labels_since(self, user_id: str, since: int, until: int) -> list[BookLabelEntity]:
+        with self.store.lock:
+            labels = [
+                replace(label) for label in self.store.labels.get(user_id, {}).values()
+                if _changed_between(label.timestamp, since, until)
+            ]
+        return sorted(labels, key=lambda label: label.timestamp or 0)
+
+    def get_deleted_labels_since(self, user_id: str, since: int, until: int) -> list[str]:
+        return _deleted_between(self.store, user_id, "unlabel", since, until)
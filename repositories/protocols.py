@@ -21,6 +21,8 @@ class ProgressEntity:
     device_id: str
     timestamp: int
     filename: Optional[str] = None
+    # Server time of the last write, which the change feed follows; timestamp may be the client's
+    modified_at: Optional[int] = None
 
 
 @dataclass
@@ -29,6 +31,7 @@ class DocumentLinkEntity:
     user_id: str
     document_hash: str
     canonical_hash: str
+    timestamp: Optional[int] = None
 
 
 @dataclass
@@ -37,6 +40,7 @@ class BookLabelEntity:
     user_id: str
     canonical_hash: str
     label: str
+    timestamp: Optional[int] = None
 
 
 class UserRepository(Protocol):
@@ -64,6 +68,19 @@ class ProgressRepository(Protocol):
         """Get progress for a specific user and document."""
         ...
 
+    def get_by_user_and_alias(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        """Get progress for a document, or for its canonical hash if it is linked.
+        Resolves the link and reads the progress in a single round-trip."""
+        ...
+
+    def get_by_user_and_documents(
+        self, user_id: str, documents: list[str]
+    ) -> dict[str, ProgressEntity]:
+        """Get progress for several documents, keyed by document. Missing ones are omitted."""
+        ...
+
     def get_by_user_and_filename(
         self, user_id: str, filename: str
     ) -> Optional[ProgressEntity]:
@@ -76,14 +93,34 @@ class ProgressRepository(Protocol):
         """Get all progress records for a specific user and filename."""
         ...
 
+    def get_all_by_user_and_filenames(
+        self, user_id: str, filenames: list[str]
+    ) -> list[ProgressEntity]:
+        """Get all progress records for a user matching any of the filenames."""
+        ...
+
     def upsert(self, progress: ProgressEntity) -> ProgressEntity:
         """Insert or update progress record."""
         ...
 
+    def upsert_many(self, progress_list: list[ProgressEntity]) -> list[ProgressEntity]:
+        """Insert or update several progress records in one write. Later entries win."""
+        ...
+
+    def upsert_if_newer(self, progress: ProgressEntity, field: str = "timestamp") -> bool:
+        """Insert or update unless the stored record has a greater `field`
+        ("timestamp" or "percentage"). The check is part of the write itself.
+        Returns False if the write was rejected as stale."""
+        ...
+
     def get_all_by_user(self, user_id: str) -> list[ProgressEntity]:
         """Get all progress records for a user."""
         ...
 
+    def get_all_by_user_since(self, user_id: str, since: int, until: int) -> list[ProgressEntity]:
+        """Get progress records written with since < modified_at <= until."""
+        ...
+
 
 class DocumentLinkRepository(Protocol):
     """Protocol for document link data access."""
@@ -92,10 +129,31 @@ class DocumentLinkRepository(Protocol):
         """Get canonical hash for a document hash. Returns None if no link exists."""
         ...
 
+    def get_canonicals(self, user_id: str, document_hashes: list[str]) -> dict[str, str]:
+        """Get canonical hashes for several document hashes. Unlinked hashes are omitted."""
+        ...
+
     def create_link(self, user_id: str, document_hash: str, canonical_hash: str) -> DocumentLinkEntity:
         """Create a link from document_hash to canonical_hash."""
         ...
 
+    def create_links(self, user_id: str, links: dict[str, str]) -> list[DocumentLinkEntity]:
+        """Create several links (document_hash -> canonical_hash) in one write."""
+        ...
+
+    def merge_links(self, user_id: str, links: dict[str, str]) -> dict[str, str]:
+        """Merge each document_hash's group into canonical_hash's group.
+
+        Every member of a merged group is repointed at the surviving root, so
+        links stay one hop deep. Returns document_hash -> root.
+        """
+        ...
+
+    def compact_links(self, user_id: str) -> int:
+        """Repoint links that lead to another alias straight at their root.
+        Returns the number of links changed."""
+        ...
+
     def get_all_links(self, user_id: str) -> list[DocumentLinkEntity]:
         """Get all document links for a user."""
         ...
@@ -108,6 +166,31 @@ class DocumentLinkRepository(Protocol):
         """Get all hashes linked to a canonical hash."""
         ...
 
+    def get_linked_hashes_by_canonical(self, user_id: str, canonical_hashes: list[str]) -> dict[str, list[str]]:
+        """Get the hashes linked to each of several canonical hashes. Canonicals without links are omitted."""
+        ...
+
+    def get_links_since(self, user_id: str, since: int, until: int) -> list[DocumentLinkEntity]:
+        """Get links created with since < timestamp <= until."""
+        ...
+
+    def get_deleted_links_since(self, user_id: str, since: int, until: int) -> list[str]:
+        """Get document hashes whose link was deleted with since < timestamp <= until.
+        Empty for a full sync (since <= 0)."""
+        ...
+
+    def get_filename_canonicals(self, user_id: str, filenames: list[str]) -> dict[str, str]:
+        """Get the indexed canonical hash of several filenames. Unindexed filenames are omitted."""
+        ...
+
+    def get_all_filename_canonicals(self, user_id: str) -> dict[str, str]:
+        """Get every indexed filename of a user with its canonical hash."""
+        ...
+
+    def index_filenames(self, user_id: str, entries: dict[str, str]) -> None:
+        """Index filename -> canonical_hash for filenames not indexed yet. Existing entries are kept."""
+        ...
+
 
 class BookLabelRepository(Protocol):
     """Protocol for book label data access."""
@@ -116,6 +199,10 @@ class BookLabelRepository(Protocol):
         """Get label for a canonical hash. Returns None if no label exists."""
         ...
 
+    def get_labels(self, user_id: str, canonical_hashes: list[str]) -> dict[str, str]:
+        """Get labels for several canonical hashes. Unlabeled hashes are omitted."""
+        ...
+
     def set_label(self, user_id: str, canonical_hash: str, label: str) -> BookLabelEntity:
         """Set or update label for a canonical hash."""
         ...
@@ -127,3 +214,12 @@ class BookLabelRepository(Protocol):
     def get_all_labels(self, user_id: str) -> list[BookLabelEntity]:
         """Get all labels for a user."""
         ...
+
+    def get_labels_since(self, user_id: str, since: int, until: int) -> list[BookLabelEntity]:
+        """Get labels set with since < timestamp <= until."""
+        ...
+
+    def get_deleted_labels_since(self, user_id: str, since: int, until: int) -> list[str]:
+        """Get canonical hashes whose label was deleted with since < timestamp <= until.
+        Empty for a full sync (since <= 0)."""
+        ...
@@ -1,12 +1,91 @@
-from typing import Optional
-from sqlalchemy.orm import Session
-from models import User, Progress, DocumentLink, BookLabel
+import time
+from typing import Optional, Iterator
+from sqlalchemy import and_, or_, update, insert, select, literal, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+from link_graph import LinkMerge, plan_merge
+from metrics import PROGRESS_WRITES, PROGRESS_WRITES_SKIPPED
+from models import User, Progress, DocumentLink, BookLabel, FilenameIndex, Deletion
 from repositories.protocols import UserEntity, ProgressEntity, DocumentLinkEntity, BookLabelEntity
 
 
+# Keep IN (...) lists well below SQLite's bound parameter limit
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = IN_CLAUSE_CHUNK_SIZE) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _changed_between(column, since: int, until: int):
+    # Rows written before change tracking have no timestamp; a full sync (since=0) includes them
+    if since <= 0:
+        return or_(column <= until, column.is_(None))
+    return and_(column > since, column <= until)
+
+
+def _record_deletions(db: Session, user_id: str, kind: str, hashes: list[str], timestamp: int) -> None:
+    """Replace the tombstones of hashes with ones at timestamp. The caller commits."""
+    if not hashes:
+        return
+    for chunk in _chunks(hashes):
+        (
+            db.query(Deletion)
+            .filter(Deletion.user_id == int(user_id), Deletion.kind == kind, Deletion.hash.in_(chunk))
+            .delete(synchronize_session=False)
+        )
+    db.execute(insert(Deletion), [
+        {"user_id": int(user_id), "kind": kind, "hash": h, "timestamp": timestamp} for h in hashes
+    ])
+
+
+def _deleted_between(db: Session, user_id: str, kind: str, since: int, until: int) -> list[str]:
+    # A full sync (since=0) only lists what exists
+    if since <= 0:
+        return []
+    rows = (
+        db.query(Deletion.hash)
+        .filter(
+            Deletion.user_id == int(user_id),
+            Deletion.kind == kind,
+            _changed_between(Deletion.timestamp, since, until)
+        )
+        .order_by(Deletion.timestamp)
+    )
+    return [row.hash for row in rows]
+
+
+def _is_unchanged(row: Progress, progress: ProgressEntity) -> bool:
+    """Whether writing progress over row would change nothing but the timestamp."""
+    return (
+        row.progress == progress.progress
+        and row.percentage == progress.percentage
+        and row.device == progress.device
+        and row.device_id == progress.device_id
+        and (not progress.filename or row.filename == progress.filename)
+    )
+
+
+def _to_progress_entity(progress: Progress) -> ProgressEntity:
+    return ProgressEntity(
+        user_id=str(progress.user_id),
+        document=progress.document,
+        progress=progress.progress,
+        percentage=progress.percentage,
+        device=progress.device,
+        device_id=progress.device_id,
+        timestamp=progress.timestamp,
+        filename=progress.filename,
+        modified_at=progress.modified_at
+    )
+
+
 class SQLUserRepository:
     """SQLAlchemy-based user repository."""
 
+    table_name = User.__tablename__
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -38,6 +117,8 @@ class SQLUserRepository:
 class SQLProgressRepository:
     """SQLAlchemy-based progress repository."""
 
+    table_name = Progress.__tablename__
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -52,16 +133,50 @@ class SQLProgressRepository:
         )
         if not progress:
             return None
-        return ProgressEntity(
-            user_id=str(progress.user_id),
-            document=progress.document,
-            progress=progress.progress,
-            percentage=progress.percentage,
-            device=progress.device,
-            device_id=progress.device_id,
-            timestamp=progress.timestamp,
-            filename=progress.filename
+        return _to_progress_entity(progress)
+
+    def get_by_user_and_alias(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        # The link is resolved by a subquery, so the lookup is one statement
+        canonical_hash = (
+            select(DocumentLink.canonical_hash)
+            .where(
+                DocumentLink.user_id == int(user_id),
+                DocumentLink.document_hash == document
+            )
+            .limit(1)
+            .scalar_subquery()
         )
+        progress = (
+            self.db.query(Progress)
+            .filter(
+                Progress.user_id == int(user_id),
+                Progress.document == func.coalesce(canonical_hash, document)
+            )
+            .order_by(Progress.timestamp.desc())
+            .first()
+        )
+        if not progress:
+            return None
+        return _to_progress_entity(progress)
+
+    def get_by_user_and_documents(
+        self, user_id: str, documents: list[str]
+    ) -> dict[str, ProgressEntity]:
+        found = {}
+        for chunk in _chunks(list(set(documents))):
+            records = (
+                self.db.query(Progress)
+                .filter(Progress.user_id == int(user_id), Progress.document.in_(chunk))
+                .order_by(Progress.timestamp.desc())
+                .all()
+            )
+            for p in records:
+                # Ordered newest first, matching get_by_user_and_document
+                if p.document not in found:
+                    found[p.document] = _to_progress_entity(p)
+        return found
 
     def get_by_user_and_filename(
         self, user_id: str, filename: str
@@ -74,16 +189,7 @@ class SQLProgressRepository:
         )
         if not progress:
             return None
-        return ProgressEntity(
-            user_id=str(progress.user_id),
-            document=progress.document,
-            progress=progress.progress,
-            percentage=progress.percentage,
-            device=progress.device,
-            device_id=progress.device_id,
-            timestamp=progress.timestamp,
-            filename=progress.filename
-        )
+        return _to_progress_entity(progress)
 
     def get_all_by_user_and_filename(
         self, user_id: str, filename: str
@@ -93,19 +199,19 @@ class SQLProgressRepository:
             .filter(Progress.user_id == int(user_id), Progress.filename == filename)
             .all()
         )
-        return [
-            ProgressEntity(
-                user_id=str(p.user_id),
-                document=p.document,
-                progress=p.progress,
-                percentage=p.percentage,
-                device=p.device,
-                device_id=p.device_id,
-                timestamp=p.timestamp,
-                filename=p.filename
+        return [_to_progress_entity(p) for p in records]
+
+    def get_all_by_user_and_filenames(
+        self, user_id: str, filenames: list[str]
+    ) -> list[ProgressEntity]:
+        records = []
+        for chunk in _chunks(list(set(filenames))):
+            records.extend(
+                self.db.query(Progress)
+                .filter(Progress.user_id == int(user_id), Progress.filename.in_(chunk))
+                .all()
             )
-            for p in records
-        ]
+        return [_to_progress_entity(p) for p in records]
 
     def upsert(self, progress: ProgressEntity) -> ProgressEntity:
         existing = (
@@ -117,12 +223,18 @@ class SQLProgressRepository:
             .first()
         )
 
+        if existing and _is_unchanged(existing, progress):
+            # Periodic re-syncs repeat the stored position; skip the write and commit
+            PROGRESS_WRITES_SKIPPED.inc()
+            return progress
+
         if existing:
             existing.progress = progress.progress
             existing.percentage = progress.percentage
             existing.device = progress.device
             existing.device_id = progress.device_id
             existing.timestamp = progress.timestamp
+            existing.modified_at = int(time.time())
             if progress.filename:
                 existing.filename = progress.filename
         else:
@@ -134,13 +246,126 @@ class SQLProgressRepository:
                 device=progress.device,
                 device_id=progress.device_id,
                 timestamp=progress.timestamp,
-                filename=progress.filename
+                filename=progress.filename,
+                modified_at=int(time.time())
             )
             self.db.add(db_progress)
 
         self.db.commit()
+        PROGRESS_WRITES.inc()
         return progress
 
+    def upsert_if_newer(self, progress: ProgressEntity, field: str = "timestamp") -> bool:
+        values = {
+            "progress": progress.progress,
+            "percentage": progress.percentage,
+            "device": progress.device,
+            "device_id": progress.device_id,
+            "timestamp": progress.timestamp,
+            "modified_at": int(time.time()),
+        }
+        if progress.filename:
+            values["filename"] = progress.filename
+        same_document = and_(
+            Progress.user_id == int(progress.user_id),
+            Progress.document == progress.document
+        )
+
+        # Common case: the row exists and is not newer, one UPDATE settles it
+        updated = self.db.execute(
+            update(Progress)
+            .where(same_document, getattr(Progress, field) <= values[field])
+            .values(**values)
+        ).rowcount
+        if not updated:
+            # Either there is no row yet or the stored one is newer; only the former inserts
+            values.update(user_id=int(progress.user_id), document=progress.document)
+            updated = self.db.execute(
+                insert(Progress).from_select(
+                    list(values),
+                    select(*[literal(v) for v in values.values()])
+                    .where(~select(Progress.id).where(same_document).exists())
+                )
+            ).rowcount
+        self.db.commit()
+        if updated:
+            PROGRESS_WRITES.inc()
+        return updated > 0
+
+    def upsert_many(self, progress_list: list[ProgressEntity]) -> list[ProgressEntity]:
+        if not progress_list:
+            return []
+
+        documents_by_user: dict[int, set[str]] = {}
+        for progress in progress_list:
+            documents_by_user.setdefault(int(progress.user_id), set()).add(progress.document)
+
+        existing: dict[tuple[int, str], Progress] = {}
+        for user_id, documents in documents_by_user.items():
+            for chunk in _chunks(list(documents)):
+                rows = (
+                    self.db.query(Progress)
+                    .filter(Progress.user_id == user_id, Progress.document.in_(chunk))
+                    .all()
+                )
+                for row in rows:
+                    existing.setdefault((row.user_id, row.document), row)
+
+        written = 0
+        modified_at = int(time.time())
+        new_rows: dict[tuple[int, str], Progress] = {}
+        for progress in progress_list:
+            key = (int(progress.user_id), progress.document)
+            row = existing.get(key)
+            if row and _is_unchanged(row, progress):
+                PROGRESS_WRITES_SKIPPED.inc()
+                continue
+            written += 1
+            if row:
+                row.progress = progress.progress
+                row.percentage = progress.percentage
+                row.device = progress.device
+                row.device_id = progress.device_id
+                row.timestamp = progress.timestamp
+                row.modified_at = modified_at
+                if progress.filename:
+                    row.filename = progress.filename
+            else:
+                row = Progress(
+                    user_id=key[0],
+                    document=progress.document,
+                    progress=progress.progress,
+                    percentage=progress.percentage,
+                    device=progress.device,
+                    device_id=progress.device_id,
+                    timestamp=progress.timestamp,
+                    filename=progress.filename,
+                    modified_at=modified_at
+                )
+                new_rows[key] = row
+                existing[key] = row
+
+        if new_rows:
+            # One executemany; adding ORM objects would insert them row by row
+            self.db.execute(insert(Progress), [
+                {
+                    "user_id": row.user_id,
+                    "document": row.document,
+                    "progress": row.progress,
+                    "percentage": row.percentage,
+                    "device": row.device,
+                    "device_id": row.device_id,
+                    "timestamp": row.timestamp,
+                    "filename": row.filename,
+                    "modified_at": row.modified_at,
+                }
+                for row in new_rows.values()
+            ])
+        if written:
+            self.db.commit()
+            PROGRESS_WRITES.inc(written)
+        return progress_list
+
     def get_all_by_user(self, user_id: str) -> list[ProgressEntity]:
         records = (
             self.db.query(Progress)
@@ -148,24 +373,25 @@ class SQLProgressRepository:
             .order_by(Progress.timestamp.desc())
             .all()
         )
-        return [
-            ProgressEntity(
-                user_id=str(p.user_id),
-                document=p.document,
-                progress=p.progress,
-                percentage=p.percentage,
-                device=p.device,
-                device_id=p.device_id,
-                timestamp=p.timestamp,
-                filename=p.filename
-            )
-            for p in records
-        ]
+        return [_to_progress_entity(p) for p in records]
+
+    def get_all_by_user_since(self, user_id: str, since: int, until: int) -> list[ProgressEntity]:
+        # Rows written before modified_at was added fall back to their timestamp
+        modified_at = func.coalesce(Progress.modified_at, Progress.timestamp)
+        records = (
+            self.db.query(Progress)
+            .filter(Progress.user_id == int(user_id), _changed_between(modified_at, since, until))
+            .order_by(modified_at)
+            .all()
+        )
+        return [_to_progress_entity(p) for p in records]
 
 
 class SQLDocumentLinkRepository:
     """SQLAlchemy-based document link repository."""
 
+    table_name = DocumentLink.__tablename__
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -180,20 +406,121 @@ class SQLDocumentLinkRepository:
         )
         return link.canonical_hash if link else None
 
+    def get_canonicals(self, user_id: str, document_hashes: list[str]) -> dict[str, str]:
+        canonicals = {}
+        for chunk in _chunks(list(set(document_hashes))):
+            links = (
+                self.db.query(DocumentLink)
+                .filter(
+                    DocumentLink.user_id == int(user_id),
+                    DocumentLink.document_hash.in_(chunk)
+                )
+                .all()
+            )
+            for link in links:
+                canonicals.setdefault(link.document_hash, link.canonical_hash)
+        return canonicals
+
     def create_link(self, user_id: str, document_hash: str, canonical_hash: str) -> DocumentLinkEntity:
+        timestamp = int(time.time())
         db_link = DocumentLink(
             user_id=int(user_id),
             document_hash=document_hash,
-            canonical_hash=canonical_hash
+            canonical_hash=canonical_hash,
+            timestamp=timestamp
         )
         self.db.add(db_link)
         self.db.commit()
         return DocumentLinkEntity(
             user_id=user_id,
             document_hash=document_hash,
-            canonical_hash=canonical_hash
+            canonical_hash=canonical_hash,
+            timestamp=timestamp
         )
 
+    def create_links(self, user_id: str, links: dict[str, str]) -> list[DocumentLinkEntity]:
+        timestamp = int(time.time())
+        if links:
+            self.db.execute(insert(DocumentLink), [
+                {
+                    "user_id": int(user_id),
+                    "document_hash": document_hash,
+                    "canonical_hash": canonical_hash,
+                    "timestamp": timestamp,
+                }
+                for document_hash, canonical_hash in links.items()
+            ])
+        self.db.commit()
+        return [
+            DocumentLinkEntity(
+                user_id=user_id,
+                document_hash=document_hash,
+                canonical_hash=canonical_hash,
+                timestamp=timestamp
+            )
+            for document_hash, canonical_hash in links.items()
+        ]
+
+    def merge_links(self, user_id: str, links: dict[str, str]) -> dict[str, str]:
+        if not links:
+            return {}
+        involved = list({h for pair in links.items() for h in pair})
+        merge = plan_merge(self.get_canonicals(user_id, involved), links)
+        self._apply_merge(user_id, merge)
+        return merge.roots
+
+    def compact_links(self, user_id: str) -> int:
+        stored = {link.document_hash: link.canonical_hash for link in self.get_all_links(user_id)}
+        merge = plan_merge(stored, {})
+        self._apply_merge(user_id, merge)
+        return len(merge.rewrites) + len(merge.deletes)
+
+    def _apply_merge(self, user_id: str, merge: LinkMerge) -> None:
+        if not (merge.absorbed or merge.rewrites or merge.deletes):
+            return
+        timestamp = int(time.time())
+        # Most absorbed roots are fresh hashes nothing points at yet; find the
+        # ones with members so only those cost an UPDATE
+        with_members = set()
+        for chunk in _chunks(list(merge.absorbed)):
+            with_members.update(
+                row.canonical_hash
+                for row in self.db.query(DocumentLink.canonical_hash)
+                .filter(DocumentLink.user_id == int(user_id), DocumentLink.canonical_hash.in_(chunk))
+                .distinct()
+            )
+        # Repoint whole groups in place, one statement per surviving root
+        for root, old_roots in merge.repoints().items():
+            for chunk in _chunks([r for r in old_roots if r in with_members]):
+                (
+                    self.db.query(DocumentLink)
+                    .filter(
+                        DocumentLink.user_id == int(user_id),
+                        DocumentLink.canonical_hash.in_(chunk)
+                    )
+                    .update(
+                        {DocumentLink.canonical_hash: root, DocumentLink.timestamp: timestamp},
+                        synchronize_session=False
+                    )
+                )
+        replaced = [*merge.rewrites, *merge.deletes]
+        for chunk in _chunks(replaced):
+            (
+                self.db.query(DocumentLink)
+                .filter(
+                    DocumentLink.user_id == int(user_id),
+                    DocumentLink.document_hash.in_(chunk)
+                )
+                .delete(synchronize_session=False)
+            )
+        if merge.rewrites:
+            self.db.execute(insert(DocumentLink), [
+                {"user_id": int(user_id), "document_hash": document_hash, "canonical_hash": root, "timestamp": timestamp}
+                for document_hash, root in merge.rewrites.items()
+            ])
+        _record_deletions(self.db, user_id, "link", merge.deletes, timestamp)
+        self.db.commit()
+
     def get_all_links(self, user_id: str) -> list[DocumentLinkEntity]:
         links = (
             self.db.query(DocumentLink)
@@ -204,7 +531,8 @@ class SQLDocumentLinkRepository:
             DocumentLinkEntity(
                 user_id=str(link.user_id),
                 document_hash=link.document_hash,
-                canonical_hash=link.canonical_hash
+                canonical_hash=link.canonical_hash,
+                timestamp=link.timestamp
             )
             for link in links
         ]
@@ -218,6 +546,8 @@ class SQLDocumentLinkRepository:
             )
             .delete()
         )
+        if result:
+            _record_deletions(self.db, user_id, "link", [document_hash], int(time.time()))
         self.db.commit()
         return result > 0
 
@@ -232,10 +562,115 @@ class SQLDocumentLinkRepository:
         )
         return [link.document_hash for link in links]
 
+    def get_linked_hashes_by_canonical(self, user_id: str, canonical_hashes: list[str]) -> dict[str, list[str]]:
+        linked: dict[str, list[str]] = {}
+        for chunk in _chunks(list(set(canonical_hashes))):
+            links = (
+                self.db.query(DocumentLink)
+                .filter(
+                    DocumentLink.user_id == int(user_id),
+                    DocumentLink.canonical_hash.in_(chunk)
+                )
+                .all()
+            )
+            for link in links:
+                linked.setdefault(link.canonical_hash, []).append(link.document_hash)
+        return linked
+
+    def get_links_since(self, user_id: str, since: int, until: int) -> list[DocumentLinkEntity]:
+        links = (
+            self.db.query(DocumentLink)
+            .filter(
+                DocumentLink.user_id == int(user_id),
+                _changed_between(DocumentLink.timestamp, since, until)
+            )
+            .order_by(DocumentLink.timestamp)
+            .all()
+        )
+        return [
+            DocumentLinkEntity(
+                user_id=str(link.user_id),
+                document_hash=link.document_hash,
+                canonical_hash=link.canonical_hash,
+                timestamp=link.timestamp
+            )
+            for link in links
+        ]
+
+    def get_deleted_links_since(self, user_id: str, since: int, until: int) -> list[str]:
+        return _deleted_between(self.db, user_id, "link", since, until)
+
+    def get_filename_canonicals(self, user_id: str, filenames: list[str]) -> dict[str, str]:
+        canonicals = {}
+        for chunk in _chunks(list(set(filenames))):
+            entries = (
+                self.db.query(FilenameIndex)
+                .filter(
+                    FilenameIndex.user_id == int(user_id),
+                    FilenameIndex.filename.in_(chunk)
+                )
+                .all()
+            )
+            canonicals.update({entry.filename: entry.canonical_hash for entry in entries})
+        return canonicals
+
+    def get_all_filename_canonicals(self, user_id: str) -> dict[str, str]:
+        entries = (
+            self.db.query(FilenameIndex)
+            .filter(FilenameIndex.user_id == int(user_id))
+            .all()
+        )
+        return {entry.filename: entry.canonical_hash for entry in entries}
+
+    def index_filenames(self, user_id: str, entries: dict[str, str]) -> None:
+        indexed = self.get_filename_canonicals(user_id, list(entries))
+        missing = {
+            filename: canonical_hash
+            for filename, canonical_hash in entries.items()
+            if filename not in indexed
+        }
+        if not missing:
+            return
+        try:
+            self.db.execute(insert(FilenameIndex), [
+                {"user_id": int(user_id), "filename": filename, "canonical_hash": canonical_hash}
+                for filename, canonical_hash in missing.items()
+            ])
+            self.db.commit()
+        except IntegrityError:
+            # Another request indexed the same filename first; its entry wins
+            self.db.rollback()
+
+
+def compact_link_chains(db: Session) -> int:
+    """Flatten link chains left by older versions, for every user that has one.
+
+    Returns the number of links changed.
+    """
+    target = aliased(DocumentLink)
+    user_ids = [
+        row.user_id
+        for row in (
+            db.query(DocumentLink.user_id)
+            .join(
+                target,
+                and_(
+                    target.user_id == DocumentLink.user_id,
+                    target.document_hash == DocumentLink.canonical_hash
+                )
+            )
+            .distinct()
+        )
+    ]
+    repository = SQLDocumentLinkRepository(db)
+    return sum(repository.compact_links(str(user_id)) for user_id in user_ids)
+
 
 class SQLBookLabelRepository:
     """SQLAlchemy-based book label repository."""
 
+    table_name = BookLabel.__tablename__
+
     def __init__(self, db: Session):
         self.db = db
 
@@ -250,6 +685,20 @@ class SQLBookLabelRepository:
         )
         return label.label if label else None
 
+    def get_labels(self, user_id: str, canonical_hashes: list[str]) -> dict[str, str]:
+        labels = {}
+        for chunk in _chunks(list(set(canonical_hashes))):
+            rows = (
+                self.db.query(BookLabel)
+                .filter(
+                    BookLabel.user_id == int(user_id),
+                    BookLabel.canonical_hash.in_(chunk)
+                )
+                .all()
+            )
+            labels.update({row.canonical_hash: row.label for row in rows})
+        return labels
+
     def set_label(self, user_id: str, canonical_hash: str, label: str) -> BookLabelEntity:
         existing = (
             self.db.query(BookLabel)
@@ -260,18 +709,21 @@ class SQLBookLabelRepository:
             .first()
         )
 
+        timestamp = int(time.time())
         if existing:
             existing.label = label
+            existing.timestamp = timestamp
         else:
             db_label = BookLabel(
                 user_id=int(user_id),
                 canonical_hash=canonical_hash,
-                label=label
+                label=label,
+                timestamp=timestamp
             )
             self.db.add(db_label)
 
         self.db.commit()
-        return BookLabelEntity(user_id=user_id, canonical_hash=canonical_hash, label=label)
+        return BookLabelEntity(user_id=user_id, canonical_hash=canonical_hash, label=label, timestamp=timestamp)
 
     def delete_label(self, user_id: str, canonical_hash: str) -> bool:
         result = (
@@ -282,6 +734,8 @@ class SQLBookLabelRepository:
             )
             .delete()
         )
+        if result:
+            _record_deletions(self.db, user_id, "label", [canonical_hash], int(time.time()))
         self.db.commit()
         return result > 0
 
@@ -295,7 +749,31 @@ class SQLBookLabelRepository:
             BookLabelEntity(
                 user_id=str(label.user_id),
                 canonical_hash=label.canonical_hash,
-                label=label.label
+                label=label.label,
+                timestamp=label.timestamp
             )
             for label in labels
         ]
+
+    def get_labels_since(self, user_id: str, since: int, until: int) -> list[BookLabelEntity]:
+        labels = (
+            self.db.query(BookLabel)
+            .filter(
+                BookLabel.user_id == int(user_id),
+                _changed_between(BookLabel.timestamp, since, until)
+            )
+            .order_by(BookLabel.timestamp)
+            .all()
+        )
+        return [
+            BookLabelEntity(
+                user_id=str(label.user_id),
+                canonical_hash=label.canonical_hash,
+                label=label.label,
+                timestamp=label.timestamp
+            )
+            for label in labels
+        ]
+
+    def get_deleted_labels_since(self, user_id: str, since: int, until: int) -> list[str]:
+        return _deleted_between(self.db, user_id, "label", since, until)
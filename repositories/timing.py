@@ -0,0 +1,46 @@
+import time
+
+from metrics import REPOSITORY_CALL_DURATION
+from request_stats import record_repository_call
+from tracing import current_span, span
+
+
+class TimedRepository:
+    """Proxy that records the duration of every public method call of a repository.
+
+    Durations go to repository_call_duration_seconds, labeled with the backend,
+    the repository kind and the method, and to the current request's stats.
+    Attributes are resolved on the wrapped repository at first use and the
+    timed wrapper is kept, so later calls cost one clock read on each side of
+    the call. In a traced request, each call is also a span carrying the
+    backend, the table and the method.
+    """
+
+    def __init__(self, repository, backend: str, kind: str):
+        self._repository = repository
+        self._backend = backend
+        self._kind = kind
+        self._table = getattr(repository, "table_name", kind)
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._repository, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+        histogram = REPOSITORY_CALL_DURATION.labels(self._backend, self._kind, name)
+        call_name = f"{self._kind}.{name}"
+        span_attributes = {"db.system": self._backend, "db.collection.name": self._table, "db.operation.name": name}
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                if current_span() is None:
+                    return attribute(*args, **kwargs)
+                with span(call_name, **span_attributes):
+                    return attribute(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                histogram.observe(elapsed)
+                record_repository_call(call_name, elapsed)
+
+        self.__dict__[name] = timed
+        return timed
@@ -0,0 +1,248 @@
+import dataclasses
+import logging
+import threading
+import time
+from contextlib import AbstractContextManager
+from typing import Callable, Optional
+
+from metrics import PROGRESS_WRITES_COALESCED
+from repositories.protocols import DocumentLinkRepository, ProgressEntity, ProgressRepository
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressWriteBuffer:
+    """Holds the latest progress per (user, document) until it is flushed.
+
+    Rapid pushes for the same book replace each other in memory, so N page
+    turns between flushes cost one write. A background thread flushes every
+    `flush_interval` seconds, or sooner once `max_pending` keys are waiting.
+    Entries stay readable until their write has been committed.
+
+    Entries put with a `conflict_field` are flushed through the repository's
+    conditional upsert_if_newer, so a newer row stored meanwhile (by another
+    worker or instance) is kept and the buffered entry is dropped.
+    """
+
+    def __init__(
+        self,
+        repository_factory: Callable[[], AbstractContextManager[ProgressRepository]],
+        flush_interval: float = 5.0,
+        max_pending: int = 500,
+    ):
+        self.repository_factory = repository_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: dict[tuple[str, str], ProgressEntity] = {}
+        self._flushing: dict[tuple[str, str], ProgressEntity] = {}
+        # Keys of pending entries that may only replace an older stored row, and the field compared
+        self._conditions: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def put(self, progress: ProgressEntity, conflict_field: Optional[str] = None) -> None:
+        key = (progress.user_id, progress.document)
+        # Stamped again by the repository when it is flushed
+        progress = dataclasses.replace(progress, modified_at=int(time.time()))
+        with self._lock:
+            previous = self._pending.get(key) or self._flushing.get(key)
+            if key in self._pending:
+                PROGRESS_WRITES_COALESCED.inc()
+            if previous and not progress.filename and previous.filename:
+                # Match upsert, which keeps the stored filename when none is sent
+                progress = dataclasses.replace(progress, filename=previous.filename)
+            self._pending[key] = progress
+            if conflict_field is not None:
+                self._conditions[key] = conflict_field
+            else:
+                self._conditions.pop(key, None)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def get(self, user_id: str, document: str) -> Optional[ProgressEntity]:
+        key = (user_id, document)
+        with self._lock:
+            return self._pending.get(key) or self._flushing.get(key)
+
+    def pending_for_user(self, user_id: str) -> list[ProgressEntity]:
+        with self._lock:
+            merged = {**self._flushing, **self._pending}
+        return [p for (uid, _), p in merged.items() if uid == user_id]
+
+    def flush(self) -> int:
+        """Write all pending progress in one batch. Returns the number of records written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                conditions, self._conditions = self._conditions, {}
+                batch = list(self._flushing.values())
+            unconditional = [p for key, p in self._flushing.items() if key not in conditions]
+            conditional = [(p, conditions[key]) for key, p in self._flushing.items() if key in conditions]
+            try:
+                with self.repository_factory() as repository:
+                    if unconditional:
+                        repository.upsert_many(unconditional)
+                    stale = sum(not repository.upsert_if_newer(p, field) for p, field in conditional)
+            except Exception:
+                logger.exception("Failed to flush %d progress records; will retry", len(batch))
+                with self._lock:
+                    # Newer updates that arrived during the flush take precedence
+                    self._conditions = {
+                        **{key: field for key, field in conditions.items() if key not in self._pending},
+                        **self._conditions,
+                    }
+                    self._pending = {**self._flushing, **self._pending}
+                    self._flushing = {}
+                return 0
+            with self._lock:
+                self._flushing = {}
+            if stale:
+                logger.info("Dropped %d buffered progress records older than the stored ones", stale)
+            return len(batch) - stale
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="progress-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and flush whatever is still pending."""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def _merge(stored: list[ProgressEntity], pending: list[ProgressEntity]) -> list[ProgressEntity]:
+    """Overlay pending records on stored ones, keyed by document."""
+    merged = {p.document: p for p in stored}
+    for p in pending:
+        existing = merged.get(p.document)
+        if existing and not p.filename and existing.filename:
+            p = dataclasses.replace(p, filename=existing.filename)
+        merged[p.document] = p
+    return list(merged.values())
+
+
+class WriteBehindProgressRepository:
+    """Progress repository that defers writes to a ProgressWriteBuffer.
+
+    Reads consult the buffer first, so a device sees its own pushes (and
+    other devices see them) before they reach the database. Pulls through an
+    alias of a book whose progress is only buffered resolve the alias with
+    `link_repository_factory`.
+    """
+
+    def __init__(
+        self,
+        repository: ProgressRepository,
+        buffer: ProgressWriteBuffer,
+        link_repository_factory: Optional[Callable[[], AbstractContextManager[DocumentLinkRepository]]] = None,
+    ):
+        self.repository = repository
+        self.buffer = buffer
+        self.link_repository_factory = link_repository_factory
+
+    def get_by_user_and_document(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        pending = self.buffer.get(user_id, document)
+        if pending and pending.filename:
+            return pending
+        stored = self.repository.get_by_user_and_document(user_id, document)
+        if pending is None:
+            return stored
+        return _merge([stored] if stored else [], [pending])[0]
+
+    def get_by_user_and_alias(
+        self, user_id: str, document: str
+    ) -> Optional[ProgressEntity]:
+        stored = self.repository.get_by_user_and_alias(user_id, document)
+        if stored is not None:
+            pending = self.buffer.get(user_id, stored.document)
+        else:
+            pending = self.buffer.get(user_id, document) or self._pending_for_alias(user_id, document)
+        if pending is None:
+            return stored
+        return _merge([stored] if stored else [], [pending])[0]
+
+    def _pending_for_alias(self, user_id: str, document: str) -> Optional[ProgressEntity]:
+        # Only worth a link lookup when the user has progress waiting to be flushed
+        if self.link_repository_factory is None or not self.buffer.pending_for_user(user_id):
+            return None
+        with self.link_repository_factory() as link_repository:
+            canonical_hash = link_repository.get_canonicals(user_id, [document]).get(document)
+        return self.buffer.get(user_id, canonical_hash) if canonical_hash else None
+
+    def get_by_user_and_documents(
+        self, user_id: str, documents: list[str]
+    ) -> dict[str, ProgressEntity]:
+        found = self.repository.get_by_user_and_documents(user_id, documents)
+        wanted = set(documents)
+        pending = [p for p in self.buffer.pending_for_user(user_id) if p.document in wanted]
+        return {p.document: p for p in _merge(list(found.values()), pending)}
+
+    def get_by_user_and_filename(
+        self, user_id: str, filename: str
+    ) -> Optional[ProgressEntity]:
+        matches = self.get_all_by_user_and_filename(user_id, filename)
+        return max(matches, key=lambda p: p.timestamp) if matches else None
+
+    def get_all_by_user_and_filename(
+        self, user_id: str, filename: str
+    ) -> list[ProgressEntity]:
+        return self.get_all_by_user_and_filenames(user_id, [filename])
+
+    def get_all_by_user_and_filenames(
+        self, user_id: str, filenames: list[str]
+    ) -> list[ProgressEntity]:
+        wanted = set(filenames)
+        stored = self.repository.get_all_by_user_and_filenames(user_id, filenames)
+        merged = _merge(stored, self.buffer.pending_for_user(user_id))
+        return [p for p in merged if p.filename in wanted]
+
+    def upsert(self, progress: ProgressEntity) -> ProgressEntity:
+        self.buffer.put(progress)
+        return progress
+
+    def upsert_if_newer(self, progress: ProgressEntity, field: str = "timestamp") -> bool:
+        # Rejects what is already known to be stale; the flush repeats the check
+        # atomically against rows other workers may have stored since
+        current = self.get_by_user_and_document(progress.user_id, progress.document)
+        if current and getattr(current, field) > getattr(progress, field):
+            return False
+        self.buffer.put(progress, conflict_field=field)
+        return True
+
+    def upsert_many(self, progress_list: list[ProgressEntity]) -> list[ProgressEntity]:
+        for progress in progress_list:
+            self.buffer.put(progress)
+        return progress_list
+
+    def get_all_by_user(self, user_id: str) -> list[ProgressEntity]:
+        merged = _merge(self.repository.get_all_by_user(user_id), self.buffer.pending_for_user(user_id))
+        return sorted(merged, key=lambda p: p.timestamp, reverse=True)
+
+    def get_all_by_user_since(self, user_id: str, since: int, until: int) -> list[ProgressEntity]:
+        stored = self.repository.get_all_by_user_since(user_id, since, until)
+        pending = [
+            p for p in self.buffer.pending_for_user(user_id)
+            if since < p.modified_at <= until
+        ]
+        return sorted(_merge(stored, pending), key=lambda p: p.timestamp)
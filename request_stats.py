@@ -0,0 +1,135 @@
+"""Per-request accounting of time spent and database round-trips.
+
+RequestStatsMiddleware starts a RequestStats for each HTTP request and keeps
+it in a context variable, which FastAPI carries into the worker threads that
+run sync endpoints and dependencies. Repository calls (through
+TimedRepository), SQL statements and commits, and DynamoDB API calls are
+added to it as they happen, and a few named phases are timed explicitly.
+
+The totals are returned in a Server-Timing header, which browser devtools and
+most HTTP clients display, and a request that makes more than
+REQUEST_MAX_ROUND_TRIPS round-trips or takes longer than REQUEST_SLOW_MS is
+logged as one JSON line listing its calls per repository method, which makes
+N+1 patterns easy to spot.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+# Requests above either threshold are logged with their per-method call counts
+REQUEST_MAX_ROUND_TRIPS = int(os.getenv("REQUEST_MAX_ROUND_TRIPS", "25"))
+REQUEST_SLOW_MS = float(os.getenv("REQUEST_SLOW_MS", "1000"))
+
+
+@dataclass
+class RequestStats:
+    """What one request spent its time on."""
+    started: float = field(default_factory=time.perf_counter)
+    # Phase name -> seconds. Phases may overlap (auth includes its user lookup).
+    phases: dict[str, float] = field(default_factory=dict)
+    # "repository.method" -> number of calls
+    calls: Counter = field(default_factory=Counter)
+    db_seconds: float = 0.0
+    round_trips: int = 0
+
+    @property
+    def repository_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        entries = [f'db;dur={self.db_seconds * 1000:.2f};desc="{self.repository_calls} calls, {self.round_trips} round-trips"']
+        entries.extend(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items())
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current() -> Optional[RequestStats]:
+    """Stats of the request being handled, or None outside a request."""
+    return _current.get()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time the enclosed block as a named phase of the current request."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_phase(name, time.perf_counter() - start)
+
+
+def record_repository_call(name: str, seconds: float) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.calls[name] += 1
+        stats.db_seconds += seconds
+
+
+def record_round_trip(*args, **kwargs) -> None:
+    """Count one database round-trip. Accepts and ignores event hook arguments."""
+    stats = _current.get()
+    if stats is not None:
+        stats.round_trips += 1
+
+
+class RequestStatsMiddleware:
+    """Collect RequestStats for each request; add Server-Timing and log outliers."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", stats.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            elapsed_ms = (time.perf_counter() - stats.started) * 1000
+            if stats.round_trips > REQUEST_MAX_ROUND_TRIPS or elapsed_ms > REQUEST_SLOW_MS:
+                logger.warning(json.dumps({
+                    "event": "request_over_threshold",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round(elapsed_ms, 2),
+                    "db_ms": round(stats.db_seconds * 1000, 2),
+                    "round_trips": stats.round_trips,
+                    "calls": dict(stats.calls.most_common()),
+                    "phases_ms": {name: round(seconds * 1000, 2) for name, seconds in stats.phases.items()},
+                }))
@@ -32,6 +32,8 @@ class ProgressUpdate(BaseModel):
     device: str
     device_id: str
     filename: Optional[str] = None
+    # When the client recorded this position (Unix time); used by the "newest" conflict policy
+    timestamp: Optional[int] = None
 
     @field_validator('percentage')
     @classmethod
@@ -47,6 +49,13 @@ class ProgressUpdate(BaseModel):
             raise ValueError('Document hash must be 1-256 characters')
         return v
 
+    @field_validator('timestamp')
+    @classmethod
+    def validate_timestamp(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and v < 0:
+            raise ValueError('Timestamp must not be negative')
+        return v
+
 
 class ProgressResponse(BaseModel):
     document: str
@@ -58,6 +67,28 @@ class ProgressResponse(BaseModel):
     filename: Optional[str] = None
 
 
+class ProgressBatchItemResult(BaseModel):
+    """Outcome of a single record in a batch progress upload."""
+    document: str
+    status: str
+    canonical: Optional[str] = None
+
+
+class ProgressBatchResponse(BaseModel):
+    """Response for batch progress upload, in request order."""
+    results: list[ProgressBatchItemResult]
+
+
+class ProgressQueryRequest(BaseModel):
+    """Request for progress of several documents at once."""
+    documents: list[str]
+
+
+class ProgressQueryResponse(BaseModel):
+    """Progress keyed by the requested document hash. Unknown documents are omitted."""
+    progress: dict[str, ProgressResponse]
+
+
 class LinkRequest(BaseModel):
     hashes: list[str]
 
@@ -100,3 +131,14 @@ class BookLabelResponse(BaseModel):
     """Response after updating a book's label."""
     canonical_hash: str
     label: str
+
+
+class ChangesResponse(BaseModel):
+    """Progress, links and labels changed or deleted after a watermark, plus the next watermark."""
+    progress: list[ProgressResponse]
+    links: list[DocumentLinkResponse]
+    labels: list[BookLabelResponse]
+    # Document hashes whose link, and canonical hashes whose label, were deleted
+    deleted_links: list[str] = []
+    deleted_labels: list[str] = []
+    next_since: int
@@ -0,0 +1,200 @@
+"""Slow SQL statement log for the SQL backend.
+
+Engine event hooks time every statement. Statements slower than SLOW_QUERY_MS
+are logged and kept in memory with their parameters redacted to type names,
+so no user data (hashes, usernames, progress) is retained. On SQLite and
+PostgreSQL the plan of a slow SELECT is captured as well, once per distinct
+statement, with EXPLAIN QUERY PLAN or EXPLAIN (never EXPLAIN ANALYZE, so the
+statement is not run again). psycopg2 interpolates bound values into the
+statement it sends, so PostgreSQL plans show them as literals; quoted
+literals, and numbers in conditions and filters, are replaced by "?" before a
+plan is kept.
+
+GET /admin/slow-queries returns the most recent slow statements and the
+statements with the most total slow time over the last SLOW_QUERY_WINDOW
+seconds.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Statements taking at least this long are recorded. Negative disables the log.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+# Slow statements kept for the recent list and the top-N summary
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "1000"))
+# Seconds of history the top-N summary covers
+SLOW_QUERY_WINDOW = float(os.getenv("SLOW_QUERY_WINDOW", "3600"))
+
+# Distinct statements whose plan is kept
+_MAX_PLANS = 500
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAIN_PREFIX = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN "}
+# 'value' or 'it''s', with an optional ::type cast left in place
+_QUOTED_LITERAL = re.compile(r"'(?:[^']|'')*'")
+# Plan lines that compare columns with values: Index Cond, Recheck Cond, Filter, Join Filter, ...
+_PLAN_CONDITION = re.compile(r"\b(Cond|Filter):")
+# A number on its own, not part of an identifier or a $n placeholder
+_NUMERIC_LITERAL = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?(?![\w.])")
+
+
+def _redact(parameters):
+    """Replace every bound value by its type name."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _redact_plan(lines: list[str]) -> list[str]:
+    """Replace the literals of a plan by "?", keeping its shape and costs."""
+    redacted = []
+    for line in lines:
+        line = _QUOTED_LITERAL.sub("'?'", line)
+        if _PLAN_CONDITION.search(line):
+            line = _NUMERIC_LITERAL.sub("?", line)
+        redacted.append(line)
+    return redacted
+
+
+@dataclass
+class SlowQuery:
+    statement: str
+    parameters: object
+    duration_ms: float
+    recorded_at: float
+    executemany: bool = False
+    # Parameter sets of an executemany; only the types of the first are kept
+    rows: int = 1
+
+    def to_dict(self) -> dict:
+        return {
+            "statement": self.statement,
+            "parameters": self.parameters,
+            "duration_ms": round(self.duration_ms, 3),
+            "recorded_at": int(self.recorded_at),
+            "executemany": self.executemany,
+            "rows": self.rows,
+        }
+
+
+class SlowQueryLog:
+    """Recent slow statements, their plans, and rolling totals per statement."""
+
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_MS,
+        explain: bool = SLOW_QUERY_EXPLAIN,
+        size: int = SLOW_QUERY_LOG_SIZE,
+        window: float = SLOW_QUERY_WINDOW,
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.window = window
+        self._recent: deque[SlowQuery] = deque(maxlen=size)
+        self._plans: OrderedDict[str, list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def install(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        # A connection runs one statement at a time
+        conn.info["slow_query_started"] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("slow_query_started", None)
+        if started is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if self.threshold_ms < 0 or duration_ms < self.threshold_ms:
+            return
+        query = SlowQuery(
+            statement=_WHITESPACE.sub(" ", statement).strip(),
+            parameters=_redact(parameters[0] if executemany and parameters else parameters),
+            duration_ms=duration_ms,
+            recorded_at=time.time(),
+            executemany=executemany,
+            rows=len(parameters) if executemany else 1,
+        )
+        with self._lock:
+            self._recent.append(query)
+            needs_plan = self.explain and not executemany and query.statement not in self._plans
+        if needs_plan:
+            plan = self._explain(conn, statement, parameters)
+            if plan is not None:
+                with self._lock:
+                    self._plans[query.statement] = plan
+                    while len(self._plans) > _MAX_PLANS:
+                        self._plans.popitem(last=False)
+        logger.warning(json.dumps({"event": "slow_query", **query.to_dict()}))
+
+    def _explain(self, conn, statement: str, parameters) -> Optional[list[str]]:
+        prefix = _EXPLAIN_PREFIX.get(conn.dialect.name)
+        # Only SELECTs: EXPLAIN of a write is harmless, but not worth the risk of
+        # aborting the caller's PostgreSQL transaction if it fails
+        if prefix is None or not statement.lstrip().upper().startswith("SELECT"):
+            return None
+        # A cursor of its own, so the caller's result set is left untouched
+        cursor = conn.connection.cursor()
+        try:
+            return _redact_plan(self._run_explain(cursor, prefix + statement, parameters))
+        except Exception:
+            logger.debug("Could not explain slow statement", exc_info=True)
+            return None
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _run_explain(cursor, statement: str, parameters) -> list[str]:
+        cursor.execute(statement, parameters)
+        return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            queries = list(self._recent)[-limit:]
+        return [query.to_dict() for query in reversed(queries)]
+
+    def top(self, limit: int = 20) -> list[dict]:
+        """Statements with the most slow time within the window, slowest first."""
+        cutoff = time.time() - self.window
+        totals: dict[str, dict] = {}
+        with self._lock:
+            queries = [q for q in self._recent if q.recorded_at >= cutoff]
+            plans = dict(self._plans)
+        for query in queries:
+            summary = totals.setdefault(query.statement, {
+                "statement": query.statement, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+            })
+            summary["count"] += 1
+            summary["total_ms"] += query.duration_ms
+            summary["max_ms"] = max(summary["max_ms"], query.duration_ms)
+        ranked = sorted(totals.values(), key=lambda s: s["total_ms"], reverse=True)[:limit]
+        for summary in ranked:
+            summary["mean_ms"] = round(summary["total_ms"] / summary["count"], 3)
+            summary["total_ms"] = round(summary["total_ms"], 3)
+            summary["max_ms"] = round(summary["max_ms"], 3)
+            summary["plan"] = plans.get(summary["statement"])
+        return ranked
+
+    def clear(self) -> None:
+        with self._lock:
+            self._recent.clear()
+            self._plans.clear()
+
+
+slow_query_log = SlowQueryLog()
@@ -33,6 +33,33 @@ resource "aws_dynamodb_table" "progress" {
     type = "S"
   }
 
+  attribute {
+    name = "timestamp"
+    type = "N"
+  }
+
+  attribute {
+    name = "modified_at"
+    type = "N"
+  }
+
+  # Progress written before modified_at existed, found by its timestamp
+  global_secondary_index {
+    name            = "user_id-timestamp-index"
+    hash_key        = "user_id"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+
+  # Change feed (GET /syncs/changes): items written after a watermark. timestamp
+  # can be the client's (PROGRESS_CONFLICT_POLICY=newest); modified_at is the server's
+  global_secondary_index {
+    name            = "user_id-modified_at-index"
+    hash_key        = "user_id"
+    range_key       = "modified_at"
+    projection_type = "ALL"
+  }
+
   tags = {
     Name        = "${var.project_name}-progress"
     Environment = var.environment
@@ -57,6 +84,32 @@ resource "aws_dynamodb_table" "document_links" {
     type = "S"
   }
 
+  attribute {
+    name = "canonical_hash"
+    type = "S"
+  }
+
+  attribute {
+    name = "timestamp"
+    type = "N"
+  }
+
+  # Change feed (GET /syncs/changes): items updated after a watermark
+  global_secondary_index {
+    name            = "user_id-timestamp-index"
+    hash_key        = "user_id"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+
+  # Group members of a canonical hash, repointed together when groups merge
+  global_secondary_index {
+    name            = "user_id-canonical_hash-index"
+    hash_key        = "user_id"
+    range_key       = "canonical_hash"
+    projection_type = "KEYS_ONLY"
+  }
+
   tags = {
     Name        = "${var.project_name}-document-links"
     Environment = var.environment
@@ -81,9 +134,85 @@ resource "aws_dynamodb_table" "book_labels" {
     type = "S"
   }
 
+  attribute {
+    name = "timestamp"
+    type = "N"
+  }
+
+  # Change feed (GET /syncs/changes): items updated after a watermark
+  global_secondary_index {
+    name            = "user_id-timestamp-index"
+    hash_key        = "user_id"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+
   tags = {
     Name        = "${var.project_name}-book-labels"
     Environment = var.environment
     Project     = var.project_name
   }
 }
+
+# Filename index - Composite key: PK=user_id, SK=filename
+# Canonical hash of the first document synced under each filename (auto-linking)
+resource "aws_dynamodb_table" "filename_index" {
+  name         = "${var.project_name}-${var.environment}-filename-index"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "user_id"
+  range_key    = "filename"
+
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "filename"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "${var.project_name}-filename-index"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
+
+# Deleted links and labels - Composite key: PK=user_id, SK=key ("link#<hash>" or "label#<hash>")
+# Tombstones reported by the change feed
+resource "aws_dynamodb_table" "deletions" {
+  name         = "${var.project_name}-${var.environment}-deletions"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "user_id"
+  range_key    = "key"
+
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "key"
+    type = "S"
+  }
+
+  attribute {
+    name = "timestamp"
+    type = "N"
+  }
+
+  # Change feed (GET /syncs/changes): deletions after a watermark
+  global_secondary_index {
+    name            = "user_id-timestamp-index"
+    hash_key        = "user_id"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+
+  tags = {
+    Name        = "${var.project_name}-deletions"
+    Environment = var.environment
+    Project     = var.project_name
+  }
+}
@@ -41,6 +41,8 @@ resource "aws_iam_role_policy" "lambda_dynamodb" {
         Action = [
           "dynamodb:PutItem",
           "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:Query",
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem",
@@ -50,7 +52,13 @@ resource "aws_iam_role_policy" "lambda_dynamodb" {
           aws_dynamodb_table.users.arn,
           aws_dynamodb_table.progress.arn,
           aws_dynamodb_table.document_links.arn,
-          aws_dynamodb_table.book_labels.arn
+          aws_dynamodb_table.book_labels.arn,
+          aws_dynamodb_table.filename_index.arn,
+          aws_dynamodb_table.deletions.arn,
+          "${aws_dynamodb_table.progress.arn}/index/*",
+          "${aws_dynamodb_table.document_links.arn}/index/*",
+          "${aws_dynamodb_table.book_labels.arn}/index/*",
+          "${aws_dynamodb_table.deletions.arn}/index/*"
         ]
       }
     ]
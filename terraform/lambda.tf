@@ -17,6 +17,8 @@ resource "aws_lambda_function" "api" {
       DYNAMODB_PROGRESS_TABLE       = aws_dynamodb_table.progress.name
       DYNAMODB_DOCUMENT_LINKS_TABLE = aws_dynamodb_table.document_links.name
       DYNAMODB_BOOK_LABELS_TABLE    = aws_dynamodb_table.book_labels.name
+      DYNAMODB_FILENAME_INDEX_TABLE = aws_dynamodb_table.filename_index.name
+      DYNAMODB_DELETIONS_TABLE      = aws_dynamodb_table.deletions.name
       PASSWORD_SALT                 = var.password_salt
     }
   }
@@ -0,0 +1,378 @@
+"""Request tracing with nested spans, exported in the OTLP/JSON format.
+
+TracingMiddleware decides at the start of each request whether it is traced
+(head-based sampling): a request carrying a W3C traceparent header follows
+the caller's decision, any other request is traced with probability
+TRACE_SAMPLE_RATE. The default of 0 traces nothing, whatever the callers
+ask for, and an untraced request costs one context variable read per
+instrumented call.
+
+A traced request gets a root span for the request and child spans for
+authentication (user lookup and bcrypt), every repository method (with the
+backend and table), the aggregation in list_books and card rendering. Spans
+are kept in a context variable, which FastAPI carries into the worker threads
+running sync endpoints, so they nest the way the calls do.
+
+Finished spans are queued and exported in batches by a background thread,
+either appended to TRACE_FILE as one OTLP/JSON document per line (the format
+of the OpenTelemetry Collector's file exporter, rotated to TRACE_FILE.1 once
+it reaches TRACE_FILE_MAX_BYTES) or posted to an OTLP/HTTP
+collector at TRACE_OTLP_ENDPOINT. CollectorStandIn receives OTLP/HTTP exports
+for tests and local development without a collector install. When the queue
+is full, spans are dropped rather than slowing requests down.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, Optional
+
+from metrics import counter, route_template
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests traced when the caller did not decide; 0 disables tracing
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# file or otlp
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "file")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Size at which TRACE_FILE is rotated to TRACE_FILE.1, replacing the previous one; 0 never rotates
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(100 * 1024 * 1024)))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "koreader-sync")
+# Seconds between exports, and spans buffered before new ones are dropped
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "5"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "2048"))
+
+# Spans per export request
+_BATCH_SIZE = 512
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_SPAN_KIND_INTERNAL = 1
+_SPAN_KIND_SERVER = 2
+_STATUS_ERROR = 2
+
+SPANS_EXPORTED = counter("trace_spans_exported_total", "Spans handed to the trace exporter")
+SPANS_DROPPED = counter("trace_spans_dropped_total", "Spans dropped because the export queue was full or failed")
+
+
+@dataclass
+class Span:
+    """One timed operation within a trace."""
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: f"{random.getrandbits(64):016x}")
+    parent_id: Optional[str] = None
+    kind: int = _SPAN_KIND_INTERNAL
+    attributes: dict[str, Any] = field(default_factory=dict)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": _STATUS_ERROR, "message": self.error}
+        return span
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _export_request(spans: list[Span]) -> dict:
+    """An OTLP ExportTraceServiceRequest holding the given spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": TRACE_SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "koreader-sync"},
+                "spans": [span.to_otlp() for span in spans],
+            }],
+        }]
+    }
+
+
+class FileExporter:
+    """Append each batch to a file as one OTLP/JSON line, keeping one rotated file."""
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def export(self, spans: list[Span]) -> None:
+        try:
+            full = self.max_bytes and os.path.getsize(self.path) >= self.max_bytes
+        except OSError:
+            full = False
+        if full:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(_export_request(spans), separators=(",", ":")) + "\n")
+
+
+class OTLPExporter:
+    """POST each batch to an OTLP/HTTP collector in the JSON encoding."""
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, spans: list[Span]) -> None:
+        import urllib.request
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(_export_request(spans)).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def create_exporter():
+    """Exporter selected by TRACE_EXPORTER."""
+    if TRACE_EXPORTER == "otlp":
+        return OTLPExporter()
+    return FileExporter()
+
+
+class Tracer:
+    """Sampling decisions, the span queue and the thread that exports it."""
+
+    def __init__(
+        self,
+        exporter,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        export_interval: float = TRACE_EXPORT_INTERVAL,
+        queue_size: int = TRACE_QUEUE_SIZE,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.export_interval = export_interval
+        self.queue_size = queue_size
+        self._queue: list[Span] = []
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def should_sample(self) -> bool:
+        return self.enabled and random.random() < self.sample_rate
+
+    def finish(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                SPANS_DROPPED.inc()
+                return
+            self._queue.append(span)
+            full = len(self._queue) >= _BATCH_SIZE
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.export_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Export every queued span now."""
+        with self._export_lock:
+            with self._lock:
+                spans, self._queue = self._queue, []
+            for start in range(0, len(spans), _BATCH_SIZE):
+                batch = spans[start:start + _BATCH_SIZE]
+                try:
+                    self.exporter.export(batch)
+                    SPANS_EXPORTED.inc(len(batch))
+                except Exception:
+                    SPANS_DROPPED.inc(len(batch))
+                    logger.warning("Could not export %d spans", len(batch), exc_info=True)
+
+
+tracer = Tracer(create_exporter())
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Innermost open span of the current request, or None if it is not traced."""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Trace the enclosed block as a child of the current span, if there is one."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent_id=parent.span_id, attributes=attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        tracer.finish(child)
+
+
+class TracingMiddleware:
+    """Open the root span of sampled requests and propagate W3C trace context."""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _route(scope) -> str:
+        return route_template(scope) or scope["path"]
+
+    def _root_span(self, scope) -> Optional[Span]:
+        traceparent = next((v for k, v in scope["headers"] if k == b"traceparent"), None)
+        match = _TRACEPARENT.match(traceparent.decode("latin-1").strip().lower()) if traceparent else None
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+        elif tracer.should_sample():
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        else:
+            return None
+        return Span(
+            f"{scope['method']} {scope['path']}",
+            trace_id,
+            parent_id=parent_id,
+            kind=_SPAN_KIND_SERVER,
+            attributes={"http.request.method": scope["method"], "url.path": scope["path"]},
+        )
+
+    async def __call__(self, scope, receive, send):
+        # With tracing off, a caller's traceparent cannot turn it on
+        root = self._root_span(scope) if scope["type"] == "http" and tracer.enabled else None
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+        token = _current.set(root)
+
+        async def send_with_traceparent(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    root.error = f"HTTP {message['status']}"
+                headers = list(message.get("headers", []))
+                headers.append((b"traceparent", f"00-{root.trace_id}-{root.span_id}-01".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_traceparent)
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            route = self._route(scope)
+            root.name = f"{scope['method']} {route}"
+            root.set_attribute("http.route", route)
+            tracer.finish(root)
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self.send_response(400)
+            self.end_headers()
+            return
+        spans = [
+            span
+            for resource_spans in request.get("resourceSpans", [])
+            for scope_spans in resource_spans.get("scopeSpans", [])
+            for span in scope_spans.get("spans", [])
+        ]
+        with self.server.lock:
+            self.server.received.extend(spans)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CollectorStandIn(ThreadingHTTPServer):
+    """Minimal OTLP/HTTP collector keeping the spans it receives in `received`.
+
+    Accepts JSON-encoded exports on any path. Port 0 picks a free port; see `url`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _CollectorHandler)
+        self.received: list[dict] = []
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/traces"
+
+    def spans(self) -> list[dict]:
+        with self.lock:
+            return list(self.received)
+
+    def start(self) -> "CollectorStandIn":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()